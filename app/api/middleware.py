@@ -9,6 +9,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.base import BaseHTTPMiddleware
 
 from ..core.config import settings
+from ..core.db_metrics import start_query_stats, stop_query_stats
 from ..core.exceptions import create_http_exception, AppException
 
 # Настройка логирования
@@ -25,8 +26,17 @@ class LoggingMiddleware(BaseHTTPMiddleware):
         # Логируем входящий запрос
         logger.info(f"Входящий запрос: {request.method} {request.url}")
         
+        # Статистика SQL-запросов на время обработки
+        stats = token = None
+        if settings.db_instrumentation:
+            stats, token = start_query_stats(settings.db_slow_query_ms / 1000)
+        
         # Обрабатываем запрос
-        response = await call_next(request)
+        try:
+            response = await call_next(request)
+        finally:
+            if token is not None:
+                stop_query_stats(token)
         
         # Вычисляем время обработки
         process_time = time.time() - start_time
@@ -40,7 +50,22 @@ class LoggingMiddleware(BaseHTTPMiddleware):
         # Добавляем заголовок с временем обработки
         response.headers["X-Process-Time"] = str(process_time)
         
+        if stats is not None:
+            self._report_query_stats(request, response, stats)
+        
         return response
+    
+    @staticmethod
+    def _report_query_stats(request: Request, response: Response, stats) -> None:
+        """Заголовки X-DB-* и предупреждения о медленных и повторяющихся запросах"""
+        response.headers["X-DB-Query-Count"] = str(stats.count)
+        response.headers["X-DB-Time"] = str(stats.total_time)
+        response.headers["X-DB-Slow-Queries"] = str(len(stats.slow))
+        
+        for duration, shape in stats.slow:
+            logger.warning(f"Медленный запрос ({duration * 1000:.1f} мс) в {request.method} {request.url.path}: {shape}")
+        for shape, count in stats.repeated(settings.db_repeated_query_threshold):
+            logger.warning(f"Возможный N+1: запрос выполнен {count} раз в {request.method} {request.url.path}: {shape}")
 
 
 class ErrorHandlingMiddleware(BaseHTTPMiddleware):
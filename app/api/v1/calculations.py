@@ -1,10 +1,18 @@
 """
 API роуты для расчетов
 """
-from fastapi import APIRouter, Depends, HTTPException
-from typing import List, Dict, Any
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from typing import List, Dict, Any, Optional
 from ..deps import get_calculation_service
-from ...models.calculation import CalculationCreate, CalculationUpdate, CalculationResponse
+from ...models.calculation import (
+    CalculationCreate,
+    CalculationUpdate,
+    CalculationResponse,
+    EvaluateRequest,
+    EvaluateResponse,
+    RepriceSimulationRequest,
+    RepriceSimulationResponse,
+)
 from ...services.calculation_service import CalculationService
 from ...core.exceptions import NotFoundError, create_http_exception
 
@@ -13,10 +21,45 @@ router = APIRouter()
 
 @router.get("/", response_model=List[Dict[str, Any]])
 async def get_calculations(
+    response: Response,
+    skip: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Размер страницы (по умолчанию - все расчеты)"),
+    search: Optional[str] = Query(None, description="Поиск по названию"),
+    sort: str = Query("id", description="Сортировка: id, created_at, updated_at, name, total_price"),
+    order: str = Query("asc", description="Направление сортировки: asc, desc"),
     calculation_service: CalculationService = Depends(get_calculation_service)
 ):
-    """Получение списка расчетов (краткая информация)"""
-    return await calculation_service.get_calculations()
+    """Получение списка расчетов (краткая информация); всего записей - в заголовке X-Total-Count"""
+    try:
+        items, total = await calculation_service.get_calculations(skip, limit, search, sort, order)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    response.headers["X-Total-Count"] = str(total)
+    return items
+
+
+@router.post("/simulate-reprice", response_model=RepriceSimulationResponse)
+async def simulate_reprice(
+    request: RepriceSimulationRequest,
+    calculation_service: CalculationService = Depends(get_calculation_service)
+):
+    """
+    Моделирование переоценки: новые итоги и изменения расчетов при
+    гипотетических ценах на марки металла (расчеты не изменяются)
+    """
+    return await calculation_service.simulate_reprice(request)
+
+
+@router.post("/evaluate", response_model=EvaluateResponse)
+async def evaluate_positions(
+    request: EvaluateRequest,
+    calculation_service: CalculationService = Depends(get_calculation_service)
+):
+    """
+    Пакетный расчет веса и стоимости позиций-сортаментов по форме, размерам
+    и марке металла (ошибки возвращаются по каждой позиции)
+    """
+    return await calculation_service.evaluate_positions(request)
 
 
 @router.get("/{calculation_id}", response_model=Dict[str, Any])
@@ -2,16 +2,19 @@
 API endpoints для работы с контактами (contacts)
 """
 from typing import Optional, List
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from ...core.security import get_current_user
+from ...core.db_executor import AsyncServiceProxy
 from ...services.contact_service import ContactService
-from ...schemas.contact import ContactCreate, ContactUpdate, ContactResponse, ContactListResponse
-from ...schemas.common import PaginatedResponse
+from ...schemas.contact import (
+    ContactCreate, ContactUpdate, ContactResponse, ContactListResponse, ContactLookupResponse,
+)
+from ...schemas.common import PaginatedResponse, DuplicateListResponse, MergeRequest
 
 
 router = APIRouter(prefix="/contacts", tags=["Contacts"])
 
-contact_service = ContactService()
+contact_service = AsyncServiceProxy(ContactService())
 
 
 @router.get("", response_model=ContactListResponse)
@@ -23,34 +26,91 @@ async def get_contacts(
     tags: Optional[List[str]] = None,
     search: Optional[str] = None,
     is_active: Optional[bool] = None,
+    cursor: Optional[str] = Query(None, description="Курсор следующей страницы (skip игнорируется)"),
+    sort: str = Query("updated_at", description="Сортировка: updated_at, created_at"),
+    order: str = Query("desc", description="Направление сортировки: asc, desc"),
     current_user: dict = Depends(get_current_user),
 ):
     """Получает список контактов с фильтрацией"""
-    contacts, total = contact_service.get_all(
-        skip=skip,
-        limit=limit,
-        company_id=company_id,
-        responsible_user_id=responsible_user_id,
-        tags=tags,
-        search=search,
-        is_active=is_active,
-    )
+    try:
+        contacts, total, next_cursor = await contact_service.get_page(
+            skip=skip,
+            limit=limit,
+            company_id=company_id,
+            responsible_user_id=responsible_user_id,
+            tags=tags,
+            search=search,
+            is_active=is_active,
+            cursor=cursor,
+            sort=sort,
+            order=order,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
     
     return ContactListResponse(
         data=[ContactResponse(**c) for c in contacts],
         total=total,
         skip=skip,
         limit=limit,
+        next_cursor=next_cursor,
     )
 
 
+@router.get("/lookup", response_model=ContactLookupResponse)
+async def lookup_contact(
+    phone: Optional[str] = Query(None, max_length=64, description="Телефон в любом формате"),
+    email: Optional[str] = Query(None, max_length=254, description="Email"),
+    current_user: dict = Depends(get_current_user),
+):
+    """
+    Обратный поиск контакта и компании по телефону или email
+    
+    Для интеграций телефонии и почты: точное совпадение по
+    нормализованному значению через индекс, с кэшем в памяти процесса.
+    """
+    try:
+        result = await contact_service.lookup(phone=phone, email=email)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    
+    return ContactLookupResponse(**result)
+
+
+@router.get("/duplicates", response_model=DuplicateListResponse)
+async def get_contact_duplicates(
+    min_score: float = Query(0.6, ge=0, le=1, description="Минимальная оценка сходства пары"),
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: dict = Depends(get_current_user),
+):
+    """Пары вероятных дублей контактов"""
+    candidates, total = await contact_service.find_duplicates(min_score=min_score, limit=limit)
+    return DuplicateListResponse(data=candidates, total=total)
+
+
+@router.post("/{contact_id}/merge", response_model=ContactResponse)
+async def merge_contacts(
+    contact_id: int,
+    merge_data: MergeRequest,
+    current_user: dict = Depends(get_current_user),
+):
+    """Сливает контакты source_ids в контакт contact_id (исходные контакты удаляются)"""
+    try:
+        contact = await contact_service.merge(contact_id, merge_data.source_ids, user_id=current_user['id'])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not contact:
+        raise HTTPException(status_code=404, detail="Контакт не найден")
+    return ContactResponse(**contact)
+
+
 @router.get("/{contact_id}", response_model=ContactResponse)
 async def get_contact(
     contact_id: int,
     current_user: dict = Depends(get_current_user),
 ):
     """Получает контакт по ID"""
-    contact = contact_service.get_by_id(contact_id)
+    contact = await contact_service.get_by_id(contact_id)
     if not contact:
         raise HTTPException(status_code=404, detail="Контакт не найден")
     
@@ -63,7 +123,7 @@ async def create_contact(
     current_user: dict = Depends(get_current_user),
 ):
     """Создаёт новый контакт"""
-    contact = contact_service.create(contact_data.dict(), user_id=current_user['id'])
+    contact = await contact_service.create(contact_data.dict(), user_id=current_user['id'])
     return ContactResponse(**contact)
 
 
@@ -74,7 +134,7 @@ async def update_contact(
     current_user: dict = Depends(get_current_user),
 ):
     """Обновляет контакт"""
-    contact = contact_service.update(
+    contact = await contact_service.update(
         contact_id,
         contact_data.dict(exclude_unset=True),
         user_id=current_user['id'],
@@ -90,7 +150,7 @@ async def delete_contact(
     current_user: dict = Depends(get_current_user),
 ):
     """Удаляет контакт"""
-    success = contact_service.delete(contact_id)
+    success = await contact_service.delete(contact_id)
     if not success:
         raise HTTPException(status_code=404, detail="Контакт не найден")
 
@@ -102,7 +162,7 @@ async def add_communication(
     current_user: dict = Depends(get_current_user),
 ):
     """Добавляет коммуникацию к контакту"""
-    contact = contact_service.add_communication(contact_id, communication)
+    contact = await contact_service.add_communication(contact_id, communication)
     if not contact:
         raise HTTPException(status_code=404, detail="Контакт не найден")
     return ContactResponse(**contact)
@@ -115,7 +175,7 @@ async def remove_communication(
     current_user: dict = Depends(get_current_user),
 ):
     """Удаляет коммуникацию из контакта"""
-    contact = contact_service.remove_communication(contact_id, comm_id)
+    contact = await contact_service.remove_communication(contact_id, comm_id)
     if not contact:
         raise HTTPException(status_code=404, detail="Контакт не найден или коммуникация не найдена")
 
@@ -131,7 +191,7 @@ async def add_tag(
     if not tag_name:
         raise HTTPException(status_code=400, detail="Не указано имя тега")
     
-    contact = contact_service.add_tag(contact_id, tag_name)
+    contact = await contact_service.add_tag(contact_id, tag_name)
     if not contact:
         raise HTTPException(status_code=404, detail="Контакт не найден")
     return ContactResponse(**contact)
@@ -144,7 +204,7 @@ async def remove_tag(
     current_user: dict = Depends(get_current_user),
 ):
     """Удаляет тег из контакта"""
-    contact = contact_service.remove_tag(contact_id, tag_name)
+    contact = await contact_service.remove_tag(contact_id, tag_name)
     if not contact:
         raise HTTPException(status_code=404, detail="Контакт не найден")
 
@@ -2,8 +2,9 @@
 API endpoints для работы с клиентами (customers)
 """
 from typing import Optional
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query
 from ...core.security import get_current_user
+from ...core.db_executor import AsyncServiceProxy
 from ...services.customer_service import CustomerService
 from ...services.file_service import FileService
 from ...schemas.customer import (
@@ -13,8 +14,9 @@ from ...schemas.customer import (
     CustomerListResponse,
     CustomerFileSchema,
     CustomerMetaResponse,
+    CustomerOverviewResponse,
 )
-from ...schemas.common import PaginatedResponse
+from ...schemas.common import PaginatedResponse, DuplicateListResponse, MergeRequest
 from ...core.database import db_manager
 from ...utils.enums import FileType
 from ...utils.customer_rules import get_customer_type_meta
@@ -22,7 +24,7 @@ from ...utils.customer_rules import get_customer_type_meta
 
 router = APIRouter(prefix="/customers", tags=["Customers"])
 
-customer_service = CustomerService()
+customer_service = AsyncServiceProxy(CustomerService())
 file_service = FileService()
 
 
@@ -33,22 +35,32 @@ async def get_customers(
     customer_type: Optional[int] = None,
     search: Optional[str] = None,
     is_active: Optional[bool] = None,
+    cursor: Optional[str] = Query(None, description="Курсор следующей страницы (skip игнорируется)"),
+    sort: str = Query("created_at", description="Сортировка: created_at, updated_at"),
+    order: str = Query("desc", description="Направление сортировки: asc, desc"),
     current_user: dict = Depends(get_current_user),
 ):
     """Получает список клиентов с фильтрацией"""
-    customers, total = customer_service.get_all(
-        skip=skip,
-        limit=limit,
-        customer_type=customer_type,
-        search=search,
-        is_active=is_active,
-    )
+    try:
+        customers, total, next_cursor = await customer_service.get_page(
+            skip=skip,
+            limit=limit,
+            customer_type=customer_type,
+            search=search,
+            is_active=is_active,
+            cursor=cursor,
+            sort=sort,
+            order=order,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
     
     return CustomerListResponse(
         data=[CustomerResponse(**c) for c in customers],
         total=total,
         skip=skip,
         limit=limit,
+        next_cursor=next_cursor,
     )
 
 
@@ -58,19 +70,64 @@ async def get_customer_meta():
     return CustomerMetaResponse(types=get_customer_type_meta())
 
 
+@router.get("/duplicates", response_model=DuplicateListResponse)
+async def get_customer_duplicates(
+    min_score: float = Query(0.6, ge=0, le=1, description="Минимальная оценка сходства пары"),
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: dict = Depends(get_current_user),
+):
+    """Пары вероятных дублей клиентов"""
+    candidates, total = await customer_service.find_duplicates(min_score=min_score, limit=limit)
+    return DuplicateListResponse(data=candidates, total=total)
+
+
+@router.post("/{customer_id}/merge", response_model=CustomerResponse)
+async def merge_customers(
+    customer_id: int,
+    merge_data: MergeRequest,
+    current_user: dict = Depends(get_current_user),
+):
+    """Сливает клиентов source_ids в клиента customer_id (исходные клиенты удаляются)"""
+    try:
+        customer = await customer_service.merge(customer_id, merge_data.source_ids, user_id=current_user['id'])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not customer:
+        raise HTTPException(status_code=404, detail="Клиент не найден")
+    return CustomerResponse(**customer)
+
+
 @router.get("/{customer_id}", response_model=CustomerResponse)
 async def get_customer(
     customer_id: int,
     current_user: dict = Depends(get_current_user),
 ):
     """Получает клиента по ID"""
-    customer = customer_service.get_by_id(customer_id)
+    customer = await customer_service.get_by_id(customer_id)
     if not customer:
         raise HTTPException(status_code=404, detail="Клиент не найден")
     
     return CustomerResponse(**customer)
 
 
+@router.get("/{customer_id}/overview", response_model=CustomerOverviewResponse)
+async def get_customer_overview(
+    customer_id: int,
+    deals_per_stage: int = Query(20, ge=1, le=100, description="Сколько последних сделок показывать на стадии"),
+    activity_limit: int = Query(20, ge=1, le=100, description="Сколько последних событий показывать"),
+    current_user: dict = Depends(get_current_user),
+):
+    """Карточка клиента: контакты, сделки по стадиям, итоги и последние события"""
+    overview = await customer_service.get_overview(
+        customer_id,
+        deals_per_stage=deals_per_stage,
+        activity_limit=activity_limit,
+    )
+    if not overview:
+        raise HTTPException(status_code=404, detail="Клиент не найден")
+    return CustomerOverviewResponse(**overview)
+
+
 @router.post("", response_model=CustomerResponse, status_code=201)
 async def create_customer(
     customer_data: CustomerCreate,
@@ -78,7 +135,7 @@ async def create_customer(
 ):
     """Создаёт нового клиента"""
     try:
-        customer = customer_service.create(customer_data.dict(), user_id=current_user['id'])
+        customer = await customer_service.create(customer_data.dict(), user_id=current_user['id'])
         return CustomerResponse(**customer)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -92,7 +149,7 @@ async def update_customer(
 ):
     """Обновляет клиента"""
     try:
-        customer = customer_service.update(
+        customer = await customer_service.update(
             customer_id,
             customer_data.dict(exclude_unset=True),
             user_id=current_user['id'],
@@ -111,7 +168,7 @@ async def delete_customer(
     current_user: dict = Depends(get_current_user),
 ):
     """Удаляет клиента (soft delete по умолчанию)"""
-    success = customer_service.delete(customer_id, soft=soft)
+    success = await customer_service.delete(customer_id, soft=soft)
     if not success:
         raise HTTPException(status_code=404, detail="Клиент не найден")
 
@@ -124,7 +181,7 @@ async def upload_customer_file(
     current_user: dict = Depends(get_current_user),
 ):
     """Загружает файл для клиента"""
-    customer = customer_service.get_by_id(customer_id)
+    customer = await customer_service.get_by_id(customer_id)
     if not customer:
         raise HTTPException(status_code=404, detail="Клиент не найден")
     
@@ -134,7 +191,7 @@ async def upload_customer_file(
         raise HTTPException(status_code=400, detail=f"Некорректный тип файла: {file_type}")
     
     saved = file_service.save_upload_file(file, f"customers/{customer_id}")
-    customer_file = customer_service.add_file(
+    customer_file = await customer_service.add_file(
         customer_id,
         saved["file_name"],
         saved["file_path"],
@@ -154,7 +211,7 @@ async def get_customer_files(
     current_user: dict = Depends(get_current_user),
 ):
     """Получает список файлов клиента"""
-    customer = customer_service.get_by_id(customer_id)
+    customer = await customer_service.get_by_id(customer_id)
     if not customer:
         raise HTTPException(status_code=404, detail="Клиент не найден")
     
@@ -168,11 +225,11 @@ async def delete_customer_file(
     current_user: dict = Depends(get_current_user),
 ):
     """Удаляет файл клиента"""
-    customer = customer_service.get_by_id(customer_id)
+    customer = await customer_service.get_by_id(customer_id)
     if not customer:
         raise HTTPException(status_code=404, detail="Клиент не найден")
     
-    file_record = customer_service.delete_file(customer_id, file_id)
+    file_record = await customer_service.delete_file(customer_id, file_id)
     if not file_record:
         raise HTTPException(status_code=404, detail="Файл не найден")
     file_service.delete_file(file_record.get('file_path'))
@@ -1,16 +1,18 @@
 """
 API endpoints для работы со сделками (deals)
 """
-from typing import Optional
+from typing import List, Optional
 from datetime import date
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query
+from fastapi.responses import JSONResponse
 from ...core.security import get_current_user
+from ...core.db_executor import AsyncServiceProxy
 from ...services.deal_service import DealService
 from ...services.file_service import FileService
 from ...schemas.deal import (
     DealCreate, DealUpdate, DealResponse, DealListResponse,
     DealProductResponse, DealFileResponse, DealCommentResponse, DealHistoryResponse,
-    DealParticipantResponse,
+    DealParticipantResponse, DealSearchHit, DealSearchResponse,
 )
 from ...schemas.common import PaginatedResponse
 from ...utils.enums import FileType
@@ -18,10 +20,17 @@ from ...utils.enums import FileType
 
 router = APIRouter(prefix="/deals", tags=["Deals"])
 
-deal_service = DealService()
+deal_service = AsyncServiceProxy(DealService())
 file_service = FileService()
 
 
+def _split_csv(value: Optional[str]) -> Optional[List[str]]:
+    """Разбирает параметр вида "a,b,c" в список (None - параметр не задан)"""
+    if value is None:
+        return None
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
 @router.get("", response_model=DealListResponse)
 async def get_deals(
     skip: int = 0,
@@ -34,27 +43,93 @@ async def get_deals(
     is_closed: Optional[bool] = None,
     date_from: Optional[date] = None,
     date_to: Optional[date] = None,
+    fields: Optional[str] = Query(
+        None,
+        description="Колонки сделки через запятую (по умолчанию - краткая проекция)",
+    ),
+    include: Optional[str] = Query(
+        None,
+        description="Связи через запятую: funnel, stage, company, primary_contact, "
+                    "responsible_user, products, files, comments, participants, history",
+    ),
+    cursor: Optional[str] = Query(None, description="Курсор следующей страницы (skip игнорируется)"),
+    sort: str = Query("created_at", description="Сортировка: created_at, updated_at, amount, close_date"),
+    order: str = Query("desc", description="Направление сортировки: asc, desc"),
     current_user: dict = Depends(get_current_user),
 ):
-    """Получает список сделок с фильтрацией"""
-    deals, total = deal_service.get_all(
+    """
+    Получает список сделок с фильтрацией
+    
+    Если задан fields или include, возвращается разреженная выборка:
+    запрошенные колонки (по умолчанию - краткая проекция для канбана)
+    и только запрошенные связи, без валидации через DealResponse.
+    
+    Для глубоких страниц используйте next_cursor из ответа вместо skip.
+    """
+    sparse = fields is not None or include is not None
+    try:
+        deals, total, next_cursor = await deal_service.get_page(
+            skip=skip,
+            limit=limit,
+            funnel_id=funnel_id,
+            stage_id=stage_id,
+            company_id=company_id,
+            responsible_user_id=responsible_user_id,
+            primary_contact_id=primary_contact_id,
+            is_closed=is_closed,
+            date_from=date_from,
+            date_to=date_to,
+            fields=_split_csv(fields),
+            include=_split_csv(include),
+            cursor=cursor,
+            sort=sort,
+            order=order,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    
+    if sparse:
+        return JSONResponse(content={
+            "data": deals,
+            "total": total,
+            "skip": skip,
+            "limit": limit,
+            "next_cursor": next_cursor,
+        })
+    
+    return DealListResponse(
+        data=[DealResponse(**d) for d in deals],
+        total=total,
         skip=skip,
         limit=limit,
-        funnel_id=funnel_id,
-        stage_id=stage_id,
-        company_id=company_id,
-        responsible_user_id=responsible_user_id,
-        primary_contact_id=primary_contact_id,
-        is_closed=is_closed,
-        date_from=date_from,
-        date_to=date_to,
+        next_cursor=next_cursor,
     )
+
+
+@router.get("/search", response_model=DealSearchResponse)
+async def search_deals(
+    q: str = Query(..., min_length=1, max_length=200, description="Поисковый запрос (слова ищутся по префиксу)"),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+    current_user: dict = Depends(get_current_user),
+):
+    """
+    Полнотекстовый поиск по названию и описанию сделок, комментариям и товарам
     
-    return DealListResponse(
-        data=[DealResponse(**d) for d in deals],
+    Результаты отсортированы по релевантности; для каждой сделки
+    возвращается фрагмент лучшего совпадения.
+    """
+    try:
+        hits, total, capped = await deal_service.search(q, skip=skip, limit=limit)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    
+    return DealSearchResponse(
+        data=[DealSearchHit(**hit) for hit in hits],
         total=total,
         skip=skip,
         limit=limit,
+        total_capped=capped,
     )
 
 
@@ -64,7 +139,7 @@ async def get_deal(
     current_user: dict = Depends(get_current_user),
 ):
     """Получает сделку по ID"""
-    deal = deal_service.get_by_id(deal_id)
+    deal = await deal_service.get_by_id(deal_id)
     if not deal:
         raise HTTPException(status_code=404, detail="Сделка не найдена")
     
@@ -77,7 +152,7 @@ async def create_deal(
     current_user: dict = Depends(get_current_user),
 ):
     """Создаёт новую сделку"""
-    deal = deal_service.create(deal_data.dict(), user_id=current_user['id'])
+    deal = await deal_service.create(deal_data.dict(), user_id=current_user['id'])
     return DealResponse(**deal)
 
 
@@ -88,7 +163,7 @@ async def update_deal(
     current_user: dict = Depends(get_current_user),
 ):
     """Обновляет сделку"""
-    deal = deal_service.update(
+    deal = await deal_service.update(
         deal_id,
         deal_data.dict(exclude_unset=True),
         user_id=current_user['id'],
@@ -109,7 +184,7 @@ async def move_deal_to_stage(
     if not stage_id:
         raise HTTPException(status_code=400, detail="Не указан stage_id")
     
-    deal = deal_service.move_to_stage(deal_id, stage_id, current_user['id'])
+    deal = await deal_service.move_to_stage(deal_id, stage_id, current_user['id'])
     if not deal:
         raise HTTPException(status_code=404, detail="Сделка не найдена")
     return DealResponse(**deal)
@@ -121,7 +196,7 @@ async def delete_deal(
     current_user: dict = Depends(get_current_user),
 ):
     """Удаляет сделку"""
-    success = deal_service.delete(deal_id, current_user['id'])
+    success = await deal_service.delete(deal_id, current_user['id'])
     if not success:
         raise HTTPException(status_code=404, detail="Сделка не найдена")
 
@@ -133,11 +208,11 @@ async def add_deal_product(
     current_user: dict = Depends(get_current_user),
 ):
     """Добавляет товар к сделке"""
-    deal = deal_service.get_by_id(deal_id)
+    deal = await deal_service.get_by_id(deal_id)
     if not deal:
         raise HTTPException(status_code=404, detail="Сделка не найдена")
     
-    product = deal_service.add_product(deal_id, product_data, current_user['id'])
+    product = await deal_service.add_product(deal_id, product_data, current_user['id'])
     return DealProductResponse(**product)
 
 
@@ -147,11 +222,11 @@ async def get_deal_products(
     current_user: dict = Depends(get_current_user),
 ):
     """Получает список товаров сделки"""
-    deal = deal_service.get_by_id(deal_id)
+    deal = await deal_service.get_by_id(deal_id)
     if not deal:
         raise HTTPException(status_code=404, detail="Сделка не найдена")
     
-    products = deal_service.get_products(deal_id)
+    products = await deal_service.get_products(deal_id)
     return [DealProductResponse(**p) for p in products]
 
 
@@ -162,7 +237,7 @@ async def remove_deal_product(
     current_user: dict = Depends(get_current_user),
 ):
     """Удаляет товар из сделки"""
-    success = deal_service.remove_product(deal_id, product_id)
+    success = await deal_service.remove_product(deal_id, product_id)
     if not success:
         raise HTTPException(status_code=404, detail="Сделка или товар не найдены")
 
@@ -175,7 +250,7 @@ async def upload_deal_file(
     current_user: dict = Depends(get_current_user),
 ):
     """Загружает файл/КП к сделке"""
-    deal = deal_service.get_by_id(deal_id)
+    deal = await deal_service.get_by_id(deal_id)
     if not deal:
         raise HTTPException(status_code=404, detail="Сделка не найдена")
     
@@ -185,7 +260,7 @@ async def upload_deal_file(
         raise HTTPException(status_code=400, detail=f"Некорректный тип файла: {file_type}")
     
     saved_file = file_service.save_upload_file(file, f"deals/{deal_id}")
-    deal_file = deal_service.upload_file(
+    deal_file = await deal_service.upload_file(
         deal_id=deal_id,
         file_name=saved_file["file_name"],
         file_path=saved_file["file_path"],
@@ -203,11 +278,11 @@ async def get_deal_files(
     current_user: dict = Depends(get_current_user),
 ):
     """Получает список файлов сделки"""
-    deal = deal_service.get_by_id(deal_id)
+    deal = await deal_service.get_by_id(deal_id)
     if not deal:
         raise HTTPException(status_code=404, detail="Сделка не найдена")
     
-    files = deal_service.get_files(deal_id)
+    files = await deal_service.get_files(deal_id)
     return [DealFileResponse(**f) for f in files]
 
 
@@ -218,9 +293,9 @@ async def delete_deal_file(
     current_user: dict = Depends(get_current_user),
 ):
     """Удаляет файл сделки"""
-    deal_files = deal_service.get_files(deal_id)
+    deal_files = await deal_service.get_files(deal_id)
     file_record = next((f for f in deal_files if f.get('id') == file_id), None)
-    success = deal_service.delete_file(deal_id, file_id)
+    success = await deal_service.delete_file(deal_id, file_id)
     if not success:
         raise HTTPException(status_code=404, detail="Сделка или файл не найдены")
     if file_record:
@@ -234,7 +309,7 @@ async def add_deal_comment(
     current_user: dict = Depends(get_current_user),
 ):
     """Добавляет комментарий к сделке"""
-    deal = deal_service.get_by_id(deal_id)
+    deal = await deal_service.get_by_id(deal_id)
     if not deal:
         raise HTTPException(status_code=404, detail="Сделка не найдена")
     
@@ -242,7 +317,7 @@ async def add_deal_comment(
     if not text:
         raise HTTPException(status_code=400, detail="Не указан текст комментария")
     
-    comment = deal_service.add_comment(
+    comment = await deal_service.add_comment(
         deal_id,
         text,
         current_user['id'],
@@ -257,11 +332,11 @@ async def get_deal_comments(
     current_user: dict = Depends(get_current_user),
 ):
     """Получает список комментариев сделки"""
-    deal = deal_service.get_by_id(deal_id)
+    deal = await deal_service.get_by_id(deal_id)
     if not deal:
         raise HTTPException(status_code=404, detail="Сделка не найдена")
     
-    comments = deal_service.get_comments(deal_id)
+    comments = await deal_service.get_comments(deal_id)
     return [DealCommentResponse(**c) for c in comments]
 
 
@@ -272,7 +347,7 @@ async def delete_deal_comment(
     current_user: dict = Depends(get_current_user),
 ):
     """Удаляет комментарий из сделки"""
-    success = deal_service.delete_comment(deal_id, comment_id)
+    success = await deal_service.delete_comment(deal_id, comment_id)
     if not success:
         raise HTTPException(status_code=404, detail="Сделка или комментарий не найдены")
 
@@ -283,11 +358,11 @@ async def get_deal_history(
     current_user: dict = Depends(get_current_user),
 ):
     """Получает историю изменений сделки"""
-    deal = deal_service.get_by_id(deal_id)
+    deal = await deal_service.get_by_id(deal_id)
     if not deal:
         raise HTTPException(status_code=404, detail="Сделка не найдена")
     
-    history = deal_service.get_history(deal_id)
+    history = await deal_service.get_history(deal_id)
     return [DealHistoryResponse(**h) for h in history]
 
 
@@ -297,10 +372,10 @@ async def get_deal_participants(
     current_user: dict = Depends(get_current_user),
 ):
     """Возвращает участников сделки"""
-    deal = deal_service.get_by_id(deal_id)
+    deal = await deal_service.get_by_id(deal_id)
     if not deal:
         raise HTTPException(status_code=404, detail="Сделка не найдена")
-    participants = deal_service.get_participants(deal_id)
+    participants = await deal_service.get_participants(deal_id)
     return [DealParticipantResponse(**p) for p in participants]
 
 
@@ -311,12 +386,12 @@ async def add_deal_participant(
     current_user: dict = Depends(get_current_user),
 ):
     """Добавляет участника к сделке"""
-    deal = deal_service.get_by_id(deal_id)
+    deal = await deal_service.get_by_id(deal_id)
     if not deal:
         raise HTTPException(status_code=404, detail="Сделка не найдена")
     
     try:
-        participant = deal_service.add_participant(
+        participant = await deal_service.add_participant(
             deal_id,
             participant_data.get('contact_id'),
             participant_data.get('user_id'),
@@ -334,7 +409,7 @@ async def remove_deal_participant(
     current_user: dict = Depends(get_current_user),
 ):
     """Удаляет участника из сделки"""
-    success = deal_service.remove_participant(deal_id, participant_id)
+    success = await deal_service.remove_participant(deal_id, participant_id)
     if not success:
         raise HTTPException(status_code=404, detail="Сделка или участник не найдены")
 
@@ -1,19 +1,22 @@
 """
 API endpoints для работы с воронками (funnels)
 """
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from typing import List
 from ...core.security import get_current_user
+from ...core.db_executor import AsyncServiceProxy
 from ...services.funnel_service import FunnelService
+from ...services.deal_service import DealService
 from ...schemas.funnel import (
-    FunnelCreate, FunnelUpdate, FunnelResponse,
+    FunnelCreate, FunnelUpdate, FunnelResponse, FunnelBoardResponse,
     StageCreate, StageUpdate, StageReorderRequest,
 )
 
 
 router = APIRouter(prefix="/funnels", tags=["Funnels"])
 
-funnel_service = FunnelService()
+funnel_service = AsyncServiceProxy(FunnelService())
+deal_service = AsyncServiceProxy(DealService())
 
 
 @router.get("", response_model=List[FunnelResponse])
@@ -21,7 +24,7 @@ async def get_funnels(
     current_user: dict = Depends(get_current_user),
 ):
     """Получает список всех воронок"""
-    funnels = funnel_service.get_all()
+    funnels = await funnel_service.get_all()
     return [FunnelResponse(**f) for f in funnels]
 
 
@@ -30,7 +33,7 @@ async def get_default_funnel(
     current_user: dict = Depends(get_current_user),
 ):
     """Получает воронку по умолчанию"""
-    funnel = funnel_service.get_default()
+    funnel = await funnel_service.get_default()
     if not funnel:
         raise HTTPException(status_code=404, detail="Воронка по умолчанию не найдена")
     return FunnelResponse(**funnel)
@@ -42,19 +45,42 @@ async def get_funnel(
     current_user: dict = Depends(get_current_user),
 ):
     """Получает воронку по ID"""
-    funnel = funnel_service.get_by_id(funnel_id)
+    funnel = await funnel_service.get_by_id(funnel_id)
     if not funnel:
         raise HTTPException(status_code=404, detail="Воронка не найдена")
     return FunnelResponse(**funnel)
 
 
+@router.get("/{funnel_id}/board", response_model=FunnelBoardResponse)
+async def get_funnel_board(
+    funnel_id: int,
+    per_stage: int = Query(20, ge=1, le=200, description="Сделок в каждой колонке"),
+    sort: str = Query("created_at", description="Сортировка: created_at, updated_at, amount, close_date"),
+    order: str = Query("desc", description="Направление сортировки: asc, desc"),
+    current_user: dict = Depends(get_current_user),
+):
+    """
+    Канбан-доска воронки за один запрос
+    
+    Догрузка колонки: GET /deals?funnel_id=&stage_id=&cursor=<next_cursor>
+    с теми же sort и order.
+    """
+    try:
+        board = await deal_service.get_board(funnel_id, per_stage=per_stage, sort=sort, order=order)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    if not board:
+        raise HTTPException(status_code=404, detail="Воронка не найдена")
+    return board
+
+
 @router.post("", response_model=FunnelResponse, status_code=201)
 async def create_funnel(
     funnel_data: FunnelCreate,
     current_user: dict = Depends(get_current_user),
 ):
     """Создаёт новую воронку"""
-    funnel = funnel_service.create(funnel_data.dict(), user_id=current_user['id'])
+    funnel = await funnel_service.create(funnel_data.dict(), user_id=current_user['id'])
     return FunnelResponse(**funnel)
 
 
@@ -65,7 +91,7 @@ async def update_funnel(
     current_user: dict = Depends(get_current_user),
 ):
     """Обновляет воронку"""
-    funnel = funnel_service.update(funnel_id, funnel_data.dict(exclude_unset=True))
+    funnel = await funnel_service.update(funnel_id, funnel_data.dict(exclude_unset=True))
     if not funnel:
         raise HTTPException(status_code=404, detail="Воронка не найдена")
     return FunnelResponse(**funnel)
@@ -78,7 +104,7 @@ async def delete_funnel(
 ):
     """Удаляет воронку (нельзя удалить default)"""
     try:
-        success = funnel_service.delete(funnel_id)
+        success = await funnel_service.delete(funnel_id)
         if not success:
             raise HTTPException(status_code=404, detail="Воронка не найдена")
     except ValueError as e:
@@ -92,11 +118,11 @@ async def add_stage(
     current_user: dict = Depends(get_current_user),
 ):
     """Добавляет стадию к воронке"""
-    funnel = funnel_service.get_by_id(funnel_id)
+    funnel = await funnel_service.get_by_id(funnel_id)
     if not funnel:
         raise HTTPException(status_code=404, detail="Воронка не найдена")
     
-    stage = funnel_service.add_stage(funnel_id, stage_data.dict())
+    stage = await funnel_service.add_stage(funnel_id, stage_data.dict())
     return stage
 
 
@@ -108,7 +134,7 @@ async def update_stage(
     current_user: dict = Depends(get_current_user),
 ):
     """Обновляет стадию"""
-    stage = funnel_service.update_stage(funnel_id, stage_id, stage_data.dict(exclude_unset=True))
+    stage = await funnel_service.update_stage(funnel_id, stage_id, stage_data.dict(exclude_unset=True))
     if not stage:
         raise HTTPException(status_code=404, detail="Стадия не найдена")
     return stage
@@ -121,7 +147,7 @@ async def delete_stage(
     current_user: dict = Depends(get_current_user),
 ):
     """Удаляет стадию (перемещает сделки в первую стадию)"""
-    success = funnel_service.delete_stage(funnel_id, stage_id)
+    success = await funnel_service.delete_stage(funnel_id, stage_id, current_user['id'])
     if not success:
         raise HTTPException(status_code=404, detail="Воронка или стадия не найдены")
 
@@ -132,7 +158,7 @@ async def set_default_funnel(
     current_user: dict = Depends(get_current_user),
 ):
     """Устанавливает воронку как стандартную"""
-    funnel = funnel_service.set_default(funnel_id)
+    funnel = await funnel_service.set_default(funnel_id)
     if not funnel:
         raise HTTPException(status_code=404, detail="Воронка не найдена")
     return FunnelResponse(**funnel)
@@ -145,11 +171,11 @@ async def reorder_stages(
     current_user: dict = Depends(get_current_user),
 ):
     """Изменяет порядок стадий в воронке"""
-    funnel = funnel_service.get_by_id(funnel_id)
+    funnel = await funnel_service.get_by_id(funnel_id)
     if not funnel:
         raise HTTPException(status_code=404, detail="Воронка не найдена")
     
-    success = funnel_service.reorder_stages(funnel_id, reorder_data.stage_ids)
+    success = await funnel_service.reorder_stages(funnel_id, reorder_data.stage_ids)
     if not success:
         raise HTTPException(status_code=400, detail="Ошибка изменения порядка стадий")
     
@@ -12,6 +12,9 @@ from ...services.auth_service import AuthService
 from ...services.user_service import UserService
 from ...services.proposal_service import ProposalService
 from ...core.security import get_current_user
+from ...core.db_executor import AsyncServiceProxy
+from ...core.materials import material_catalog
+from ...core.repricing import repricing_worker
 from ...services.ai_service import AIService
 from ...services.file_service import FileService
 from ...models.user import UserLogin
@@ -170,7 +173,6 @@ CUSTOMERS_STORAGE_PATH = os.path.join(ROOT_DIR, 'customers.json')
 CONTACTS_STORAGE_PATH = os.path.join(ROOT_DIR, 'contacts.json')
 CATALOG_STORAGE_PATH = os.path.join(ROOT_DIR, 'catalog.json')
 WAREHOUSE_STORAGE_PATH = os.path.join(ROOT_DIR, 'warehouse.json')
-CALCULATIONS_STORAGE_PATH = os.path.join(ROOT_DIR, 'calculations.json')
 
 def _read_prices() -> list:
     try:
@@ -766,13 +768,13 @@ async def delete_production_operation(payload: dict):
 
 from ...services.customer_service import CustomerService
 
-customer_service = CustomerService()
+customer_service = AsyncServiceProxy(CustomerService())
 
 
 @router.get('/api/customers/get_list')
 async def customers_get_list_legacy():
     """Legacy: Получение списка клиентов"""
-    customers, total = customer_service.get_all(skip=0, limit=1000)
+    customers, total = await customer_service.get_all(skip=0, limit=1000)
     return {"success": True, "customers": customers}
 
 
@@ -783,7 +785,7 @@ async def customers_get_entry_legacy(data: dict, current_user: dict = Depends(ge
     if cid is None:
         return JSONResponse(status_code=400, content={"success": False, "error": "customer_id required"})
     
-    customer = customer_service.get_by_id(cid)
+    customer = await customer_service.get_by_id(cid)
     if not customer:
         return JSONResponse(status_code=404, content={"success": False, "error": "not found"})
     
@@ -813,7 +815,7 @@ async def customers_add_legacy(payload: dict, current_user: dict = Depends(get_c
             'manager_post': payload.get('manager_post', ''),
             'notes': payload.get('notes', ''),
         }
-        customer = customer_service.create(customer_data, user_id=current_user.get('id'))
+        customer = await customer_service.create(customer_data, user_id=current_user.get('id'))
         return {"success": True, "customer_id": customer['id']}
     except ValueError as e:
         return JSONResponse(status_code=400, content={"success": False, "error": str(e)})
@@ -843,7 +845,7 @@ async def customers_edit_legacy(payload: dict, current_user: dict = Depends(get_
             'manager_post': payload.get('manager_post', ''),
             'notes': payload.get('notes', ''),
         }
-        customer = customer_service.update(cid, customer_data, user_id=current_user.get('id'))
+        customer = await customer_service.update(cid, customer_data, user_id=current_user.get('id'))
         if not customer:
             return JSONResponse(status_code=404, content={"success": False, "error": "not found"})
         return {"success": True}
@@ -858,7 +860,7 @@ async def customers_delete_legacy(payload: dict, current_user: dict = Depends(ge
     if cid is None:
         return JSONResponse(status_code=400, content={"success": False, "error": "customer_id required"})
     
-    success = customer_service.delete(cid, soft=True)
+    success = await customer_service.delete(cid, soft=True)
     if not success:
         return JSONResponse(status_code=404, content={"success": False, "error": "not found"})
     return {"success": True}
@@ -870,13 +872,13 @@ async def customers_delete_legacy(payload: dict, current_user: dict = Depends(ge
 
 from ...services.contact_service import ContactService
 
-contact_service = ContactService()
+contact_service = AsyncServiceProxy(ContactService())
 
 
 @router.get('/api/contacts/get_list')
 async def contacts_get_list_legacy():
     """Legacy: Получение списка контактов"""
-    contacts, total = contact_service.get_all(skip=0, limit=1000)
+    contacts, total = await contact_service.get_all(skip=0, limit=1000)
     return {"success": True, "contacts": contacts}
 
 
@@ -887,7 +889,7 @@ async def contacts_get_entry_legacy(data: dict, current_user: dict = Depends(get
     if cid is None:
         return JSONResponse(status_code=400, content={"success": False, "error": "contact_id required"})
     
-    contact = contact_service.get_by_id(cid)
+    contact = await contact_service.get_by_id(cid)
     if not contact:
         return JSONResponse(status_code=404, content={"success": False, "error": "not found"})
     
@@ -909,7 +911,7 @@ async def contacts_add_legacy(payload: dict, current_user: dict = Depends(get_cu
         'company_id': payload.get('company_id'),
         'tags': payload.get('tags', []),
     }
-    contact = contact_service.create(contact_data, user_id=current_user.get('id'))
+    contact = await contact_service.create(contact_data, user_id=current_user.get('id'))
     return {"success": True, "contact": contact, "contact_id": contact['id']}
 
 
@@ -932,7 +934,7 @@ async def contacts_edit_legacy(payload: dict, current_user: dict = Depends(get_c
     # Удаляем None значения
     contact_data = {k: v for k, v in contact_data.items() if v is not None}
     
-    contact = contact_service.update(cid, contact_data, user_id=current_user.get('id'))
+    contact = await contact_service.update(cid, contact_data, user_id=current_user.get('id'))
     if not contact:
         return JSONResponse(status_code=404, content={"success": False, "error": "not found"})
     
@@ -946,7 +948,7 @@ async def contacts_delete_legacy(payload: dict, current_user: dict = Depends(get
     if cid is None:
         return JSONResponse(status_code=400, content={"success": False, "error": "contact_id required"})
     
-    success = contact_service.delete(cid)
+    success = await contact_service.delete(cid)
     if not success:
         return JSONResponse(status_code=404, content={"success": False, "error": "not found"})
     return {"success": True}
@@ -1116,39 +1118,23 @@ def _enrich_warehouse_operation(operation: dict) -> dict:
 # Calculations history (simple storage)
 # ======================
 
-def _read_calculations() -> list:
-    try:
-        if os.path.exists(CALCULATIONS_STORAGE_PATH):
-            with open(CALCULATIONS_STORAGE_PATH, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                if isinstance(data, list):
-                    return data
-    except Exception:
-        pass
-    return []
-
-def _write_calculations(items: list) -> None:
-    try:
-        with open(CALCULATIONS_STORAGE_PATH, 'w', encoding='utf-8') as f:
-            json.dump(items, f, ensure_ascii=False, indent=2)
-    except Exception:
-        pass
+from ...core.calculation_store import CalculationStore
 
-def _next_calc_id(items: list) -> int:
-    return (max([c.get('id', 0) for c in items] + [0]) + 1)
+# Расчеты хранятся в таблице calculations (общей с CalculationService)
+calculation_store = AsyncServiceProxy(CalculationStore())
 
 
 @router.get('/api/calculations/list')
 async def calculations_list_legacy():
-    items = _read_calculations()
+    items, _ = await calculation_store.list_summaries()
     # Возвращаем краткий список
     brief = [
         {
-            'id': it.get('id'),
-            'name': it.get('name') or it.get('Название изделия') or '',
-            'created_at': it.get('created_at'),
-            'items_count': len(it.get('items') or []),
-            'total': it.get('totals') or {}
+            'id': it['id'],
+            'name': it['name'] or '',
+            'created_at': it['created_at'],
+            'items_count': it['items_count'],
+            'total': it['totals']
         } for it in items
     ]
     return {'success': True, 'items': brief}
@@ -1156,11 +1142,10 @@ async def calculations_list_legacy():
 
 @router.get('/api/calculations/{calc_id}')
 async def calculations_get_entry_legacy(calc_id: int):
-    items = _read_calculations()
-    for it in items:
-        if int(it.get('id', -1)) == int(calc_id):
-            return {'success': True, 'calculation': it}
-    return JSONResponse(status_code=404, content={'success': False, 'error': 'not found'})
+    it = await calculation_store.get(calc_id)
+    if it is None:
+        return JSONResponse(status_code=404, content={'success': False, 'error': 'not found'})
+    return {'success': True, 'calculation': it}
 
 
 @router.post('/api/calculations/save')
@@ -1177,41 +1162,24 @@ async def calculations_save_legacy(payload: dict):
       meta?: { ... }
     }
     """
-    items = _read_calculations()
-    from datetime import datetime
-    now_iso = datetime.utcnow().isoformat()
-
     calc_id = payload.get('id')
     if calc_id is None:
-        new_id = _next_calc_id(items)
-        entry = {
-            'id': new_id,
+        new_id = await calculation_store.create({
             'name': payload.get('name') or payload.get('Название изделия') or '',
             'items': payload.get('items') or [],
             'totals': payload.get('totals') or {},
             'meta': payload.get('meta') or {},
-            'created_at': now_iso,
-            'updated_at': now_iso,
-        }
-        items.append(entry)
-        _write_calculations(items)
+        })
         return {'success': True, 'id': new_id}
     else:
         # update
-        for i, it in enumerate(items):
-            if int(it.get('id', -1)) == int(calc_id):
-                items[i] = {
-                    'id': int(calc_id),
-                    'name': payload.get('name') or payload.get('Название изделия') or it.get('name') or '',
-                    'items': payload.get('items') if 'items' in payload else it.get('items', []),
-                    'totals': payload.get('totals') if 'totals' in payload else it.get('totals', {}),
-                    'meta': payload.get('meta') if 'meta' in payload else it.get('meta', {}),
-                    'created_at': it.get('created_at'),
-                    'updated_at': now_iso,
-                }
-                _write_calculations(items)
-                return {'success': True, 'id': int(calc_id)}
-        return JSONResponse(status_code=404, content={'success': False, 'error': 'not found'})
+        changes = {key: payload.get(key) for key in ('items', 'totals', 'meta') if key in payload}
+        name = payload.get('name') or payload.get('Название изделия')
+        if name:
+            changes['name'] = name
+        if not await calculation_store.update(int(calc_id), changes):
+            return JSONResponse(status_code=404, content={'success': False, 'error': 'not found'})
+        return {'success': True, 'id': int(calc_id)}
 
 
 @router.post('/api/calculations/delete')
@@ -1219,9 +1187,7 @@ async def calculations_delete_legacy(payload: dict):
     calc_id = payload.get('id')
     if calc_id is None:
         return JSONResponse(status_code=400, content={'success': False, 'error': 'id required'})
-    items = _read_calculations()
-    new_items = [it for it in items if int(it.get('id', -1)) != int(calc_id)]
-    _write_calculations(new_items)
+    await calculation_store.delete(int(calc_id))
     return {'success': True}
 
 
@@ -1299,6 +1265,27 @@ def _write_materials_settings(items: list) -> None:
     except Exception:
         pass
 
+def _schedule_repricing(old: Optional[dict], new: Optional[dict]) -> None:
+    """
+    Фоновая переоценка расчетов после изменения марки
+
+    Смена цены переоценивает расчеты с этой маркой; смена категории или
+    марки (а также добавление и удаление) перестраивает ссылки расчетов.
+    """
+    material_catalog.invalidate()
+    if not old or not new:
+        repricing_worker.submit(rebuild_index=True)
+        return
+    prices = {}
+    if old.get('price') != new.get('price'):
+        try:
+            prices[int(new['id'])] = float(new.get('price') or 0)
+        except (TypeError, ValueError):
+            pass
+    renamed = (old.get('category'), old.get('grade')) != (new.get('category'), new.get('grade'))
+    repricing_worker.submit(prices, rebuild_index=renamed)
+
+
 def _next_material_id(items: list) -> int:
     return (max([m.get('id', 0) for m in items] + [0]) + 1)
 
@@ -1325,6 +1312,7 @@ async def materials_add(payload: dict):
     }
     items.append(entry)
     _write_materials_settings(items)
+    _schedule_repricing(None, entry)
     return { 'success': True, 'material': entry, 'id': new_id }
 
 
@@ -1344,6 +1332,7 @@ async def materials_edit(payload: dict):
                 'price': payload.get('price', m.get('price', 0)),
             }
             _write_materials_settings(items)
+            _schedule_repricing(m, items[i])
             return { 'success': True }
     return JSONResponse(status_code=404, content={'success': False, 'error': 'not found'})
 
@@ -1356,6 +1345,8 @@ async def materials_delete(payload: dict):
     items = _read_materials_settings()
     new_items = [m for m in items if int(m.get('id', -1)) != int(mid)]
     _write_materials_settings(new_items)
+    if len(new_items) != len(items):
+        _schedule_repricing({'id': mid}, None)
     return { 'success': True }
 
 
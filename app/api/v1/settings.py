@@ -1,17 +1,16 @@
 """
 API роуты для настроек сайдбара
 """
+import json
 from fastapi import APIRouter, Depends, HTTPException
 from typing import List
 from pydantic import BaseModel
-from ...core.database import DatabaseManager
+from ...core.database import db_manager
+from ...core.db_executor import run_in_db
 from ...core.security import get_current_user
 
 router = APIRouter()
 
-# Создаем экземпляр DatabaseManager
-db_manager = DatabaseManager()
-
 
 class SidebarSettingsUpdate(BaseModel):
     """Модель для обновления настроек сайдбара"""
@@ -27,37 +26,8 @@ class SidebarSettingsResponse(BaseModel):
     hidden_items: List[str]
 
 
-def init_sidebar_settings_table():
-    """Инициализация таблицы настроек сайдбара"""
-    with db_manager.get_connection() as conn:
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS sidebar_settings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                hidden_categories TEXT DEFAULT '[]',
-                collapsed_categories TEXT DEFAULT '[]',
-                hidden_items TEXT DEFAULT '[]',
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Создаем запись по умолчанию, если её нет
-        cursor = conn.execute('SELECT * FROM sidebar_settings WHERE id = 1')
-        if not cursor.fetchone():
-            conn.execute('''
-                INSERT INTO sidebar_settings (id, hidden_categories, collapsed_categories, hidden_items)
-                VALUES (1, '[]', '[]', '[]')
-            ''')
-        
-        conn.commit()
-
-
-@router.get("/sidebar", response_model=SidebarSettingsResponse)
-async def get_sidebar_settings(
-    current_user: dict = Depends(get_current_user)
-):
-    """Получение настроек сайдбара (глобальные настройки)"""
-    init_sidebar_settings_table()
-    
+def _load_sidebar_settings() -> SidebarSettingsResponse:
+    """Читает настройки сайдбара, создавая запись при первом обращении"""
     with db_manager.get_connection() as conn:
         cursor = conn.execute('SELECT * FROM sidebar_settings WHERE id = 1')
         row = cursor.fetchone()
@@ -68,14 +38,12 @@ async def get_sidebar_settings(
                 INSERT INTO sidebar_settings (id, hidden_categories, collapsed_categories, hidden_items)
                 VALUES (1, '[]', '[]', '[]')
             ''')
-            conn.commit()
             return SidebarSettingsResponse(
                 hidden_categories=[],
                 collapsed_categories=[],
                 hidden_items=[]
             )
         
-        import json
         return SidebarSettingsResponse(
             hidden_categories=json.loads(row[1] or '[]'),
             collapsed_categories=json.loads(row[2] or '[]'),
@@ -83,15 +51,8 @@ async def get_sidebar_settings(
         )
 
 
-@router.put("/sidebar", response_model=SidebarSettingsResponse)
-async def update_sidebar_settings(
-    settings: SidebarSettingsUpdate,
-    current_user: dict = Depends(get_current_user)
-):
-    """Обновление настроек сайдбара (глобальные настройки)"""
-    init_sidebar_settings_table()
-    
-    import json
+def _save_sidebar_settings(settings: SidebarSettingsUpdate) -> SidebarSettingsResponse:
+    """Сохраняет настройки сайдбара"""
     with db_manager.get_connection() as conn:
         # Проверяем, существует ли запись
         cursor = conn.execute('SELECT * FROM sidebar_settings WHERE id = 1')
@@ -122,11 +83,26 @@ async def update_sidebar_settings(
                 json.dumps(settings.hidden_items)
             ))
         
-        conn.commit()
-        
         return SidebarSettingsResponse(
             hidden_categories=settings.hidden_categories,
             collapsed_categories=settings.collapsed_categories,
             hidden_items=settings.hidden_items
         )
 
+
+@router.get("/sidebar", response_model=SidebarSettingsResponse)
+async def get_sidebar_settings(
+    current_user: dict = Depends(get_current_user)
+):
+    """Получение настроек сайдбара (глобальные настройки)"""
+    return await run_in_db(_load_sidebar_settings)
+
+
+@router.put("/sidebar", response_model=SidebarSettingsResponse)
+async def update_sidebar_settings(
+    settings: SidebarSettingsUpdate,
+    current_user: dict = Depends(get_current_user)
+):
+    """Обновление настроек сайдбара (глобальные настройки)"""
+    return await run_in_db(_save_sidebar_settings, settings)
+
@@ -0,0 +1,179 @@
+"""
+Расчет веса и стоимости позиций-сортаментов на сервере
+
+Вес позиции = площадь сечения формы * длина * плотность марки. Размеры
+задаются в миллиметрах (как в dimensions позиций расчета), плотность -
+в кг/м3 из справочника марок (app.core.materials), цена за кг по
+умолчанию - цена марки из справочника.
+
+Стоимости считаются так же, как их сохраняет клиент:
+materialCost = вес * количество * цена за кг,
+totalCost = materialCost + processingCost.
+"""
+import math
+from typing import Any, Callable, Dict, List, Mapping, NamedTuple, Optional, Sequence
+
+from ..utils.search_keys import normalize_text
+from .materials import MaterialCatalog, material_catalog
+
+# мм3 -> м3
+_MM3_TO_M3 = 1e-9
+
+
+class Shape(NamedTuple):
+    """Форма сортамента: обязательные размеры и площадь сечения, мм2"""
+    dimensions: Sequence[str]
+    area: Callable[[Mapping[str, float]], float]
+
+
+def _tube_area(d: Mapping[str, float]) -> float:
+    inner = d['diameter'] - 2 * d['thickness']
+    if inner < 0:
+        raise ValueError('Толщина стенки больше радиуса трубы')
+    return math.pi * (d['diameter'] ** 2 - inner ** 2) / 4
+
+
+def _profile_tube_area(d: Mapping[str, float]) -> float:
+    height = d.get('height') or d['width']
+    inner_width, inner_height = d['width'] - 2 * d['thickness'], height - 2 * d['thickness']
+    if inner_width < 0 or inner_height < 0:
+        raise ValueError('Толщина стенки больше половины стороны профиля')
+    return d['width'] * height - inner_width * inner_height
+
+
+def _angle_area(d: Mapping[str, float]) -> float:
+    height = d.get('height') or d['width']
+    return d['thickness'] * (d['width'] + height - d['thickness'])
+
+
+_SHEET = Shape(('width', 'thickness', 'length'), lambda d: d['width'] * d['thickness'])
+
+# Ключ - нормализованное название формы (normalize_text)
+SHAPES: Dict[str, Shape] = {
+    'круг': Shape(('diameter', 'length'), lambda d: math.pi * d['diameter'] ** 2 / 4),
+    'квадрат': Shape(('width', 'length'), lambda d: d['width'] ** 2),
+    # width - размер под ключ
+    'шестигранник': Shape(('width', 'length'), lambda d: math.sqrt(3) / 2 * d['width'] ** 2),
+    'лист': _SHEET,
+    'плита': _SHEET,
+    'полоса': _SHEET,
+    'труба': Shape(('diameter', 'thickness', 'length'), _tube_area),
+    'труба профильная': Shape(('width', 'thickness', 'length'), _profile_tube_area),
+    'уголок': Shape(('width', 'thickness', 'length'), _angle_area),
+}
+
+# Синонимы ключей размеров
+_DIMENSION_ALIASES = {
+    'd': 'diameter',
+    'outer_diameter': 'diameter',
+    'side': 'width',
+    'size': 'width',
+    'a': 'width',
+    'b': 'height',
+    'wall': 'thickness',
+    's': 'thickness',
+    'l': 'length',
+}
+
+
+def _dimensions(shape: Shape, raw: Optional[Mapping[str, Any]]) -> Dict[str, float]:
+    values: Dict[str, float] = {}
+    for key, value in (raw or {}).items():
+        if value in (None, ''):
+            continue
+        name = _DIMENSION_ALIASES.get(key, key)
+        try:
+            number = float(str(value).replace(',', '.'))
+        except ValueError:
+            raise ValueError(f'Некорректный размер {key}: {value}')
+        if number < 0:
+            raise ValueError(f'Отрицательный размер {key}')
+        values.setdefault(name, number)
+    missing = [name for name in shape.dimensions if not values.get(name)]
+    if missing:
+        raise ValueError(f"Не заданы размеры: {', '.join(missing)}")
+    return values
+
+
+def unit_weight(shape: str, dimensions: Optional[Mapping[str, Any]], density: float) -> float:
+    """
+    Вес одной единицы сортамента, кг
+
+    Args:
+        shape: Название формы ("Круг", "Труба", ...)
+        dimensions: Размеры в мм
+        density: Плотность, кг/м3
+
+    Raises:
+        ValueError: Неизвестная форма или неполные размеры
+    """
+    spec = SHAPES.get(normalize_text(shape))
+    if spec is None:
+        raise ValueError(f'Неизвестная форма сортамента: {shape}')
+    values = _dimensions(spec, dimensions)
+    return spec.area(values) * values['length'] * _MM3_TO_M3 * density
+
+
+def evaluate_position(position: Mapping[str, Any], catalog: MaterialCatalog = material_catalog) -> Dict[str, Any]:
+    """
+    Вес и стоимость одной позиции
+
+    Args:
+        position: material или materialId, shape, dimensions, quantity,
+            необязательные pricePerKg, processingCost, markup
+
+    Raises:
+        ValueError: Марка не найдена, неизвестная форма или неполные размеры
+    """
+    material_id = position.get('materialId')
+    if material_id is None:
+        material_id = catalog.resolve(position.get('material'))
+    grade = catalog.get(material_id) if material_id is not None else None
+    if grade is None:
+        raise ValueError(f"Марка не найдена: {position.get('material') or material_id}")
+
+    density = float(grade.get('density') or 0)
+    weight = unit_weight(position.get('shape') or '', position.get('dimensions'), density)
+    quantity = position.get('quantity') or 0
+    price_per_kg = position.get('pricePerKg')
+    if price_per_kg is None:
+        price_per_kg = float(grade.get('price') or 0)
+    processing_cost = position.get('processingCost') or 0
+    markup = position.get('markup') or 0
+
+    material_cost = weight * quantity * price_per_kg
+    total_cost = material_cost + processing_cost
+    return {
+        'id': position.get('id'),
+        'materialId': material_id,
+        'material': f"{grade.get('category', '')} {grade.get('grade', '')}".strip(),
+        'density': density,
+        'weight': weight,
+        'totalWeight': weight * quantity,
+        'quantity': quantity,
+        'pricePerKg': price_per_kg,
+        'materialCost': material_cost,
+        'processingCost': processing_cost,
+        'totalCost': total_cost,
+        'markup': markup,
+        'price': total_cost * (1 + markup / 100),
+    }
+
+
+def evaluate_positions(
+    positions: Sequence[Mapping[str, Any]],
+    catalog: MaterialCatalog = material_catalog,
+) -> List[Dict[str, Any]]:
+    """
+    Пакетный расчет позиций
+
+    Ошибка в позиции не прерывает пакет: позиция возвращается с полем
+    error и без расчетных значений.
+    """
+    results = []
+    for position in positions:
+        try:
+            results.append(evaluate_position(position, catalog))
+        except ValueError as exc:
+            results.append({'id': position.get('id'), 'error': str(exc)})
+    return results
@@ -0,0 +1,148 @@
+"""
+Запись журнала изменений сделок (deal_history)
+
+Записи истории копятся в пределах операции и пишутся одним executemany.
+Режим задаётся настройкой audit_write_mode:
+
+- transactional: пакет пишется в той же транзакции, что и само изменение
+  (запись истории атомарна с изменением сделки);
+- write_behind: после фиксации транзакции пакет ставится в очередь
+  (при откате отбрасывается), фоновый поток сбрасывает её
+  по таймеру (audit_flush_interval_ms) или по размеру
+  (audit_flush_batch_size). Незаписанные строки теряются при аварийном
+  завершении процесса; при штатной остановке очередь сбрасывается.
+"""
+import logging
+import queue
+import threading
+from typing import List, NamedTuple, Optional
+
+from .config import settings
+from .database import DatabaseManager, call_after_commit, db_manager
+
+logger = logging.getLogger(__name__)
+
+AUDIT_MODES = ('transactional', 'write_behind')
+
+_INSERT_SQL = '''
+    INSERT INTO deal_history (deal_id, field_name, old_value, new_value, change_type, changed_by_id)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+
+class HistoryEntry(NamedTuple):
+    """Строка журнала изменений"""
+    deal_id: int
+    field_name: str
+    old_value: Optional[str]
+    new_value: Optional[str]
+    change_type: str
+    changed_by_id: int
+
+
+class AuditWriter:
+    """Пакетная запись истории с опциональной отложенной записью"""
+
+    def __init__(
+        self,
+        db: Optional[DatabaseManager] = None,
+        mode: Optional[str] = None,
+        flush_interval: Optional[float] = None,
+        batch_size: Optional[int] = None,
+    ):
+        self.db = db or db_manager
+        self.mode = mode or settings.audit_write_mode
+        if self.mode not in AUDIT_MODES:
+            raise ValueError(f"Неизвестный режим записи истории: {self.mode}")
+        self.flush_interval = flush_interval if flush_interval is not None else settings.audit_flush_interval_ms / 1000
+        self.batch_size = batch_size or settings.audit_flush_batch_size
+
+        self._queue: "queue.Queue[List[HistoryEntry]]" = queue.Queue()
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._thread_lock = threading.Lock()
+
+    def write(self, conn, entries: List[HistoryEntry]) -> None:
+        """
+        Записывает пакет истории
+
+        Args:
+            conn: Соединение текущей транзакции (запись в режиме transactional, постановка в очередь после фиксации в write_behind)
+            entries: Строки истории
+        """
+        if not entries:
+            return
+        if self.mode == 'transactional':
+            conn.executemany(_INSERT_SQL, entries)
+            return
+        # В очередь попадает только зафиксированное изменение
+        batch = list(entries)
+        call_after_commit(conn, lambda: self._enqueue(batch))
+
+    def _enqueue(self, entries: List[HistoryEntry]) -> None:
+        self._ensure_thread()
+        self._queue.put(entries)
+        with self._pending_lock:
+            self._pending += len(entries)
+            full = self._pending >= self.batch_size
+        if full:
+            self._wakeup.set()
+
+    def flush(self) -> int:
+        """Синхронно сбрасывает очередь отложенной записи, возвращает число строк"""
+        pending: List[HistoryEntry] = []
+        while True:
+            try:
+                pending.extend(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if not pending:
+            return 0
+        try:
+            self._write_batch(pending)
+        except Exception:
+            # Строки возвращаются в очередь и будут записаны при следующем сбросе
+            self._queue.put(pending)
+            raise
+        with self._pending_lock:
+            self._pending = max(self._pending - len(pending), 0)
+        return len(pending)
+
+    def close(self) -> None:
+        """Останавливает фоновый поток и сбрасывает остаток очереди"""
+        with self._thread_lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stopping.set()
+            self._wakeup.set()
+            thread.join()
+            self._stopping.clear()
+        self.flush()
+
+    def _ensure_thread(self) -> None:
+        if self._thread is not None:
+            return
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Ошибка отложенной записи истории сделок")
+
+    def _write_batch(self, entries: List[HistoryEntry]) -> None:
+        with self.db.get_connection() as conn:
+            conn.executemany(_INSERT_SQL, entries)
+
+
+# Глобальный экземпляр для сервисов
+audit_writer = AuditWriter()
@@ -0,0 +1,137 @@
+"""
+Обратный индекс: марка металла и технологическая операция -> расчеты
+
+Таблица calculation_refs хранит ссылки расчетов на справочники:
+
+- material - ID марки из prices_metal_materials.json (materialId позиции
+  или сопоставление строки материала через MaterialCatalog);
+- service / variant - serviceId и variantId операций (операции позиций
+  и глобальные операции расчета).
+
+item_id - ID позиции-сортамента (пустая строка для глобальных операций).
+Первичный ключ (kind, ref, calculation_id, item_id) - индекс для поиска
+расчетов по ссылке. Хранилище расчетов перестраивает ссылки расчета при
+каждой записи (refresh_refs), поэтому найти расчеты, затронутые
+изменением цены, можно без разбора payload всех расчетов.
+"""
+import json
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from .materials import MaterialCatalog, material_catalog
+
+MATERIAL = 'material'
+SERVICE = 'service'
+VARIANT = 'variant'
+
+REF_KINDS = (MATERIAL, SERVICE, VARIANT)
+
+_INSERT_SQL = '''
+    INSERT OR IGNORE INTO calculation_refs (kind, ref, calculation_id, item_id)
+    VALUES (?, ?, ?, ?)
+'''
+
+
+def create_refs_table(conn) -> None:
+    """Создаёт таблицу обратного индекса"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS calculation_refs (
+            kind TEXT NOT NULL,
+            ref TEXT NOT NULL,
+            calculation_id INTEGER NOT NULL,
+            item_id TEXT NOT NULL DEFAULT '',
+            PRIMARY KEY (kind, ref, calculation_id, item_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_calculation_refs_calculation ON calculation_refs(calculation_id)')
+
+
+def material_id(item: Dict[str, Any], catalog: MaterialCatalog = material_catalog) -> Optional[int]:
+    """ID марки позиции: materialId или сопоставление строки материала"""
+    explicit = item.get('materialId')
+    if isinstance(explicit, int):
+        return explicit
+    return catalog.resolve(item.get('material'))
+
+
+def _operation_refs(operation: Dict[str, Any]) -> List[Tuple[str, str]]:
+    refs = []
+    service_id = operation.get('serviceId', operation.get('service_id'))
+    variant_id = operation.get('variantId', operation.get('variant_id'))
+    if service_id is not None:
+        refs.append((SERVICE, str(service_id)))
+    if variant_id is not None:
+        refs.append((VARIANT, str(variant_id)))
+    return refs
+
+
+def record_refs(
+    calc_id: int,
+    record: Dict[str, Any],
+    catalog: MaterialCatalog = material_catalog,
+) -> Set[Tuple[str, str, int, str]]:
+    """Строки индекса для расчета"""
+    refs: Set[Tuple[str, str, int, str]] = set()
+    for item in record.get('assortments') or []:
+        if not isinstance(item, dict):
+            continue
+        item_id = str(item.get('id') or '')
+        grade_id = material_id(item, catalog)
+        if grade_id is not None:
+            refs.add((MATERIAL, str(grade_id), calc_id, item_id))
+        for operation in item.get('operations') or []:
+            if isinstance(operation, dict):
+                refs.update((kind, ref, calc_id, item_id) for kind, ref in _operation_refs(operation))
+    for operation in record.get('global_operations') or []:
+        if isinstance(operation, dict):
+            refs.update((kind, ref, calc_id, '') for kind, ref in _operation_refs(operation))
+    return refs
+
+
+def refresh_refs(conn, calc_id: int, record: Optional[Dict[str, Any]]) -> None:
+    """Перестраивает ссылки расчета (record None - расчет удалён)"""
+    conn.execute('DELETE FROM calculation_refs WHERE calculation_id = ?', (calc_id,))
+    if record is not None:
+        conn.executemany(_INSERT_SQL, record_refs(calc_id, record))
+
+
+def rebuild_refs(conn, catalog: MaterialCatalog = material_catalog) -> None:
+    """Заполняет индекс заново по всем расчетам"""
+    conn.execute('DELETE FROM calculation_refs')
+    for row in conn.execute('SELECT id, payload FROM calculations').fetchall():
+        conn.executemany(_INSERT_SQL, record_refs(row[0], json.loads(row[1] or '{}'), catalog))
+
+
+def find_calculations(conn, kind: str, refs: Iterable[Any]) -> Dict[int, List[str]]:
+    """
+    Расчеты, ссылающиеся на любое из значений refs
+
+    Returns:
+        ID расчета -> ID позиций со ссылкой (пустая строка - глобальная операция)
+    """
+    if kind not in REF_KINDS:
+        raise ValueError(f"Неизвестный тип ссылки: {kind}. Доступно: {', '.join(REF_KINDS)}")
+    values = sorted({str(ref) for ref in refs})
+    if not values:
+        return {}
+    rows = conn.execute(
+        f'''
+        SELECT calculation_id, item_id FROM calculation_refs
+        WHERE kind = ? AND ref IN ({', '.join('?' for _ in values)})
+        ORDER BY calculation_id, item_id
+        ''',
+        [kind] + values,
+    ).fetchall()
+    found: Dict[int, List[str]] = {}
+    for calc_id, item_id in rows:
+        items = found.setdefault(calc_id, [])
+        if item_id not in items:
+            items.append(item_id)
+    return found
+
+
+if __name__ == "__main__":
+    from .database import db_manager
+
+    with db_manager.get_connection() as connection:
+        rebuild_refs(connection)
+    print("Обратный индекс расчетов перестроен")
@@ -0,0 +1,307 @@
+"""
+Хранилище расчетов в SQLite
+
+Расчет - строка таблицы calculations: скалярные колонки id, name,
+created_at, updated_at (по ним строятся индексы) и payload - JSON с
+остальными полями (assortments, blanks, global_operations, настройки
+наценки или items/totals/meta legacy формата). Запись и удаление
+затрагивают одну строку вместо перезаписи всего calculations.json.
+
+Записи возвращаются в прежнем формате файла:
+{id, name, ...payload, created_at, updated_at}.
+
+Сводка расчета (app.utils.calculation_summary) и ключ поиска по названию
+пересчитываются при каждой записи и хранятся в колонках SUMMARY_COLUMNS,
+поэтому список расчетов читает только их, не разбирая payload. Там же
+обновляется обратный индекс ссылок на марки и операции
+(app.core.calculation_refs).
+"""
+import json
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from ..utils.calculation_summary import SUMMARY_FIELDS, calculation_summary
+from ..utils.pagination import order_by_clause, resolve_sort
+from ..utils.search_keys import normalize_text
+from .calculation_refs import refresh_refs
+from .database import begin_immediate, db_manager as default_db_manager
+
+# Поля записи, хранящиеся в отдельных колонках
+SCALAR_FIELDS = ('id', 'name', 'created_at', 'updated_at')
+
+SUMMARY_COLUMNS = {
+    'items_count': 'INTEGER NOT NULL DEFAULT 0',
+    'cost_price': 'REAL NOT NULL DEFAULT 0',
+    'markup_value': 'REAL NOT NULL DEFAULT 0',
+    'markup_percent': 'REAL NOT NULL DEFAULT 0',
+    'total_price': 'REAL NOT NULL DEFAULT 0',
+    # totals legacy формата (JSON)
+    'totals': "TEXT NOT NULL DEFAULT '{}'",
+    'search_name': "TEXT NOT NULL DEFAULT ''",
+}
+
+CALCULATION_SORT_KEYS = ('id', 'created_at', 'updated_at', 'name', 'total_price')
+
+_SUMMARY_ASSIGNMENTS = ', '.join(f'{column} = ?' for column in SUMMARY_COLUMNS)
+
+
+def create_calculations_table(conn) -> None:
+    """Создаёт таблицу расчетов и индексы"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS calculations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            payload TEXT NOT NULL DEFAULT '{}',
+            created_at TEXT,
+            updated_at TEXT
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_calculations_name ON calculations(name)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_calculations_created_at ON calculations(created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_calculations_updated_at ON calculations(updated_at)')
+
+
+def create_summary_columns(conn) -> None:
+    """Добавляет колонки сводки и индекс сортировки по итоговой цене"""
+    existing = {row[1] for row in conn.execute('PRAGMA table_info(calculations)').fetchall()}
+    for name, definition in SUMMARY_COLUMNS.items():
+        if name not in existing:
+            conn.execute(f'ALTER TABLE calculations ADD COLUMN {name} {definition}')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_calculations_total_price ON calculations(total_price)')
+
+
+def _now_iso() -> str:
+    return datetime.utcnow().isoformat()
+
+
+def _dump_payload(record: Dict[str, Any]) -> str:
+    payload = {key: value for key, value in record.items() if key not in SCALAR_FIELDS}
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':'))
+
+
+def _record_name(record: Dict[str, Any]) -> Optional[str]:
+    return record.get('name') or record.get('Название изделия')
+
+
+def _summary_values(record: Dict[str, Any]) -> Tuple[Any, ...]:
+    """Значения колонок SUMMARY_COLUMNS для записи"""
+    summary = calculation_summary(record)
+    totals = json.dumps(record.get('totals') or {}, ensure_ascii=False, separators=(',', ':'))
+    return tuple(summary[field] for field in SUMMARY_FIELDS) + (totals, normalize_text(_record_name(record)))
+
+
+def _row_to_record(row: Any) -> Dict[str, Any]:
+    record: Dict[str, Any] = {'id': row['id']}
+    if row['name'] is not None:
+        record['name'] = row['name']
+    record.update(json.loads(row['payload'] or '{}'))
+    record['created_at'] = row['created_at']
+    record['updated_at'] = row['updated_at']
+    return record
+
+
+def _insert(conn, record: Dict[str, Any], calc_id: Optional[int] = None) -> int:
+    now_iso = _now_iso()
+    columns = ', '.join(SUMMARY_COLUMNS)
+    placeholders = ', '.join('?' for _ in SUMMARY_COLUMNS)
+    cursor = conn.execute(
+        f'''
+        INSERT INTO calculations (id, name, payload, created_at, updated_at, {columns})
+        VALUES (?, ?, ?, ?, ?, {placeholders})
+        ''',
+        (
+            calc_id,
+            _record_name(record),
+            _dump_payload(record),
+            record.get('created_at') or now_iso,
+            record.get('updated_at') or record.get('created_at') or now_iso,
+        ) + _summary_values(record),
+    )
+    refresh_refs(conn, cursor.lastrowid, record)
+    return cursor.lastrowid
+
+
+def load_record(conn, calc_id: int) -> Optional[Dict[str, Any]]:
+    """Расчет по ID в текущей транзакции или None"""
+    row = conn.execute(
+        'SELECT id, name, payload, created_at, updated_at FROM calculations WHERE id = ?',
+        (calc_id,),
+    ).fetchone()
+    return _row_to_record(row) if row else None
+
+
+def save_record(conn, calc_id: int, record: Dict[str, Any]) -> None:
+    """Перезаписывает расчет, его сводку и ссылки; updated_at - текущее время"""
+    conn.execute(
+        f'UPDATE calculations SET name = ?, payload = ?, updated_at = ?, {_SUMMARY_ASSIGNMENTS} WHERE id = ?',
+        (_record_name(record), _dump_payload(record), _now_iso()) + _summary_values(record) + (calc_id,),
+    )
+    refresh_refs(conn, calc_id, record)
+
+
+def rebuild_calculation_summaries(conn) -> None:
+    """Пересчитывает сводку всех расчетов по payload"""
+    rows = conn.execute('SELECT id, name, payload, created_at, updated_at FROM calculations').fetchall()
+    conn.executemany(
+        f'UPDATE calculations SET {_SUMMARY_ASSIGNMENTS} WHERE id = ?',
+        [_summary_values(_row_to_record(row)) + (row['id'],) for row in rows],
+    )
+
+
+def _already_imported(conn, record: Dict[str, Any]) -> bool:
+    """
+    Запись уже перенесена прошлым импортом
+
+    Расчет legacy файла узнаётся по created_at и названию (payload мог
+    измениться после импорта, например при переоценке), запись без
+    created_at - по совпадению названия и payload.
+    """
+    created_at = record.get('created_at')
+    if created_at:
+        row = conn.execute(
+            'SELECT 1 FROM calculations WHERE created_at = ? AND name IS ? LIMIT 1',
+            (created_at, _record_name(record)),
+        ).fetchone()
+    else:
+        row = conn.execute(
+            'SELECT 1 FROM calculations WHERE payload = ? AND name IS ? LIMIT 1',
+            (_dump_payload(record), _record_name(record)),
+        ).fetchone()
+    return row is not None
+
+
+def import_calculations(conn, records: Iterable[Dict[str, Any]]) -> int:
+    """
+    Переносит расчеты из legacy JSON в таблицу
+
+    Импорт идемпотентен: уже перенесённые записи пропускаются, поэтому
+    повторный запуск не создаёт дубликатов. ID записей сохраняются; если
+    ID занят другим расчетом (или некорректен), записи назначается новый ID.
+
+    Returns:
+        Количество импортированных записей
+    """
+    count = 0
+    for record in records:
+        if not isinstance(record, dict) or _already_imported(conn, record):
+            continue
+        try:
+            calc_id = int(record.get('id'))
+        except (TypeError, ValueError):
+            calc_id = None
+        if calc_id is not None and conn.execute(
+            'SELECT 1 FROM calculations WHERE id = ?', (calc_id,)
+        ).fetchone():
+            calc_id = None
+        _insert(conn, record, calc_id)
+        count += 1
+    return count
+
+
+class CalculationStore:
+    """Операции с таблицей расчетов (каждый метод - одна транзакция)"""
+
+    def __init__(self, db_manager=None):
+        self.db_manager = db_manager or default_db_manager
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Все расчеты в порядке создания"""
+        with self.db_manager.get_connection() as conn:
+            rows = conn.execute(
+                'SELECT id, name, payload, created_at, updated_at FROM calculations ORDER BY id'
+            ).fetchall()
+        return [_row_to_record(row) for row in rows]
+
+    def list_summaries(
+        self,
+        skip: int = 0,
+        limit: Optional[int] = None,
+        search: Optional[str] = None,
+        sort: str = 'id',
+        order: str = 'asc',
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Страница сводок расчетов (без разбора payload)
+
+        Args:
+            skip, limit: Смещение и размер страницы (limit None - все записи)
+            search: Подстрока названия (без учёта регистра и пунктуации)
+            sort, order: Ключ из CALCULATION_SORT_KEYS и направление
+
+        Returns:
+            Кортеж (сводки, всего записей с учётом поиска)
+        """
+        sort, order = resolve_sort(sort, order, CALCULATION_SORT_KEYS)
+        query = '''
+            SELECT id, name, created_at, updated_at, items_count, cost_price, markup_value,
+                   markup_percent, total_price, totals, COUNT(*) OVER () AS total_count
+            FROM calculations
+        '''
+        params: List[Any] = []
+        key = normalize_text(search)
+        if key:
+            query += ' WHERE instr(search_name, ?) > 0'
+            params.append(key)
+        query += order_by_clause(sort, order) + ' LIMIT ? OFFSET ?'
+        params.extend([limit if limit is not None else -1, skip])
+
+        with self.db_manager.get_connection() as conn:
+            rows = conn.execute(query, params).fetchall()
+            if rows:
+                total = rows[0]['total_count']
+            else:
+                total = conn.execute(
+                    'SELECT COUNT(*) FROM calculations' + (' WHERE instr(search_name, ?) > 0' if key else ''),
+                    [key] if key else [],
+                ).fetchone()[0]
+
+        summaries = []
+        for row in rows:
+            summary = {column: row[column] for column in ('id', 'name', 'created_at', 'updated_at') + SUMMARY_FIELDS}
+            summary['totals'] = json.loads(row['totals'] or '{}')
+            summaries.append(summary)
+        return summaries, total
+
+    def get(self, calc_id: int) -> Optional[Dict[str, Any]]:
+        """Расчет по ID или None"""
+        with self.db_manager.get_connection() as conn:
+            return load_record(conn, calc_id)
+
+    def create(self, record: Dict[str, Any]) -> int:
+        """
+        Сохраняет новый расчет
+
+        Args:
+            record: Поля расчета (id игнорируется, timestamps по умолчанию - текущее время)
+
+        Returns:
+            ID созданного расчета
+        """
+        with self.db_manager.get_connection() as conn:
+            return _insert(conn, record)
+
+    def update(self, calc_id: int, changes: Dict[str, Any]) -> bool:
+        """
+        Обновляет поля расчета и updated_at
+
+        Поля из changes заменяют сохранённые, остальные не меняются.
+        Чтение и запись выполняются в одной транзакции.
+
+        Returns:
+            False, если расчет не найден
+        """
+        with self.db_manager.get_connection() as conn:
+            begin_immediate(conn)
+            record = load_record(conn, calc_id)
+            if record is None:
+                return False
+            record.update({key: value for key, value in changes.items() if key not in ('id', 'created_at')})
+            save_record(conn, calc_id, record)
+        return True
+
+    def delete(self, calc_id: int) -> bool:
+        """Удаляет расчет; False, если расчет не найден"""
+        with self.db_manager.get_connection() as conn:
+            cursor = conn.execute('DELETE FROM calculations WHERE id = ?', (calc_id,))
+            refresh_refs(conn, calc_id, None)
+            return cursor.rowcount > 0
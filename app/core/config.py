@@ -29,6 +29,37 @@ class Settings(BaseSettings):
     # База данных
     database_url: str = "sqlite:///./users.db"
     
+    # Параметры соединений SQLite (применяются при создании соединения в пуле)
+    sqlite_journal_mode: str = "WAL"
+    sqlite_synchronous: str = "NORMAL"
+    sqlite_cache_size: int = -64000  # отрицательное значение - размер в КиБ (64 МБ)
+    sqlite_mmap_size: int = 268435456  # 256 МБ
+    sqlite_busy_timeout: int = 5000  # мс
+    
+    # Пул потоков для синхронных запросов к БД из async-эндпоинтов
+    db_max_workers: int = 8
+    
+    # Инструментирование запросов к БД (заголовки X-DB-* и предупреждения в лог)
+    db_instrumentation: bool = True
+    db_slow_query_ms: int = 100
+    db_repeated_query_threshold: int = 10  # повторов одной формы запроса до предупреждения о N+1
+    
+    # Журнал изменений сделок: transactional - в транзакции изменения,
+    # write_behind - фоновая запись пакетами (возможна потеря при аварии)
+    audit_write_mode: str = "transactional"
+    audit_flush_interval_ms: int = 500
+    audit_flush_batch_size: int = 200
+    
+    # Кэш обратного поиска контактов по телефону/email (GET /contacts/lookup)
+    contact_lookup_cache_size: int = 4096
+    contact_lookup_cache_ttl: int = 60  # секунд
+
+    # Полнотекстовый поиск сделок: общее количество считается до этого предела
+    deal_search_total_cap: int = 1000
+
+    # Поиск дублей: блоки кандидатов крупнее этого размера не сравниваются
+    dedup_max_block_size: int = 50
+    
     # OpenAI API
     openai_api_key: Optional[str] = None
     openai_api_url: str = "https://api.openai.com/v1/responses"
@@ -0,0 +1,217 @@
+"""
+Обратный поиск контакта и компании по телефону или email
+
+Таблица contact_lookup хранит нормализованные значения (телефон - цифры
+в формате E.164 без "+", email - в нижнем регистре) из contacts.phone/email,
+contact_communications и customers.phone/email, customer_contacts.
+Первичный ключ (kind, value, owner, owner_id) - уникальный индекс, по
+префиксу которого выполняется поиск. Сервисы перестраивают записи
+владельца после каждой записи (refresh_contact / refresh_customer).
+
+Результаты поиска кэшируются в LRU-кэше процесса. Кэш очищается после
+фиксации транзакции, изменившей записи (call_after_commit), а каждая
+очистка увеличивает поколение кэша: результат чтения, начатого до
+очистки, в кэш не попадает. Изменения из других воркеров видны не
+позже чем через contact_lookup_cache_ttl секунд.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+from ..utils.search_keys import normalize_email, normalize_phone_e164
+from .config import settings
+from .database import call_after_commit, fetch_in
+
+PHONE = 'phone'
+EMAIL = 'email'
+
+# Типы коммуникаций, попадающие в индекс
+_COMM_KINDS = {'PHONE': PHONE, 'EMAIL': EMAIL}
+
+_INSERT_SQL = '''
+    INSERT OR IGNORE INTO contact_lookup (kind, value, owner, owner_id, contact_id, company_id)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+
+class LookupCache:
+    """Потокобезопасный LRU-кэш с ограничением времени жизни записей"""
+
+    def __init__(self, maxsize: Optional[int] = None, ttl: Optional[float] = None):
+        self.maxsize = maxsize if maxsize is not None else settings.contact_lookup_cache_size
+        self.ttl = ttl if ttl is not None else settings.contact_lookup_cache_ttl
+        self._items: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    @property
+    def generation(self) -> int:
+        """Номер поколения; запоминается до чтения из БД и передаётся в put()"""
+        return self._generation
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            stored_at, value = item
+            if time.monotonic() - stored_at > self.ttl:
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Any, generation: Optional[int] = None) -> None:
+        """Сохраняет значение, если после чтения (generation) кэш не очищался"""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._items[key] = (time.monotonic(), value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._items.clear()
+
+
+lookup_cache = LookupCache()
+
+
+def create_lookup_table(conn) -> None:
+    """Создаёт таблицу обратного поиска"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS contact_lookup (
+            kind TEXT NOT NULL,
+            value TEXT NOT NULL,
+            owner TEXT NOT NULL,
+            owner_id INTEGER NOT NULL,
+            contact_id INTEGER,
+            company_id INTEGER,
+            PRIMARY KEY (kind, value, owner, owner_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_contact_lookup_owner ON contact_lookup(owner, owner_id)')
+
+
+def _entry(kind: str, raw: Any) -> Optional[Tuple[str, str]]:
+    value = normalize_phone_e164(raw) if kind == PHONE else normalize_email(raw)
+    return (kind, value) if value else None
+
+
+def _contact_entries(conn, contact_ids: List[int]) -> List[Tuple[Any, ...]]:
+    entries: List[Tuple[Any, ...]] = []
+    companies: Dict[int, Optional[int]] = {}
+    for row in fetch_in(conn, 'SELECT id, company_id, phone, email FROM contacts WHERE id IN ({ids})', contact_ids):
+        companies[row['id']] = row['company_id']
+        for kind, raw in ((PHONE, row['phone']), (EMAIL, row['email'])):
+            entry = _entry(kind, raw)
+            if entry:
+                entries.append(entry + ('contact', row['id'], row['id'], row['company_id']))
+    for row in fetch_in(
+        conn,
+        'SELECT contact_id, comm_type, value FROM contact_communications WHERE contact_id IN ({ids})',
+        contact_ids,
+    ):
+        kind = _COMM_KINDS.get((row['comm_type'] or '').upper())
+        entry = _entry(kind, row['value']) if kind else None
+        if entry and row['contact_id'] in companies:
+            contact_id = row['contact_id']
+            entries.append(entry + ('contact', contact_id, contact_id, companies[contact_id]))
+    return entries
+
+
+def _customer_entries(conn, customer_ids: List[int]) -> List[Tuple[Any, ...]]:
+    entries: List[Tuple[Any, ...]] = []
+    existing: Set[int] = set()
+    for row in fetch_in(conn, 'SELECT id, phone, email FROM customers WHERE id IN ({ids})', customer_ids):
+        existing.add(row['id'])
+        for kind, raw in ((PHONE, row['phone']), (EMAIL, row['email'])):
+            entry = _entry(kind, raw)
+            if entry:
+                entries.append(entry + ('customer', row['id'], None, row['id']))
+    for row in fetch_in(
+        conn,
+        'SELECT customer_id, contact_type, value FROM customer_contacts WHERE customer_id IN ({ids})',
+        customer_ids,
+    ):
+        kind = _COMM_KINDS.get((row['contact_type'] or '').upper())
+        entry = _entry(kind, row['value']) if kind else None
+        if entry and row['customer_id'] in existing:
+            entries.append(entry + ('customer', row['customer_id'], None, row['customer_id']))
+    return entries
+
+
+def _replace(conn, owner: str, owner_ids: Iterable[int], entries: List[Tuple[Any, ...]]) -> None:
+    conn.executemany(
+        'DELETE FROM contact_lookup WHERE owner = ? AND owner_id = ?',
+        [(owner, owner_id) for owner_id in owner_ids],
+    )
+    conn.executemany(_INSERT_SQL, entries)
+    call_after_commit(conn, lookup_cache.clear)
+
+
+def refresh_contact(conn, contact_id: int) -> None:
+    """Перестраивает записи контакта (после создания, изменения или удаления)"""
+    _replace(conn, 'contact', [contact_id], _contact_entries(conn, [contact_id]))
+
+
+def refresh_customer(conn, customer_id: int) -> None:
+    """Перестраивает записи компании (после создания, изменения или удаления)"""
+    _replace(conn, 'customer', [customer_id], _customer_entries(conn, [customer_id]))
+
+
+def rebuild_lookup(conn) -> None:
+    """Заполняет таблицу заново по всем контактам и компаниям"""
+    conn.execute('DELETE FROM contact_lookup')
+    contact_ids = [row[0] for row in conn.execute('SELECT id FROM contacts').fetchall()]
+    customer_ids = [row[0] for row in conn.execute('SELECT id FROM customers').fetchall()]
+    conn.executemany(_INSERT_SQL, _contact_entries(conn, contact_ids))
+    conn.executemany(_INSERT_SQL, _customer_entries(conn, customer_ids))
+    call_after_commit(conn, lookup_cache.clear)
+
+
+def _person_name(row: Any) -> str:
+    return ' '.join(filter(None, [row['last_name'], row['first_name'], row['middle_name']])).strip()
+
+
+def lookup(conn, kind: str, value: str) -> List[Dict[str, Any]]:
+    """
+    Находит контакты и компании по нормализованному значению
+
+    Совпадения с контактами идут первыми (активные, затем недавно
+    изменённые), за ними - совпадения только с компанией.
+    """
+    rows = conn.execute('''
+        SELECT l.owner, c.id AS contact_id, cu.id AS company_id,
+               c.first_name, c.middle_name, c.last_name, cu.name AS company_name
+        FROM contact_lookup l
+        LEFT JOIN contacts c ON c.id = l.contact_id
+        LEFT JOIN customers cu ON cu.id = l.company_id
+        WHERE l.kind = ? AND l.value = ?
+        ORDER BY l.owner = 'customer', c.is_active DESC, c.updated_at DESC, cu.is_active DESC
+    ''', (kind, value)).fetchall()
+    matches = []
+    for row in rows:
+        contact = None
+        if row['contact_id'] is not None:
+            contact = {'id': row['contact_id'], 'name': _person_name(row)}
+        company = None
+        if row['company_id'] is not None:
+            company = {'id': row['company_id'], 'name': row['company_name']}
+        if contact or company:
+            matches.append({'contact': contact, 'company': company, 'matched_by': kind})
+    return matches
+
+
+if __name__ == "__main__":
+    from .database import db_manager
+
+    with db_manager.get_connection() as connection:
+        rebuild_lookup(connection)
+    print("Таблица обратного поиска контактов перестроена")
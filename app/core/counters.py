@@ -0,0 +1,168 @@
+"""
+Счётчики записей для списков
+
+Таблица entity_counts хранит количество строк по каждому значению
+основных фильтров (воронка, стадия, ответственный, is_closed, is_active)
+и общее количество. Поддерживается триггерами SQLite, поэтому итог
+без фильтров или с одним таким фильтром читается одной строкой по ключу.
+Для прочих комбинаций фильтров итог считается COUNT(*) OVER() в том же
+запросе, что и страница.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+# Таблица -> колонки-измерения, по которым ведутся счётчики
+COUNTED_DIMENSIONS: Dict[str, Tuple[str, ...]] = {
+    'deals': ('funnel_id', 'stage_id', 'responsible_user_id', 'is_closed'),
+    'customers': ('is_active', 'customer_type'),
+    'contacts': ('is_active', 'responsible_user_id', 'company_id'),
+}
+
+# Измерение общего количества строк таблицы
+TOTAL_DIMENSION = '*'
+
+
+def _increment_sql(entity: str, dimension: str, value_expr: str, delta: int) -> str:
+    if delta > 0:
+        return f'''
+            INSERT INTO entity_counts (entity, dimension, value, count)
+            SELECT '{entity}', '{dimension}', {value_expr}, {delta} WHERE {value_expr} IS NOT NULL
+            ON CONFLICT (entity, dimension, value) DO UPDATE SET count = count + {delta};'''
+    return f'''
+            UPDATE entity_counts SET count = count - {-delta}
+            WHERE entity = '{entity}' AND dimension = '{dimension}' AND value = {value_expr};'''
+
+
+def create_count_triggers(conn) -> None:
+    """Создаёт таблицу счётчиков и триггеры на INSERT/UPDATE/DELETE"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS entity_counts (
+            entity TEXT NOT NULL,
+            dimension TEXT NOT NULL,
+            value,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (entity, dimension, value)
+        ) WITHOUT ROWID
+    ''')
+    for entity, dimensions in COUNTED_DIMENSIONS.items():
+        inserts = [_increment_sql(entity, TOTAL_DIMENSION, '0', 1)]
+        inserts += [_increment_sql(entity, dim, f'NEW.{dim}', 1) for dim in dimensions]
+        deletes = [_increment_sql(entity, TOTAL_DIMENSION, '0', -1)]
+        deletes += [_increment_sql(entity, dim, f'OLD.{dim}', -1) for dim in dimensions]
+
+        conn.execute(f'DROP TRIGGER IF EXISTS trg_{entity}_count_insert')
+        conn.execute(f'''
+            CREATE TRIGGER trg_{entity}_count_insert AFTER INSERT ON {entity}
+            BEGIN{''.join(inserts)}
+            END
+        ''')
+        conn.execute(f'DROP TRIGGER IF EXISTS trg_{entity}_count_delete')
+        conn.execute(f'''
+            CREATE TRIGGER trg_{entity}_count_delete AFTER DELETE ON {entity}
+            BEGIN{''.join(deletes)}
+            END
+        ''')
+        for dim in dimensions:
+            conn.execute(f'DROP TRIGGER IF EXISTS trg_{entity}_count_update_{dim}')
+            conn.execute(f'''
+                CREATE TRIGGER trg_{entity}_count_update_{dim} AFTER UPDATE OF {dim} ON {entity}
+                WHEN OLD.{dim} IS NOT NEW.{dim}
+                BEGIN{_increment_sql(entity, dim, f'OLD.{dim}', -1)}{_increment_sql(entity, dim, f'NEW.{dim}', 1)}
+                END
+            ''')
+
+
+def rebuild_counts(conn, entity: Optional[str] = None) -> None:
+    """Пересчитывает счётчики по фактическим данным (после сбоя или ручных правок)"""
+    entities = [entity] if entity else list(COUNTED_DIMENSIONS)
+    for name in entities:
+        conn.execute('DELETE FROM entity_counts WHERE entity = ?', (name,))
+        conn.execute(
+            f"INSERT INTO entity_counts (entity, dimension, value, count) "
+            f"SELECT ?, ?, 0, COUNT(*) FROM {name}",
+            (name, TOTAL_DIMENSION),
+        )
+        for dim in COUNTED_DIMENSIONS[name]:
+            conn.execute(
+                f"INSERT INTO entity_counts (entity, dimension, value, count) "
+                f"SELECT ?, ?, {dim}, COUNT(*) FROM {name} WHERE {dim} IS NOT NULL GROUP BY {dim}",
+                (name, dim),
+            )
+
+
+def lookup_count(conn, entity: str, filters: Optional[Dict[str, Any]]) -> Optional[int]:
+    """
+    Возвращает итог из entity_counts
+
+    Args:
+        filters: Применённые фильтры-равенства (None - есть другие фильтры)
+
+    Returns:
+        Количество строк или None, если комбинацию фильтров нельзя
+        получить из счётчиков
+    """
+    if filters is None:
+        return None
+    active = {key: value for key, value in filters.items() if value is not None}
+    if not active:
+        dimension, value = TOTAL_DIMENSION, 0
+    elif len(active) == 1:
+        dimension, value = next(iter(active.items()))
+        if dimension not in COUNTED_DIMENSIONS.get(entity, ()):
+            return None
+        if isinstance(value, bool):
+            value = int(value)
+    else:
+        return None
+    row = conn.execute(
+        'SELECT count FROM entity_counts WHERE entity = ? AND dimension = ? AND value = ?',
+        (entity, dimension, value),
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def fetch_page(
+    conn,
+    entity: str,
+    query: str,
+    params: List[Any],
+    filters: Optional[Dict[str, Any]],
+    tail: str,
+    tail_params: List[Any],
+) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Выбирает страницу и итоговое количество
+
+    Args:
+        query: 'SELECT ... FROM <entity> WHERE ...' с фильтрами, без сортировки
+        filters: Фильтры-равенства из query (None - есть другие фильтры)
+        tail: Условие курсора, ORDER BY и LIMIT для выборки страницы
+            (колонки указываются без префикса таблицы)
+
+    Returns:
+        Кортеж (строки страницы в виде словарей, общее количество)
+    """
+    total = lookup_count(conn, entity, filters)
+    if total is not None:
+        rows = conn.execute(f'SELECT * FROM ({query}) {tail}', params + tail_params).fetchall()
+        return [dict(row) for row in rows], total
+
+    # Итог считается оконной функцией в том же запросе
+    windowed = query.replace('SELECT ', 'SELECT COUNT(*) OVER () AS _total, ', 1)
+    rows = [dict(row) for row in conn.execute(f'SELECT * FROM ({windowed}) {tail}', params + tail_params).fetchall()]
+    if rows:
+        total = rows[0]['_total']
+        for row in rows:
+            row.pop('_total', None)
+        return rows, total
+
+    # Пустая страница (за концом выборки): отдельный подсчёт
+    count_query = f'SELECT COUNT(*) FROM ({query})'
+    return rows, conn.execute(count_query, params).fetchone()[0]
+
+
+if __name__ == "__main__":
+    from .database import db_manager
+
+    with db_manager.get_connection() as connection:
+        rebuild_counts(connection)
+    print("Счётчики пересчитаны")
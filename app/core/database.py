@@ -1,10 +1,12 @@
 """
 Управление базой данных с репозиториями
 """
+import logging
 import sqlite3
 import os
+import threading
 from contextlib import contextmanager
-from typing import Generator, Optional, Dict, Any, List
+from typing import Callable, Generator, Optional, Dict, Any, List
 from sqlalchemy import create_engine, MetaData
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
@@ -13,6 +15,10 @@ import bcrypt
 
 from .config import settings
 from .exceptions import AppException
+from .db_metrics import InstrumentedConnection
+from .row_mappers import RowMapper, column
+
+logger = logging.getLogger(__name__)
 
 # SQLAlchemy настройки
 SQLALCHEMY_DATABASE_URL = settings.database_url
@@ -44,6 +50,94 @@ def get_db() -> Generator[Session, None, None]:
         db.close()
 
 
+# Ограничение числа параметров в одном запросе (SQLITE_MAX_VARIABLE_NUMBER)
+IN_CHUNK_SIZE = 500
+
+
+# Отложенные до фиксации действия: id соединения -> колбэки (пока открыт внешний блок)
+_after_commit: Dict[int, List[Callable[[], None]]] = {}
+
+
+def call_after_commit(conn, callback: Callable[[], None]) -> None:
+    """
+    Выполняет callback после фиксации транзакции соединения
+
+    Внутри блока get_connection() вызов откладывается до фиксации на
+    внешнем уровне и отменяется при откате (в том числе при откате
+    вложенного блока, в котором он зарегистрирован). Вне блока callback
+    выполняется сразу.
+    """
+    callbacks = _after_commit.get(id(conn))
+    if callbacks is None:
+        callback()
+    else:
+        callbacks.append(callback)
+
+
+def begin_immediate(conn) -> None:
+    """
+    Берёт блокировку записи для чтения-изменения-записи в одной транзакции
+
+    Во вложенном блоке get_connection() транзакция уже открыта внешним
+    уровнем, и BEGIN IMMEDIATE не выполняется.
+    """
+    if not conn.in_transaction:
+        conn.execute('BEGIN IMMEDIATE')
+
+
+def fetch_in(conn, query: str, ids: List[Any]) -> List[Any]:
+    """
+    Выполняет запрос с плейсхолдером {ids} для списка ID (частями)
+
+    Args:
+        query: SQL с "IN ({ids})"; фигурные скобки в остальном тексте удваиваются
+        ids: Значения для IN
+
+    Returns:
+        Строки всех частей в порядке выполнения
+    """
+    rows = []
+    for start in range(0, len(ids), IN_CHUNK_SIZE):
+        chunk = ids[start:start + IN_CHUNK_SIZE]
+        placeholders = ', '.join('?' * len(chunk))
+        rows.extend(conn.execute(query.format(ids=placeholders), chunk).fetchall())
+    return rows
+
+
+# Мапперы строк users/proposals: старые базы могут не содержать части колонок
+_USER_COLUMNS = [
+    column('id'),
+    column('login', 'login', 'username'),  # fallback для старых записей
+    column('username'),
+    column('full_name', default='', none_to_default=True),
+    column('email'),
+    column('phone', default='', none_to_default=True),
+    column('role', default='manager', none_to_default=True),
+    column('is_admin', convert=bool),
+    column('is_active', convert=bool),
+    column('created_at'),
+    column('updated_at', default='', none_to_default=True),
+]
+
+USER_MAPPER = RowMapper(_USER_COLUMNS)
+USER_WITH_PASSWORD_MAPPER = RowMapper(_USER_COLUMNS[:7] + [column('password_hash')] + _USER_COLUMNS[7:])
+
+PROPOSAL_MAPPER = RowMapper([
+    column('id'),
+    column('user_id'),
+    column('company', default=''),
+    column('productType'),
+    column('material'),
+    column('materialGrade'),
+    column('dimensions'),
+    column('selectedOperations'),
+    column('result'),
+    column('created_at'),
+    column('status', default=''),
+    column('priority', default=''),
+])
+
+
 class DatabaseManager:
     """Менеджер для работы с базой данных (legacy поддержка)"""
     
@@ -52,20 +146,119 @@ class DatabaseManager:
             self.db_path = os.path.join(os.path.dirname(__file__), '..', '..', 'users.db')
         else:
             self.db_path = db_path
+        # Пул соединений: одно постоянное соединение на поток (и на процесс-воркер)
+        self._local = threading.local()
+        self._pool_lock = threading.Lock()
+        self._pool: Dict[threading.Thread, sqlite3.Connection] = {}
+    
+    def _create_connection(self) -> sqlite3.Connection:
+        """Открывает соединение и настраивает его параметрами из Settings"""
+        # Соединение используется только своим потоком; check_same_thread
+        # отключён, чтобы close_all() мог закрыть его при остановке
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=settings.sqlite_busy_timeout / 1000,
+            check_same_thread=False,
+            factory=InstrumentedConnection if settings.db_instrumentation else sqlite3.Connection,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA journal_mode = {settings.sqlite_journal_mode}")
+        conn.execute(f"PRAGMA synchronous = {settings.sqlite_synchronous}")
+        conn.execute(f"PRAGMA cache_size = {int(settings.sqlite_cache_size)}")
+        conn.execute(f"PRAGMA mmap_size = {int(settings.sqlite_mmap_size)}")
+        conn.execute(f"PRAGMA busy_timeout = {int(settings.sqlite_busy_timeout)}")
+        with self._pool_lock:
+            stale = self._prune_pool()
+            self._pool[threading.current_thread()] = conn
+        self._close_connections(stale)
+        return conn
+    
+    def _prune_pool(self) -> List[sqlite3.Connection]:
+        """Убирает из пула соединения завершившихся потоков (вызывается под _pool_lock)"""
+        dead = [thread for thread in self._pool if not thread.is_alive()]
+        return [self._pool.pop(thread) for thread in dead]
+    
+    @staticmethod
+    def _close_connections(connections: List[sqlite3.Connection]) -> None:
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception:
+                pass
+    
+    def _acquire_connection(self) -> sqlite3.Connection:
+        """Возвращает соединение текущего потока, создавая его при первом обращении"""
+        local = self._local
+        conn = getattr(local, 'conn', None)
+        # После fork() соединение родительского процесса использовать нельзя
+        if conn is None or getattr(local, 'pid', None) != os.getpid():
+            conn = self._create_connection()
+            local.conn = conn
+            local.pid = os.getpid()
+            local.depth = 0
+        return conn
     
     @contextmanager
     def get_connection(self) -> Generator[sqlite3.Connection, None, None]:
-        """Контекстный менеджер для работы с базой данных"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
+        """
+        Контекстный менеджер для работы с базой данных
+    
+        Соединение берётся из пула и не закрывается после выхода из блока.
+        Вложенные блоки в одном потоке получают то же соединение; фиксация
+        и откат транзакции выполняются только на внешнем уровне. Вложенный
+        блок работает в точке сохранения (SAVEPOINT): при ошибке откатываются
+        только его изменения. Сервисы не вызывают conn.commit() сами;
+        действия, которые должны видеть зафиксированные данные (сброс
+        кэшей), регистрируются через call_after_commit().
+        """
+        conn = self._acquire_connection()
+        local = self._local
+        local.depth += 1
+        savepoint = None
+        if local.depth == 1:
+            _after_commit[id(conn)] = []
+        callbacks = _after_commit.setdefault(id(conn), [])
+        registered = len(callbacks)
         try:
+            if local.depth > 1:
+                # Транзакцией владеет внешний блок; вложенный - точка сохранения
+                if not conn.in_transaction:
+                    conn.execute('BEGIN')
+                savepoint = f'nested_{local.depth}'
+                conn.execute(f'SAVEPOINT {savepoint}')
             yield conn
-            conn.commit()
+            if savepoint:
+                conn.execute(f'RELEASE {savepoint}')
+            else:
+                conn.commit()
         except Exception as e:
-            conn.rollback()
-            raise AppException(f"Ошибка базы данных: {str(e)}")
+            if savepoint:
+                # Откатываются только изменения вложенного блока
+                if conn.in_transaction:
+                    conn.execute(f'ROLLBACK TO {savepoint}')
+                    conn.execute(f'RELEASE {savepoint}')
+                del callbacks[registered:]
+            else:
+                conn.rollback()
+                _after_commit.pop(id(conn), None)
+            if isinstance(e, AppException):
+                raise
+            raise AppException(f"Ошибка базы данных: {str(e)}") from e
         finally:
-            conn.close()
+            local.depth -= 1
+        if not savepoint:
+            for callback in _after_commit.pop(id(conn), []):
+                try:
+                    callback()
+                except Exception:
+                    logger.exception("Ошибка действия после фиксации транзакции")
+    
+    def close_all(self) -> None:
+        """Закрывает все соединения пула (при остановке приложения)"""
+        with self._pool_lock:
+            connections, self._pool = list(self._pool.values()), {}
+        self._close_connections(connections)
+        self._local = threading.local()
     
     def init_database(self):
         """Инициализация базы данных"""
@@ -249,44 +442,13 @@ class DatabaseManager:
         """Возвращает список всех пользователей"""
         with self.get_connection() as conn:
             cursor = conn.execute('SELECT * FROM users ORDER BY created_at DESC')
-            users: List[Dict[str, Any]] = []
-            for row in cursor.fetchall():
-                users.append({
-                    'id': row['id'],
-                    'login': row['login'] if 'login' in row.keys() else row['username'],  # fallback для старых записей
-                    'username': row['username'],
-                    'full_name': row['full_name'] if 'full_name' in row.keys() and row['full_name'] is not None else '',
-                    'email': row['email'],
-                    'phone': row['phone'] if 'phone' in row.keys() and row['phone'] is not None else '',
-                    'role': row['role'] if 'role' in row.keys() and row['role'] is not None else 'manager',
-                    'is_admin': bool(row['is_admin']),
-                    'is_active': bool(row['is_active']),
-                    'created_at': row['created_at'],
-                    'updated_at': row['updated_at'] if 'updated_at' in row.keys() and row['updated_at'] is not None else ''
-                })
-            return users
+            return USER_MAPPER.map_all(cursor)
 
     def get_user_by_id(self, user_id: int) -> Optional[Dict[str, Any]]:
         """Возвращает пользователя по ID"""
         with self.get_connection() as conn:
             cursor = conn.execute('SELECT * FROM users WHERE id = ?', (user_id,))
-            row = cursor.fetchone()
-            if row:
-                return {
-                    'id': row['id'],
-                    'login': row['login'] if 'login' in row.keys() else row['username'],
-                    'username': row['username'],
-                    'full_name': row['full_name'] if 'full_name' in row.keys() and row['full_name'] is not None else '',
-                    'email': row['email'],
-                    'phone': row['phone'] if 'phone' in row.keys() and row['phone'] is not None else '',
-                    'role': row['role'] if 'role' in row.keys() and row['role'] is not None else 'manager',
-                    'password_hash': row['password_hash'],
-                    'is_admin': bool(row['is_admin']),
-                    'is_active': bool(row['is_active']),
-                    'created_at': row['created_at'],
-                    'updated_at': row['updated_at'] if 'updated_at' in row.keys() and row['updated_at'] is not None else ''
-                }
-            return None
+            return USER_WITH_PASSWORD_MAPPER.map_one(cursor)
 
     def create_user(self, login: str, username: str, email: str, password: str, 
                    full_name: str = None, phone: str = None, role: str = 'manager', 
@@ -300,7 +462,6 @@ class DatabaseManager:
                 (login, username, full_name, email, phone, role, password_hash, 
                  1 if is_admin else 0, 1)
             )
-            conn.commit()
             return cursor.lastrowid
 
     def update_user(self, user_id: int, login: str = None, username: str = None, 
@@ -342,26 +503,9 @@ class DatabaseManager:
                 values.append(user_id)
                 sql = f"UPDATE users SET {', '.join(set_clauses)} WHERE id = ?"
                 conn.execute(sql, values)
-                conn.commit()
             
             cursor = conn.execute('SELECT * FROM users WHERE id = ?', (user_id,))
-            row = cursor.fetchone()
-            if row:
-                return {
-                    'id': row['id'],
-                    'login': row['login'] if 'login' in row.keys() else row['username'],
-                    'username': row['username'],
-                    'full_name': row['full_name'] if 'full_name' in row.keys() and row['full_name'] is not None else '',
-                    'email': row['email'],
-                    'phone': row['phone'] if 'phone' in row.keys() and row['phone'] is not None else '',
-                    'role': row['role'] if 'role' in row.keys() and row['role'] is not None else 'manager',
-                    'password_hash': row['password_hash'],
-                    'is_admin': bool(row['is_admin']),
-                    'is_active': bool(row['is_active']),
-                    'created_at': row['created_at'],
-                    'updated_at': row['updated_at'] if 'updated_at' in row.keys() and row['updated_at'] is not None else ''
-                }
-            return None
+            return USER_WITH_PASSWORD_MAPPER.map_one(cursor)
 
     def change_user_password(self, user_id: int, new_password: str) -> bool:
         """Меняет пароль пользователя"""
@@ -371,7 +515,6 @@ class DatabaseManager:
                 'UPDATE users SET password_hash = ? WHERE id = ?',
                 (new_hash, user_id)
             )
-            conn.commit()
             return cursor.rowcount > 0
 
     def toggle_admin_status(self, user_id: int) -> Optional[bool]:
@@ -383,7 +526,6 @@ class DatabaseManager:
                 return None
             new_value = 0 if row['is_admin'] else 1
             conn.execute('UPDATE users SET is_admin = ? WHERE id = ?', (new_value, user_id))
-            conn.commit()
             return bool(new_value)
 
     def toggle_user_active_status(self, user_id: int) -> Optional[bool]:
@@ -395,7 +537,6 @@ class DatabaseManager:
                 return None
             new_value = 0 if row['is_active'] else 1
             conn.execute('UPDATE users SET is_active = ? WHERE id = ?', (new_value, user_id))
-            conn.commit()
             return bool(new_value)
 
     def delete_user(self, user_id: int) -> bool:
@@ -408,7 +549,6 @@ class DatabaseManager:
             if row['is_admin']:
                 return False
             cursor = conn.execute('DELETE FROM users WHERE id = ?', (user_id,))
-            conn.commit()
             return cursor.rowcount > 0
     
     def get_proposals(self, user_id: int = None):
@@ -419,47 +559,13 @@ class DatabaseManager:
             else:
                 cursor = conn.execute('SELECT * FROM proposals ORDER BY created_at DESC')
             
-            proposals = []
-            for row in cursor.fetchall():
-                proposal = {
-                    'id': row['id'],
-                    'user_id': row['user_id'],
-                    'company': row['company'] if 'company' in row.keys() else '',
-                    'productType': row['productType'],
-                    'material': row['material'],
-                    'materialGrade': row['materialGrade'],
-                    'dimensions': row['dimensions'],
-                    'selectedOperations': row['selectedOperations'],
-                    'result': row['result'],
-                    'created_at': row['created_at'],
-                    'status': row['status'] if 'status' in row.keys() else '',
-                    'priority': row['priority'] if 'priority' in row.keys() else ''
-                }
-                proposals.append(proposal)
-            
-            return proposals
+            return PROPOSAL_MAPPER.map_all(cursor)
     
     def get_proposal_by_id(self, proposal_id: int) -> Optional[Dict[str, Any]]:
         """Получает одно предложение по ID"""
         with self.get_connection() as conn:
             cursor = conn.execute('SELECT * FROM proposals WHERE id = ?', (proposal_id,))
-            row = cursor.fetchone()
-            if row:
-                return {
-                    'id': row['id'],
-                    'user_id': row['user_id'],
-                    'company': row['company'] if 'company' in row.keys() else '',
-                    'productType': row['productType'],
-                    'material': row['material'],
-                    'materialGrade': row['materialGrade'],
-                    'dimensions': row['dimensions'],
-                    'selectedOperations': row['selectedOperations'],
-                    'result': row['result'],
-                    'created_at': row['created_at'],
-                    'status': row['status'] if 'status' in row.keys() else '',
-                    'priority': row['priority'] if 'priority' in row.keys() else ''
-                }
-            return None
+            return PROPOSAL_MAPPER.map_one(cursor)
 
     def save_proposal(self, proposal_data: dict) -> int:
         """Сохраняет новое предложение в базу данных"""
@@ -481,7 +587,6 @@ class DatabaseManager:
                 proposal_data.get('status', ''),
                 proposal_data.get('priority', '')
             ))
-            conn.commit()
             return cursor.lastrowid
     
     def update_proposal(self, proposal_id: int, proposal_data: dict) -> dict:
@@ -530,33 +635,15 @@ class DatabaseManager:
             sql = f"UPDATE proposals SET {', '.join(set_clauses)} WHERE id = ?"
             
             cursor = conn.execute(sql, values)
-            conn.commit()
             
             # Возвращаем обновленное предложение
             cursor = conn.execute('SELECT * FROM proposals WHERE id = ?', (proposal_id,))
-            row = cursor.fetchone()
-            if row:
-                return {
-                    'id': row['id'],
-                    'user_id': row['user_id'],
-                    'company': row['company'] if 'company' in row.keys() else '',
-                    'productType': row['productType'],
-                    'material': row['material'],
-                    'materialGrade': row['materialGrade'],
-                    'dimensions': row['dimensions'],
-                    'selectedOperations': row['selectedOperations'],
-                    'result': row['result'],
-                    'created_at': row['created_at'],
-                    'status': row['status'] if 'status' in row.keys() else '',
-                    'priority': row['priority'] if 'priority' in row.keys() else ''
-                }
-            return None
+            return PROPOSAL_MAPPER.map_one(cursor)
     
     def delete_proposal(self, proposal_id: int) -> bool:
         """Удаляет предложение из базы данных"""
         with self.get_connection() as conn:
             cursor = conn.execute('DELETE FROM proposals WHERE id = ?', (proposal_id,))
-            conn.commit()
             return cursor.rowcount > 0
     
     def init_crm_tables(self):
@@ -926,8 +1013,6 @@ class DatabaseManager:
             conn.execute('CREATE INDEX IF NOT EXISTS idx_contact_tags_contact_id ON contact_tags(contact_id)')
             conn.execute('CREATE INDEX IF NOT EXISTS idx_contact_tags_tag ON contact_tags(tag)')
             
-            conn.commit()
-
 
 # Глобальный экземпляр для legacy поддержки
 db_manager = DatabaseManager()
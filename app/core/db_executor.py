@@ -0,0 +1,100 @@
+"""
+Выполнение блокирующих операций с базой данных вне event loop
+
+Сервисы работают с sqlite3 синхронно. Чтобы медленный запрос не
+останавливал остальные запросы воркера, вызовы выполняются в отдельном
+ограниченном пуле потоков. Каждый поток пула держит своё соединение из
+пула DatabaseManager, поэтому размер пула ограничивает и число соединений.
+"""
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, TypeVar
+
+from .config import settings
+
+T = TypeVar("T")
+
+
+class DatabaseExecutor:
+    """Пул потоков для синхронных обращений к базе данных"""
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers or settings.db_max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """Создаёт пул при первом обращении (после fork воркера)"""
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers,
+                        thread_name_prefix="db",
+                    )
+        return self._executor
+
+    async def run(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        Выполняет синхронную функцию в пуле потоков БД
+
+        Args:
+            func: Синхронная функция или метод сервиса
+            *args, **kwargs: Аргументы вызова
+
+        Returns:
+            Результат функции; исключения пробрасываются как есть
+        """
+        loop = asyncio.get_running_loop()
+        call = functools.partial(func, *args, **kwargs)
+        # Контекст (в т.ч. статистика запросов) передаётся в поток пула
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self._get_executor(), context.run, call)
+
+    def shutdown(self) -> None:
+        """Останавливает пул, дожидаясь завершения начатых запросов"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+class AsyncServiceProxy:
+    """
+    Асинхронная обёртка над синхронным сервисом
+
+    Публичные методы сервиса становятся корутинами, выполняемыми в пуле
+    потоков БД: `await deals.get_by_id(1)` вместо `service.get_by_id(1)`.
+    """
+
+    def __init__(self, service: Any, executor: Optional[DatabaseExecutor] = None):
+        self._service = service
+        self._executor = executor or db_executor
+
+    @property
+    def sync(self) -> Any:
+        """Исходный синхронный сервис"""
+        return self._service
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._service, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            return await self._executor.run(attr, *args, **kwargs)
+
+        return wrapper
+
+
+# Глобальный пул для всех обращений к БД из API
+db_executor = DatabaseExecutor()
+
+
+async def run_in_db(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Выполняет синхронную функцию работы с БД в общем пуле потоков"""
+    return await db_executor.run(func, *args, **kwargs)
@@ -0,0 +1,107 @@
+"""
+Инструментирование запросов к SQLite
+
+Соединения DatabaseManager создаются с фабрикой InstrumentedConnection:
+каждый execute/executemany (соединения или курсора conn.cursor())
+засекается и записывается в статистику текущего HTTP-запроса
+(contextvars). LoggingMiddleware открывает статистику на время запроса
+и выводит её в заголовки ответа.
+"""
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar, Token
+from typing import List, Optional, Tuple
+
+_IN_LIST_RE = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE)
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_SPACES_RE = re.compile(r'\s+')
+
+
+def normalize_sql(sql: str) -> str:
+    """Форма запроса: без литералов и с IN (?, ?, ...) свёрнутым в IN (...)"""
+    shape = _STRING_RE.sub('?', sql)
+    shape = _NUMBER_RE.sub('?', shape)
+    shape = _IN_LIST_RE.sub('IN (...)', shape)
+    return _SPACES_RE.sub(' ', shape).strip()
+
+
+class QueryStats:
+    """Статистика SQL-запросов в рамках одного HTTP-запроса"""
+
+    def __init__(self, slow_threshold: float):
+        self.slow_threshold = slow_threshold
+        self.count = 0
+        self.total_time = 0.0
+        self.slow: List[Tuple[float, str]] = []
+        self.shapes: Counter = Counter()
+        # Запросы одного HTTP-запроса могут идти из разных потоков пула
+        self._lock = threading.Lock()
+
+    def record(self, sql: str, duration: float) -> None:
+        shape = normalize_sql(sql)
+        with self._lock:
+            self.count += 1
+            self.total_time += duration
+            self.shapes[shape] += 1
+            if duration >= self.slow_threshold:
+                self.slow.append((duration, shape))
+
+    def repeated(self, threshold: int) -> List[Tuple[str, int]]:
+        """Формы запросов, выполненные больше threshold раз (признак N+1)"""
+        return [(shape, count) for shape, count in self.shapes.most_common() if count > threshold]
+
+
+_current_stats: ContextVar[Optional[QueryStats]] = ContextVar('db_query_stats', default=None)
+
+
+def start_query_stats(slow_threshold: float) -> Tuple[QueryStats, Token]:
+    """Начинает сбор статистики для текущего контекста"""
+    stats = QueryStats(slow_threshold)
+    return stats, _current_stats.set(stats)
+
+
+def stop_query_stats(token: Token) -> None:
+    _current_stats.reset(token)
+
+
+def current_query_stats() -> Optional[QueryStats]:
+    return _current_stats.get()
+
+
+def _timed(method, sql, *args, **kwargs):
+    """Выполняет execute/executemany и записывает запрос в статистику контекста"""
+    stats = _current_stats.get()
+    if stats is None:
+        return method(sql, *args, **kwargs)
+    started = time.perf_counter()
+    try:
+        return method(sql, *args, **kwargs)
+    finally:
+        stats.record(sql, time.perf_counter() - started)
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Курсор, замеряющий время выполнения запросов (conn.cursor().execute)"""
+
+    def execute(self, sql, *args, **kwargs):
+        return _timed(super().execute, sql, *args, **kwargs)
+
+    def executemany(self, sql, *args, **kwargs):
+        return _timed(super().executemany, sql, *args, **kwargs)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Соединение, замеряющее время выполнения запросов"""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, *args, **kwargs):
+        return _timed(super().execute, sql, *args, **kwargs)
+
+    def executemany(self, sql, *args, **kwargs):
+        return _timed(super().executemany, sql, *args, **kwargs)
@@ -0,0 +1,203 @@
+"""
+Полнотекстовый поиск по сделкам (SQLite FTS5)
+
+Виртуальная таблица deal_search содержит по документу на сделку
+(title, description), комментарий (text) и товар сделки (name,
+description). Документы поддерживаются триггерами, rowid вычисляется из
+id источника (id * 4 + вид), поэтому обновление и удаление документа -
+операция по ключу, без сканирования индекса.
+
+Выдача строится из документов, прочитанных по rank с LIMIT, без
+ранжирования всех совпадений; общее количество сделок считается
+отдельным запросом до предела (deal_search_total_cap).
+"""
+import re
+from typing import Any, Dict, List, Tuple
+
+from .database import fetch_in
+
+# Вид документа -> смещение rowid
+DOCUMENT_KINDS: Dict[str, int] = {
+    'deal': 0,
+    'comment': 1,
+    'product': 2,
+}
+_ROWID_STRIDE = 4
+
+# Вес заголовка относительно текста в bm25
+TITLE_WEIGHT = 10.0
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+_MAX_TOKENS = 8
+
+# Документов на сделку в первой выборке по rank; при нехватке сделок выборка растёт во столько же раз
+_FETCH_FACTOR = 4
+
+
+def _rowid(kind: str, id_expr: str) -> str:
+    return f'{id_expr} * {_ROWID_STRIDE} + {DOCUMENT_KINDS[kind]}'
+
+
+def _insert_sql(kind: str, ref: str, title: str, body: str, deal_id: str, when: str = '') -> str:
+    where = f' WHERE {when}' if when else ''
+    return f'''
+            INSERT INTO deal_search (rowid, title, body, deal_id, kind)
+            SELECT {_rowid(kind, f'{ref}.id')}, {title}, {body}, {deal_id}, '{kind}'{where};'''
+
+
+def _delete_sql(kind: str, ref: str) -> str:
+    return f'''
+            DELETE FROM deal_search WHERE rowid = {_rowid(kind, f'{ref}.id')};'''
+
+
+# Источники документов: таблица, вид, колонки (title, body), колонки-триггеры обновления, условие
+_SOURCES: List[Tuple[str, str, str, str, str, str]] = [
+    ('deals', 'deal', 'title', 'description', 'title, description', ''),
+    ('deal_comments', 'comment', 'NULL', 'text', 'text, is_deleted', 'NOT COALESCE({ref}.is_deleted, 0)'),
+    ('deal_products', 'product', 'name', 'description', 'name, description', ''),
+]
+
+
+def create_search_index(conn) -> None:
+    """Создаёт таблицу FTS5 и триггеры синхронизации"""
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS deal_search USING fts5(
+            title, body, deal_id UNINDEXED, kind UNINDEXED,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+    ''')
+    conn.execute(
+        "INSERT INTO deal_search (deal_search, rank) VALUES ('rank', ?)",
+        (f'bm25({TITLE_WEIGHT}, 1.0)',),
+    )
+
+    for table, kind, title, body, watched, condition in _SOURCES:
+        deal_id = 'NEW.id' if kind == 'deal' else 'NEW.deal_id'
+        insert = _insert_sql(
+            kind, 'NEW', f'NEW.{title}' if title != 'NULL' else title, f'NEW.{body}',
+            deal_id, condition.format(ref='NEW'),
+        )
+        delete = _delete_sql(kind, 'OLD')
+        if kind == 'deal':
+            # Комментарии и товары удаляемой сделки (каскад FK может быть выключен)
+            delete += f'''
+            DELETE FROM deal_search WHERE rowid IN (
+                SELECT {_rowid('comment', 'id')} FROM deal_comments WHERE deal_id = OLD.id
+                UNION ALL
+                SELECT {_rowid('product', 'id')} FROM deal_products WHERE deal_id = OLD.id
+            );'''
+
+        conn.execute(f'DROP TRIGGER IF EXISTS trg_{table}_search_insert')
+        conn.execute(f'''
+            CREATE TRIGGER trg_{table}_search_insert AFTER INSERT ON {table}
+            BEGIN{insert}
+            END
+        ''')
+        conn.execute(f'DROP TRIGGER IF EXISTS trg_{table}_search_update')
+        conn.execute(f'''
+            CREATE TRIGGER trg_{table}_search_update AFTER UPDATE OF {watched} ON {table}
+            BEGIN{_delete_sql(kind, 'OLD')}{insert}
+            END
+        ''')
+        conn.execute(f'DROP TRIGGER IF EXISTS trg_{table}_search_delete')
+        conn.execute(f'''
+            CREATE TRIGGER trg_{table}_search_delete AFTER DELETE ON {table}
+            BEGIN{delete}
+            END
+        ''')
+
+
+def rebuild_search_index(conn) -> None:
+    """Заполняет индекс заново по текущим данным"""
+    conn.execute('DELETE FROM deal_search')
+    for table, kind, title, body, _, condition in _SOURCES:
+        deal_id = 'id' if kind == 'deal' else 'deal_id'
+        conditions = [condition.format(ref=table)] if condition else []
+        if kind != 'deal':
+            # Комментарии и товары уже удалённых сделок не индексируются
+            conditions.append('deal_id IN (SELECT id FROM deals)')
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+        conn.execute(f'''
+            INSERT INTO deal_search (rowid, title, body, deal_id, kind)
+            SELECT {_rowid(kind, 'id')}, {title}, {body}, {deal_id}, '{kind}' FROM {table}{where}
+        ''')
+    conn.execute("INSERT INTO deal_search (deal_search) VALUES ('optimize')")
+
+
+def build_match_query(text: str) -> str:
+    """
+    Преобразует пользовательский запрос в выражение MATCH
+
+    Каждое слово ищется как префикс, слова объединяются через AND.
+    Операторы FTS5 во вводе не интерпретируются.
+
+    Raises:
+        ValueError: В запросе нет ни одного слова
+    """
+    tokens = _TOKEN_RE.findall(text or '')[:_MAX_TOKENS]
+    if not tokens:
+        raise ValueError("Поисковый запрос не содержит слов")
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def best_documents(conn, match: str, count: int) -> List[Any]:
+    """
+    Лучший документ каждой сделки в порядке релевантности (первые count сделок)
+
+    Документы читаются по rank с LIMIT и дедуплицируются по сделке в
+    Python; если сделок не хватило (у сделок по нескольку документов),
+    выборка расширяется. Документы несуществующих сделок пропускаются.
+    Меньше count сделок возвращается, только если совпадения исчерпаны.
+
+    Returns:
+        Строки doc_id, deal_id, kind, score
+    """
+    if count <= 0:
+        return []
+    fetch = count * _FETCH_FACTOR
+    while True:
+        rows = conn.execute('''
+            SELECT rowid AS doc_id, deal_id, kind, rank AS score
+            FROM deal_search
+            WHERE deal_search MATCH ?
+            ORDER BY rank
+            LIMIT ?
+        ''', (match, fetch)).fetchall()
+        best: Dict[Any, Any] = {}
+        for row in rows:
+            best.setdefault(row['deal_id'], row)
+        existing = {
+            row[0] for row in fetch_in(conn, 'SELECT id FROM deals WHERE id IN ({ids})', list(best))
+        }
+        found = [row for deal_id, row in best.items() if deal_id in existing]
+        if len(found) >= count or len(rows) < fetch:
+            return found[:count]
+        fetch *= _FETCH_FACTOR
+
+
+def count_matching_deals(conn, match: str, cap: int) -> Tuple[int, bool]:
+    """
+    Количество найденных сделок, но не больше cap
+
+    Returns:
+        Кортеж (количество, достигнут ли предел)
+    """
+    total = conn.execute('''
+        SELECT COUNT(*) FROM (
+            SELECT DISTINCT s.deal_id
+            FROM deal_search s
+            JOIN deals d ON d.id = s.deal_id
+            WHERE deal_search MATCH ?
+            LIMIT ?
+        )
+    ''', (match, cap + 1)).fetchone()[0]
+    return min(total, cap), total > cap
+
+
+if __name__ == "__main__":
+    from .database import db_manager
+
+    with db_manager.get_connection() as connection:
+        rebuild_search_index(connection)
+    print("Поисковый индекс сделок перестроен")
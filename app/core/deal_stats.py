@@ -0,0 +1,179 @@
+"""
+Сводка сделок клиентов и контактов
+
+Колонки DEAL_STATS_COLUMNS в customers (сделки с company_id) и contacts
+(сделки с primary_contact_id) ведутся триггерами на deals, поэтому
+карточки читают статистику без агрегирующих запросов:
+
+- deals_count - все сделки;
+- open_deals_count - незакрытые (is_closed = FALSE);
+- won_deals_count, won_amount - сделки на успешной стадии и их сумма;
+- last_deal_at - дата создания последней сделки.
+
+Триггер вычитает вклад старой строки сделки у прежнего владельца и
+добавляет вклад новой строки новому. last_deal_at при уходе сделки
+пересчитывается по индексу (владелец, created_at). rebuild_deal_stats
+пересчитывает всё одним проходом по deals (бэкфилл, починка).
+"""
+from typing import Any, Dict, List
+
+from ..utils.enums import StageSemanticId
+
+DEAL_STATS_COLUMNS = {
+    'deals_count': 'INTEGER NOT NULL DEFAULT 0',
+    'open_deals_count': 'INTEGER NOT NULL DEFAULT 0',
+    'won_deals_count': 'INTEGER NOT NULL DEFAULT 0',
+    'won_amount': 'REAL NOT NULL DEFAULT 0',
+    'last_deal_at': 'TIMESTAMP',
+}
+
+# Таблица владельца -> колонка deals, ссылающаяся на него
+DEAL_OWNERS: Dict[str, str] = {
+    'customers': 'company_id',
+    'contacts': 'primary_contact_id',
+}
+
+# Колонки сделки, от которых зависит сводка
+_WATCHED_COLUMNS = ('is_closed', 'stage_id', 'amount', 'created_at')
+
+
+def _won_sql(ref: str) -> str:
+    return (
+        f'COALESCE((SELECT stage_semantic_id FROM deal_stages WHERE id = {ref}.stage_id)'
+        f" = '{StageSemanticId.S.value}', 0)"
+    )
+
+
+def _apply_sql(table: str, owner_column: str, ref: str, sign: str) -> str:
+    """UPDATE владельца: добавляет (sign '+') или вычитает (sign '-') вклад строки сделки ref"""
+    won = _won_sql(ref)
+    if sign == '+':
+        last_deal_at = (
+            f'CASE WHEN last_deal_at IS NULL OR {ref}.created_at > last_deal_at '
+            f'THEN {ref}.created_at ELSE last_deal_at END'
+        )
+    else:
+        last_deal_at = f'(SELECT MAX(created_at) FROM deals WHERE {owner_column} = {ref}.{owner_column})'
+    return f'''
+            UPDATE {table} SET
+                deals_count = COALESCE(deals_count, 0) {sign} 1,
+                open_deals_count = open_deals_count {sign} (NOT COALESCE({ref}.is_closed, 0)),
+                won_deals_count = won_deals_count {sign} {won},
+                won_amount = won_amount {sign} {won} * COALESCE({ref}.amount, 0),
+                last_deal_at = {last_deal_at}
+            WHERE id = {ref}.{owner_column};'''
+
+
+def create_deal_stats(conn) -> None:
+    """Добавляет колонки сводки, индексы и триггеры на deals"""
+    for table, owner_column in DEAL_OWNERS.items():
+        existing = {row[1] for row in conn.execute(f'PRAGMA table_info({table})').fetchall()}
+        for name, definition in DEAL_STATS_COLUMNS.items():
+            if name not in existing:
+                conn.execute(f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
+        conn.execute(
+            f'CREATE INDEX IF NOT EXISTS idx_deals_{owner_column}_created_at ON deals({owner_column}, created_at)'
+        )
+
+        watched = ', '.join((owner_column,) + _WATCHED_COLUMNS)
+        conn.execute(f'DROP TRIGGER IF EXISTS trg_deals_{table}_stats_insert')
+        conn.execute(f'''
+            CREATE TRIGGER trg_deals_{table}_stats_insert AFTER INSERT ON deals
+            BEGIN{_apply_sql(table, owner_column, 'NEW', '+')}
+            END
+        ''')
+        conn.execute(f'DROP TRIGGER IF EXISTS trg_deals_{table}_stats_update')
+        conn.execute(f'''
+            CREATE TRIGGER trg_deals_{table}_stats_update AFTER UPDATE OF {watched} ON deals
+            BEGIN{_apply_sql(table, owner_column, 'OLD', '-')}{_apply_sql(table, owner_column, 'NEW', '+')}
+            END
+        ''')
+        conn.execute(f'DROP TRIGGER IF EXISTS trg_deals_{table}_stats_delete')
+        conn.execute(f'''
+            CREATE TRIGGER trg_deals_{table}_stats_delete AFTER DELETE ON deals
+            BEGIN{_apply_sql(table, owner_column, 'OLD', '-')}
+            END
+        ''')
+
+
+def _aggregate_sql(owner_column: str) -> str:
+    """Сводка по deals, сгруппированная по владельцу"""
+    won = f"COALESCE(s.stage_semantic_id = '{StageSemanticId.S.value}', 0)"
+    return f'''
+        SELECT d.{owner_column} AS owner_id,
+               COUNT(*) AS deals_count,
+               SUM(NOT COALESCE(d.is_closed, 0)) AS open_deals_count,
+               SUM({won}) AS won_deals_count,
+               TOTAL({won} * COALESCE(d.amount, 0)) AS won_amount,
+               MAX(d.created_at) AS last_deal_at
+        FROM deals d
+        LEFT JOIN deal_stages s ON s.id = d.stage_id
+        WHERE d.{owner_column} IS NOT NULL
+        GROUP BY d.{owner_column}
+    '''
+
+
+def rebuild_deal_stats(conn) -> None:
+    """Пересчитывает сводку всех клиентов и контактов по таблице deals"""
+    for table, owner_column in DEAL_OWNERS.items():
+        conn.execute(f'''
+            UPDATE {table} SET deals_count = 0, open_deals_count = 0, won_deals_count = 0,
+                               won_amount = 0, last_deal_at = NULL
+        ''')
+        conn.execute(f'''
+            UPDATE {table} SET
+                deals_count = agg.deals_count,
+                open_deals_count = agg.open_deals_count,
+                won_deals_count = agg.won_deals_count,
+                won_amount = agg.won_amount,
+                last_deal_at = agg.last_deal_at
+            FROM ({_aggregate_sql(owner_column)}) AS agg
+            WHERE {table}.id = agg.owner_id
+        ''')
+
+
+def check_deal_stats(conn) -> List[Dict[str, Any]]:
+    """
+    Сверяет сводку с фактическими данными deals
+
+    Returns:
+        Расхождения: таблица, id и значения колонок сводки (сохранённые и фактические)
+    """
+    mismatches = []
+    for table, owner_column in DEAL_OWNERS.items():
+        cursor = conn.execute(f'''
+            SELECT '{table}' AS entity, t.id,
+                   t.deals_count, COALESCE(agg.deals_count, 0) AS actual_deals_count,
+                   t.open_deals_count, COALESCE(agg.open_deals_count, 0) AS actual_open_deals_count,
+                   t.won_deals_count, COALESCE(agg.won_deals_count, 0) AS actual_won_deals_count,
+                   t.won_amount, COALESCE(agg.won_amount, 0) AS actual_won_amount,
+                   t.last_deal_at, agg.last_deal_at AS actual_last_deal_at
+            FROM {table} t
+            LEFT JOIN ({_aggregate_sql(owner_column)}) AS agg ON agg.owner_id = t.id
+            WHERE COALESCE(t.deals_count, 0) != COALESCE(agg.deals_count, 0)
+               OR t.open_deals_count != COALESCE(agg.open_deals_count, 0)
+               OR t.won_deals_count != COALESCE(agg.won_deals_count, 0)
+               OR ABS(t.won_amount - COALESCE(agg.won_amount, 0)) > 0.005
+               OR t.last_deal_at IS NOT agg.last_deal_at
+        ''')
+        columns = [d[0] for d in cursor.description]
+        mismatches.extend(dict(zip(columns, row)) for row in cursor.fetchall())
+    return mismatches
+
+
+if __name__ == "__main__":
+    import sys
+
+    from .database import db_manager
+
+    if '--check' in sys.argv[1:]:
+        with db_manager.get_connection() as connection:
+            mismatches = check_deal_stats(connection)
+        for item in mismatches:
+            print(item)
+        print(f"Расхождений сводки сделок: {len(mismatches)}")
+        sys.exit(1 if mismatches else 0)
+
+    with db_manager.get_connection() as connection:
+        rebuild_deal_stats(connection)
+    print("Сводка сделок клиентов и контактов пересчитана")
@@ -0,0 +1,368 @@
+"""
+Поиск и слияние дублей клиентов и контактов
+
+Попарное сравнение всех записей - O(n^2), поэтому кандидаты отбираются
+блоками: записи с общим ключом блока (ИНН, слово названия/ФИО, полный
+нормализованный ключ имени, телефон, email) сравниваются только между
+собой. Телефоны и email берутся из contact_lookup (там уже учтены
+коммуникации), имена - из колонок search_name. Блоки крупнее
+dedup_max_block_size (частые слова, общий телефон офиса) пропускаются:
+такой ключ ничего не говорит о дублировании. Блоки по отдельным словам
+строятся, только если порог ниже оценки, достижимой одним сходством
+имени: иначе пара, совпавшая лишь частью названия, в выдачу не попадёт.
+
+Каждая пара кандидатов оценивается взвешенной суммой признаков
+(WEIGHTS) от 0 до 1. Слияние переносит сделки, контакты, файлы,
+коммуникации и теги на целевую запись и удаляет исходные в одной
+транзакции.
+"""
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from ..utils.enums import ChangeType
+from ..utils.search_keys import normalize_email, normalize_phone_e164, normalize_text
+from .audit_writer import HistoryEntry, audit_writer
+from .config import settings
+from .contact_lookup import EMAIL, PHONE, refresh_contact, refresh_customer
+from .database import fetch_in
+from .name_search import refresh_search_keys
+
+CUSTOMERS = 'customers'
+CONTACTS = 'contacts'
+
+# Признак -> вес в оценке пары
+WEIGHTS: Dict[str, Dict[str, float]] = {
+    CUSTOMERS: {'inn': 0.6, 'name': 0.6, 'phone': 0.3, 'email': 0.3},
+    CONTACTS: {'name': 0.5, 'email': 0.45, 'phone': 0.35, 'company': 0.1},
+}
+
+# Множитель оценки клиентов с разными непустыми ИНН (разные юрлица)
+INN_CONFLICT_FACTOR = 0.3
+
+# Минимальное сходство названий (по Жаккару), считающееся совпадением имени
+NAME_MATCH_THRESHOLD = 0.5
+
+DEFAULT_MIN_SCORE = 0.6
+
+# Слова названий, не отличающие одну организацию от другой
+_NAME_STOPWORDS = frozenset({
+    'ооо', 'оао', 'зао', 'пао', 'ао', 'ип', 'нко', 'ано', 'тоо', 'чп', 'гк', 'тд', 'нпо', 'нпп',
+    'общество', 'с', 'ограниченной', 'ответственностью', 'компания', 'группа', 'фирма',
+    'llc', 'ltd', 'inc', 'gmbh', 'co',
+})
+_TOKEN_BLOCK_MIN_LENGTH = 3
+
+# Колонки, которые целевая запись получает от исходной, если у неё они пустые
+CUSTOMER_FILL_COLUMNS = (
+    'email', 'phone', 'address_legal', 'address_real', 'inn', 'kpp', 'ogrn', 'agreement',
+    'manager_name', 'manager_post', 'notes', 'annual_revenue', 'employees_count', 'industry',
+)
+CONTACT_FILL_COLUMNS = (
+    'first_name', 'middle_name', 'last_name', 'honorific', 'position', 'department', 'birthdate',
+    'photo_url', 'company_id', 'responsible_user_id', 'email', 'phone', 'last_activity_at',
+)
+
+
+def name_tokens(search_name: Optional[str]) -> FrozenSet[str]:
+    """Значимые слова ключа search_name (без организационно-правовых форм)"""
+    return frozenset((search_name or '').split()) - _NAME_STOPWORDS
+
+
+def _inn(value: Any) -> str:
+    digits = ''.join(ch for ch in str(value or '') if ch.isdigit())
+    return digits if len(digits) in (10, 12) else ''
+
+
+def _jaccard(left: FrozenSet[str], right: FrozenSet[str]) -> float:
+    if not left or not right:
+        return 0.0
+    return len(left & right) / len(left | right)
+
+
+def load_records(conn, entity: str) -> Dict[int, Dict[str, Any]]:
+    """Признаки всех записей для сравнения (один запрос к таблице и один к contact_lookup)"""
+    records: Dict[int, Dict[str, Any]] = {}
+    if entity == CUSTOMERS:
+        for row in conn.execute('SELECT id, name, search_name, inn FROM customers').fetchall():
+            records[row['id']] = {
+                'name': row['name'], 'tokens': name_tokens(row['search_name']),
+                'inn': _inn(row['inn']), 'company_id': None, PHONE: set(), EMAIL: set(),
+            }
+        owner = 'customer'
+    else:
+        for row in conn.execute('''
+            SELECT id, first_name, middle_name, last_name, search_name, company_id FROM contacts
+        ''').fetchall():
+            name = ' '.join(filter(None, [row['last_name'], row['first_name'], row['middle_name']]))
+            records[row['id']] = {
+                'name': name, 'tokens': name_tokens(row['search_name']),
+                'inn': '', 'company_id': row['company_id'], PHONE: set(), EMAIL: set(),
+            }
+        owner = 'contact'
+
+    cursor = conn.execute('SELECT owner_id, kind, value FROM contact_lookup WHERE owner = ?', (owner,))
+    for owner_id, kind, value in cursor.fetchall():
+        record = records.get(owner_id)
+        if record is not None:
+            record[kind].add(value)
+    return records
+
+
+def build_blocks(
+    records: Dict[int, Dict[str, Any]],
+    with_tokens: bool = True,
+) -> Dict[Tuple[str, str], List[int]]:
+    """Группирует записи по ключам блоков (with_tokens - и по отдельным словам имени)"""
+    blocks: Dict[Tuple[str, str], List[int]] = {}
+    for record_id, record in records.items():
+        keys: Set[Tuple[str, str]] = set()
+        if record['inn']:
+            keys.add(('inn', record['inn']))
+        tokens = record['tokens']
+        if tokens:
+            keys.add(('name', ' '.join(sorted(tokens))))
+        if with_tokens:
+            keys.update(('token', token) for token in tokens if len(token) >= _TOKEN_BLOCK_MIN_LENGTH)
+        keys.update((PHONE, value) for value in record[PHONE])
+        keys.update((EMAIL, value) for value in record[EMAIL])
+        for key in keys:
+            blocks.setdefault(key, []).append(record_id)
+    return blocks
+
+
+def candidate_pairs(
+    blocks: Dict[Tuple[str, str], List[int]],
+    max_block_size: Optional[int] = None,
+) -> Set[Tuple[int, int]]:
+    """Пары (меньший id, больший id) из блоков не крупнее max_block_size"""
+    limit = max_block_size or settings.dedup_max_block_size
+    pairs: Set[Tuple[int, int]] = set()
+    for ids in blocks.values():
+        if len(ids) < 2 or len(ids) > limit:
+            continue
+        ids = sorted(ids)
+        for index, left in enumerate(ids):
+            for right in ids[index + 1:]:
+                pairs.add((left, right))
+    return pairs
+
+
+def score_pair(entity: str, left: Dict[str, Any], right: Dict[str, Any]) -> Tuple[float, List[str]]:
+    """
+    Оценка пары от 0 до 1 и совпавшие признаки
+
+    Сходство имени входит в оценку с весом, пропорциональным мере
+    Жаккара по значимым словам; остальные признаки - точные совпадения.
+    """
+    weights = WEIGHTS[entity]
+    similarity = _jaccard(left['tokens'], right['tokens'])
+    score = weights['name'] * similarity
+    matched = ['name'] if similarity >= NAME_MATCH_THRESHOLD else []
+    for kind in (PHONE, EMAIL):
+        if not left[kind].isdisjoint(right[kind]):
+            score += weights[kind]
+            matched.append(kind)
+    if entity == CUSTOMERS and left['inn'] and right['inn']:
+        if left['inn'] == right['inn']:
+            score += weights['inn']
+            matched.insert(0, 'inn')
+        else:
+            score *= INN_CONFLICT_FACTOR
+    if entity == CONTACTS and left['company_id'] and left['company_id'] == right['company_id']:
+        score += weights['company']
+        matched.append('company')
+    return round(min(score, 1.0), 3), matched
+
+
+def find_duplicates(
+    conn,
+    entity: str,
+    min_score: float = DEFAULT_MIN_SCORE,
+    limit: int = 100,
+) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Пары вероятных дублей по убыванию оценки
+
+    Returns:
+        Кортеж (первые limit пар, всего пар с оценкой не ниже min_score).
+        Пара - {'left', 'right', 'score', 'matched_by'}; left - запись с
+        меньшим id (обычно более ранняя, естественная цель слияния)
+    """
+    records = load_records(conn, entity)
+    weights = WEIGHTS[entity]
+    # Предел оценки пары с разными именами без общих ИНН, телефона и email
+    name_only_ceiling = weights['name'] + weights.get('company', 0.0)
+    blocks = build_blocks(records, with_tokens=min_score < name_only_ceiling)
+    candidates = []
+    for left_id, right_id in candidate_pairs(blocks):
+        left, right = records[left_id], records[right_id]
+        score, matched = score_pair(entity, left, right)
+        if score >= min_score:
+            candidates.append((score, left_id, right_id, matched))
+    candidates.sort(key=lambda item: (-item[0], item[1], item[2]))
+    return [
+        {
+            'left': {'id': left_id, 'name': records[left_id]['name']},
+            'right': {'id': right_id, 'name': records[right_id]['name']},
+            'score': score,
+            'matched_by': matched,
+        }
+        for score, left_id, right_id, matched in candidates[:limit]
+    ], len(candidates)
+
+
+def merge_source_ids(target_id: int, source_ids: Iterable[int]) -> List[int]:
+    """
+    Проверяет список сливаемых записей
+
+    Returns:
+        id исходных записей без повторов, в исходном порядке
+
+    Raises:
+        ValueError: Список пуст или содержит целевую запись
+    """
+    ids = list(dict.fromkeys(source_ids))
+    if not ids:
+        raise ValueError("Не указаны записи для слияния")
+    if target_id in ids:
+        raise ValueError("Запись не может быть слита сама с собой")
+    return ids
+
+
+def _fill_empty_columns(conn, table: str, columns: Tuple[str, ...], target_id: int, source_ids: List[int]) -> None:
+    """Заполняет пустые колонки целевой записи значениями исходных (по порядку source_ids)"""
+    target = conn.execute(f"SELECT {', '.join(columns)} FROM {table} WHERE id = ?", (target_id,)).fetchone()
+    sources = {
+        row['id']: row
+        for row in fetch_in(conn, f"SELECT id, {', '.join(columns)} FROM {table} WHERE id IN ({{ids}})", source_ids)
+    }
+    updates = {}
+    for column in columns:
+        if target[column] not in (None, ''):
+            continue
+        for source_id in source_ids:
+            value = sources[source_id][column] if source_id in sources else None
+            if value not in (None, ''):
+                updates[column] = value
+                break
+    assignments = ''.join(f'{column} = ?, ' for column in updates)
+    conn.execute(
+        f'UPDATE {table} SET {assignments}updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+        list(updates.values()) + [target_id],
+    )
+
+
+def _communication_key(kind: Any, value: Any) -> str:
+    kind = (kind or '').upper()
+    if kind == 'PHONE':
+        return normalize_phone_e164(value)
+    if kind == 'EMAIL':
+        return normalize_email(value)
+    return normalize_text(value)
+
+
+def _move_communications(
+    conn, table: str, owner_column: str, kind_column: str, target_id: int, source_ids: List[int],
+) -> None:
+    """Переносит коммуникации на целевую запись, пропуская уже имеющиеся у неё значения"""
+    seen = {
+        (row[kind_column] or '').upper() + ':' + _communication_key(row[kind_column], row['value'])
+        for row in conn.execute(
+            f'SELECT {kind_column}, value FROM {table} WHERE {owner_column} = ?', (target_id,)
+        ).fetchall()
+    }
+    moved, dropped = [], []
+    for row in fetch_in(
+        conn, f'SELECT id, {kind_column}, value FROM {table} WHERE {owner_column} IN ({{ids}}) ORDER BY id', source_ids,
+    ):
+        key = (row[kind_column] or '').upper() + ':' + _communication_key(row[kind_column], row['value'])
+        if key in seen:
+            dropped.append((row['id'],))
+        else:
+            seen.add(key)
+            moved.append((target_id, row['id']))
+    conn.executemany(f'UPDATE {table} SET {owner_column} = ?, is_primary = FALSE WHERE id = ?', moved)
+    conn.executemany(f'DELETE FROM {table} WHERE id = ?', dropped)
+
+
+def _repoint_deals(conn, column: str, target_id: int, source_ids: List[int], user_id: int) -> None:
+    """Переназначает сделки на целевую запись с записью в историю сделок"""
+    rows = fetch_in(conn, f'SELECT id, {column} FROM deals WHERE {column} IN ({{ids}})', source_ids)
+    conn.executemany(f'UPDATE deals SET {column} = ? WHERE id = ?', [(target_id, row['id']) for row in rows])
+    audit_writer.write(conn, [
+        HistoryEntry(row['id'], column, str(row[column]), str(target_id), ChangeType.UPDATE, user_id)
+        for row in rows
+    ])
+
+
+def _delete_rows(conn, table: str, column: str, ids: Iterable[int]) -> None:
+    conn.executemany(f'DELETE FROM {table} WHERE {column} = ?', [(row_id,) for row_id in ids])
+
+
+def merge_customers(conn, target_id: int, source_ids: List[int], user_id: int) -> None:
+    """
+    Сливает клиентов source_ids в target_id (в транзакции вызывающего)
+
+    Сделки, контакты, файлы и контактные данные переносятся на целевого
+    клиента, пустые поля целевого заполняются из исходных, исходные
+    клиенты удаляются.
+    """
+    _fill_empty_columns(conn, 'customers', CUSTOMER_FILL_COLUMNS, target_id, source_ids)
+    _repoint_deals(conn, 'company_id', target_id, source_ids, user_id)
+
+    moved_contacts = [
+        row['id'] for row in fetch_in(conn, 'SELECT id FROM contacts WHERE company_id IN ({ids})', source_ids)
+    ]
+    conn.executemany('UPDATE contacts SET company_id = ? WHERE id = ?', [(target_id, cid) for cid in moved_contacts])
+    conn.executemany(
+        'UPDATE customer_files SET customer_id = ? WHERE customer_id = ?',
+        [(target_id, source_id) for source_id in source_ids],
+    )
+    _move_communications(conn, 'customer_contacts', 'customer_id', 'contact_type', target_id, source_ids)
+    _delete_rows(conn, 'customers', 'id', source_ids)
+
+    refresh_search_keys(conn, 'customers', target_id)
+    for customer_id in [target_id] + source_ids:
+        refresh_customer(conn, customer_id)
+    for contact_id in moved_contacts:
+        refresh_contact(conn, contact_id)
+
+
+def merge_contacts(conn, target_id: int, source_ids: List[int], user_id: int) -> None:
+    """
+    Сливает контакты source_ids в target_id (в транзакции вызывающего)
+
+    Сделки, участие в сделках, коммуникации и теги переносятся на целевой
+    контакт, пустые поля целевого заполняются из исходных, исходные
+    контакты удаляются.
+    """
+    _fill_empty_columns(conn, 'contacts', CONTACT_FILL_COLUMNS, target_id, source_ids)
+    _repoint_deals(conn, 'primary_contact_id', target_id, source_ids, user_id)
+
+    # Участие в сделке, где целевой контакт уже участвует, не дублируется
+    participating = {
+        row[0] for row in conn.execute('SELECT deal_id FROM deal_participants WHERE contact_id = ?', (target_id,))
+    }
+    moved, dropped = [], []
+    for row in fetch_in(
+        conn, 'SELECT id, deal_id FROM deal_participants WHERE contact_id IN ({ids}) ORDER BY id', source_ids,
+    ):
+        if row['deal_id'] in participating:
+            dropped.append((row['id'],))
+        else:
+            participating.add(row['deal_id'])
+            moved.append((target_id, row['id']))
+    conn.executemany('UPDATE deal_participants SET contact_id = ? WHERE id = ?', moved)
+    conn.executemany('DELETE FROM deal_participants WHERE id = ?', dropped)
+
+    _move_communications(conn, 'contact_communications', 'contact_id', 'comm_type', target_id, source_ids)
+    conn.executemany(
+        'INSERT OR IGNORE INTO contact_tags (contact_id, tag) SELECT ?, tag FROM contact_tags WHERE contact_id = ?',
+        [(target_id, source_id) for source_id in source_ids],
+    )
+    _delete_rows(conn, 'contact_tags', 'contact_id', source_ids)
+
+    _delete_rows(conn, 'contacts', 'id', source_ids)
+
+    refresh_search_keys(conn, 'contacts', target_id)
+    for contact_id in [target_id] + source_ids:
+        refresh_contact(conn, contact_id)
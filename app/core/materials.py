@@ -0,0 +1,123 @@
+"""
+Справочник марок металла (prices_metal_materials.json)
+
+Файл сгруппирован по категориям: {"prices_metal_materials": {"Сталь":
+[{id, grade, density, price}, ...], ...}}. Справочник держится в памяти
+процесса с индексами по ID марки и по названию материала и
+перечитывается, только когда меняется время изменения файла.
+
+Материал позиции расчета хранится строкой "<категория> <марка>"
+(например "Сталь Ст3"); resolve() сопоставляет её с ID марки.
+"""
+import json
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+from ..utils.search_keys import normalize_text
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+MATERIALS_SETTINGS_PATH = os.path.join(ROOT_DIR, 'prices_metal_materials.json')
+
+# Предел кэша сопоставления строк материалов
+_RESOLVED_CACHE_SIZE = 10000
+
+
+def _flatten(data: Any) -> List[Dict[str, Any]]:
+    """Плоский список марок (новая структура по категориям или legacy массив)"""
+    materials = data.get('prices_metal_materials') if isinstance(data, dict) else data
+    if isinstance(materials, dict):
+        return [
+            {
+                'id': material.get('id'),
+                'category': category,
+                'grade': material.get('grade', ''),
+                'density': material.get('density', 0),
+                'price': material.get('price', 0),
+            }
+            for category, items in materials.items()
+            for material in items
+        ]
+    if isinstance(materials, list):
+        return [material for material in materials if isinstance(material, dict)]
+    return []
+
+
+class MaterialCatalog:
+    """Индексированный справочник марок в памяти"""
+
+    def __init__(self, path: str = MATERIALS_SETTINGS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime: Optional[float] = None
+        self._by_id: Dict[int, Dict[str, Any]] = {}
+        self._by_label: Dict[str, int] = {}
+        # Строка материала как есть -> ID марки (без повторной нормализации)
+        self._resolved: Dict[Any, Optional[int]] = {}
+
+    def _refresh(self) -> None:
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            if mtime == self._mtime:
+                return
+            materials: List[Dict[str, Any]] = []
+            if mtime is not None:
+                try:
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        materials = _flatten(json.load(f))
+                except (OSError, ValueError):
+                    materials = []
+            by_id: Dict[int, Dict[str, Any]] = {}
+            by_label: Dict[str, int] = {}
+            for material in materials:
+                try:
+                    material_id = int(material.get('id'))
+                except (TypeError, ValueError):
+                    continue
+                by_id[material_id] = material
+                category, grade = material.get('category', ''), material.get('grade', '')
+                by_label.setdefault(normalize_text(f'{category} {grade}'), material_id)
+            # Марка без категории - только если она однозначна
+            grades: Dict[str, List[int]] = {}
+            for material_id, material in by_id.items():
+                grades.setdefault(normalize_text(material.get('grade', '')), []).append(material_id)
+            for grade, ids in grades.items():
+                if grade and len(ids) == 1:
+                    by_label.setdefault(grade, ids[0])
+            self._by_id, self._by_label, self._resolved, self._mtime = by_id, by_label, {}, mtime
+
+    def invalidate(self) -> None:
+        """Сбрасывает кэш (после записи файла в этом процессе)"""
+        with self._lock:
+            self._mtime = None
+            self._by_id, self._by_label, self._resolved = {}, {}, {}
+
+    def get(self, material_id: int) -> Optional[Dict[str, Any]]:
+        """Марка по ID"""
+        self._refresh()
+        return self._by_id.get(material_id)
+
+    def all(self) -> List[Dict[str, Any]]:
+        """Все марки"""
+        self._refresh()
+        return list(self._by_id.values())
+
+    def resolve(self, material: Any) -> Optional[int]:
+        """ID марки по строке материала позиции ("Сталь Ст3") или None"""
+        self._refresh()
+        if not isinstance(material, str):
+            return self._by_label.get(normalize_text(material))
+        resolved = self._resolved
+        if material not in resolved:
+            if len(resolved) >= _RESOLVED_CACHE_SIZE:
+                resolved.clear()
+            resolved[material] = self._by_label.get(normalize_text(material))
+        return resolved[material]
+
+
+material_catalog = MaterialCatalog()
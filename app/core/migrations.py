@@ -0,0 +1,214 @@
+"""
+Версионированные миграции схемы базы данных
+
+Каждая миграция - шаг с номером версии, выполняемый ровно один раз.
+Применённые версии фиксируются в таблице schema_version, поэтому при
+актуальной схеме запуск приложения сводится к одному SELECT.
+"""
+import logging
+from typing import Callable, List, NamedTuple
+
+from .calculation_refs import create_refs_table, rebuild_refs
+from .calculation_store import create_calculations_table, create_summary_columns, rebuild_calculation_summaries
+from .contact_lookup import create_lookup_table, rebuild_lookup
+from .counters import create_count_triggers, rebuild_counts
+from .database import DatabaseManager, begin_immediate
+from .deal_stats import create_deal_stats, rebuild_deal_stats
+from .deal_search import create_search_index, rebuild_search_index
+from .name_search import create_search_columns, rebuild_search_keys
+from .stage_metrics import rebuild_stage_metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Migration(NamedTuple):
+    """Шаг миграции схемы"""
+    version: int
+    description: str
+    apply: Callable[[DatabaseManager, object], None]
+
+
+def _create_base_tables(db: DatabaseManager, conn) -> None:
+    db.init_database()
+
+
+def _migrate_users(db: DatabaseManager, conn) -> None:
+    db.migrate_users_table()
+
+
+def _add_proposal_columns(db: DatabaseManager, conn) -> None:
+    db.add_missing_columns()
+
+
+def _create_crm_tables(db: DatabaseManager, conn) -> None:
+    db.init_crm_tables()
+
+
+def _create_sidebar_settings(db: DatabaseManager, conn) -> None:
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sidebar_settings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            hidden_categories TEXT DEFAULT '[]',
+            collapsed_categories TEXT DEFAULT '[]',
+            hidden_items TEXT DEFAULT '[]',
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        INSERT OR IGNORE INTO sidebar_settings (id, hidden_categories, collapsed_categories, hidden_items)
+        VALUES (1, '[]', '[]', '[]')
+    ''')
+
+
+def _create_keyset_indexes(db: DatabaseManager, conn) -> None:
+    # Индексы (ключ сортировки, id) для курсорной пагинации списков
+    indexes = {
+        'idx_deals_created_at_id': 'deals(created_at, id)',
+        'idx_deals_updated_at_id': 'deals(updated_at, id)',
+        'idx_deals_amount_id': 'deals(amount, id)',
+        'idx_deals_close_date_id': 'deals(close_date, id)',
+        'idx_deals_funnel_created_at_id': 'deals(funnel_id, created_at, id)',
+        'idx_customers_created_at_id': 'customers(created_at, id)',
+        'idx_customers_updated_at_id': 'customers(updated_at, id)',
+        'idx_contacts_updated_at_id': 'contacts(updated_at, id)',
+        'idx_contacts_created_at_id': 'contacts(created_at, id)',
+    }
+    for name, target in indexes.items():
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {target}')
+
+
+def _create_entity_counts(db: DatabaseManager, conn) -> None:
+    create_count_triggers(conn)
+    rebuild_counts(conn)
+
+
+def _backfill_stage_metrics(db: DatabaseManager, conn) -> None:
+    rebuild_stage_metrics(conn)
+
+
+def _create_deal_search(db: DatabaseManager, conn) -> None:
+    create_search_index(conn)
+    rebuild_search_index(conn)
+
+
+def _create_name_search(db: DatabaseManager, conn) -> None:
+    create_search_columns(conn)
+    rebuild_search_keys(conn)
+
+
+def _create_contact_lookup(db: DatabaseManager, conn) -> None:
+    create_lookup_table(conn)
+    rebuild_lookup(conn)
+
+
+def _create_deal_stats(db: DatabaseManager, conn) -> None:
+    create_deal_stats(conn)
+    rebuild_deal_stats(conn)
+
+
+def _create_legacy_import_ledger(db: DatabaseManager, conn) -> None:
+    # Журнал однократных импортов legacy JSON (app.services.legacy_import)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS legacy_imports (
+            name TEXT PRIMARY KEY,
+            source TEXT,
+            status TEXT NOT NULL,
+            imported_count INTEGER NOT NULL DEFAULT 0,
+            imported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def _create_calculations(db: DatabaseManager, conn) -> None:
+    # Данные из calculations.json переносит app.services.legacy_import
+    create_calculations_table(conn)
+
+
+def _create_calculation_summaries(db: DatabaseManager, conn) -> None:
+    create_summary_columns(conn)
+    rebuild_calculation_summaries(conn)
+
+
+def _create_calculation_refs(db: DatabaseManager, conn) -> None:
+    create_refs_table(conn)
+    rebuild_refs(conn)
+
+
+# Миграции в порядке применения. Новые шаги добавляются только в конец
+# списка; номера уже выпущенных версий не меняются.
+MIGRATIONS: List[Migration] = [
+    Migration(1, "Базовые таблицы users и proposals", _create_base_tables),
+    Migration(2, "Новые поля таблицы users", _migrate_users),
+    Migration(3, "Колонки company/status/priority в proposals", _add_proposal_columns),
+    Migration(4, "Таблицы CRM", _create_crm_tables),
+    Migration(5, "Таблица настроек сайдбара", _create_sidebar_settings),
+    Migration(6, "Индексы для курсорной пагинации", _create_keyset_indexes),
+    Migration(7, "Счётчики записей entity_counts с триггерами", _create_entity_counts),
+    Migration(8, "Накопители и пересчёт метрик стадий", _backfill_stage_metrics),
+    Migration(9, "Полнотекстовый индекс сделок deal_search (FTS5)", _create_deal_search),
+    Migration(10, "Нормализованные ключи и триграммный поиск клиентов и контактов", _create_name_search),
+    Migration(11, "Таблица обратного поиска по телефону и email", _create_contact_lookup),
+    Migration(12, "Сводка сделок клиентов и контактов с триггерами", _create_deal_stats),
+    Migration(13, "Журнал импортов legacy JSON", _create_legacy_import_ledger),
+    Migration(14, "Таблица расчетов calculations", _create_calculations),
+    Migration(15, "Сводка расчетов для списка", _create_calculation_summaries),
+    Migration(16, "Обратный индекс марок и операций расчетов", _create_calculation_refs),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def get_current_version(db: DatabaseManager) -> int:
+    """Возвращает последнюю применённую версию схемы"""
+    with db.get_connection() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+        return row[0] or 0
+
+
+def apply_migrations(db: DatabaseManager) -> int:
+    """
+    Применяет недостающие миграции
+
+    Args:
+        db: Менеджер базы данных
+
+    Returns:
+        Количество применённых миграций
+    """
+    current = get_current_version(db)
+    if current >= LATEST_VERSION:
+        return 0
+
+    applied = 0
+    for migration in MIGRATIONS:
+        if migration.version <= current:
+            continue
+        with db.get_connection() as conn:
+            # Параллельно стартующие процессы применяют шаг по очереди:
+            # версия перечитывается под блокировкой записи
+            begin_immediate(conn)
+            version = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()[0] or 0
+            if migration.version <= version:
+                continue
+            logger.info(f"Миграция схемы до версии {migration.version}: {migration.description}")
+            migration.apply(db, conn)
+            conn.execute(
+                'INSERT OR IGNORE INTO schema_version (version, description) VALUES (?, ?)',
+                (migration.version, migration.description)
+            )
+        applied += 1
+    return applied
+
+
+if __name__ == "__main__":
+    from .database import db_manager
+
+    count = apply_migrations(db_manager)
+    print(f"Применено миграций: {count}, версия схемы: {get_current_version(db_manager)}")
@@ -0,0 +1,167 @@
+"""
+Поиск клиентов и контактов по нормализованным ключам
+
+Колонки search_* хранят ключи из app.utils.search_keys (регистр и ё
+сброшены, пунктуация убрана, у телефона только цифры). Сервисы
+пересчитывают их при каждой записи (refresh_search_keys).
+
+Для поиска по подстроке ключи проиндексированы таблицами FTS5 с
+токенизатором trigram (external content, синхронизация триггерами).
+Запросы короче трёх символов ищутся по префиксу search_name через
+обычный индекс.
+"""
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from ..utils.search_keys import join_keys, normalize_phone, normalize_text, search_digits
+
+# Таблица -> колонка ключа -> (вид ключа: text/phone, исходные колонки)
+SEARCH_KEYS: Dict[str, Dict[str, Tuple[str, Tuple[str, ...]]]] = {
+    'customers': {
+        'search_name': ('text', ('name',)),
+        'search_phone': ('phone', ('phone',)),
+    },
+    'contacts': {
+        'search_name': ('text', ('last_name', 'first_name', 'middle_name')),
+        'search_email': ('text', ('email',)),
+        'search_phone': ('phone', ('phone',)),
+    },
+}
+
+# Минимальная длина запроса для поиска по триграммам
+TRIGRAM_MIN_LENGTH = 3
+
+
+def _trigram_table(table: str) -> str:
+    return f'{table}_trigram'
+
+
+def compute_search_keys(table: str, row: Mapping[str, Any]) -> Dict[str, str]:
+    """Ключи поиска для строки таблицы"""
+    keys = {}
+    for key, (kind, sources) in SEARCH_KEYS[table].items():
+        if kind == 'phone':
+            keys[key] = normalize_phone(row.get(sources[0]))
+        else:
+            keys[key] = join_keys(row.get(source) for source in sources)
+    return keys
+
+
+def refresh_search_keys(conn, table: str, row_id: int) -> None:
+    """Пересчитывает ключи поиска строки после INSERT/UPDATE"""
+    sources = sorted({source for _, columns in SEARCH_KEYS[table].values() for source in columns})
+    row = conn.execute(f"SELECT {', '.join(sources)} FROM {table} WHERE id = ?", (row_id,)).fetchone()
+    if row is None:
+        return
+    keys = compute_search_keys(table, dict(zip(sources, row)))
+    assignments = ', '.join(f'{key} = ?' for key in keys)
+    conn.execute(f'UPDATE {table} SET {assignments} WHERE id = ?', list(keys.values()) + [row_id])
+
+
+def create_search_columns(conn) -> None:
+    """Добавляет колонки ключей, индексы, триграммные таблицы и триггеры синхронизации"""
+    for table, keys in SEARCH_KEYS.items():
+        existing = {row[1] for row in conn.execute(f'PRAGMA table_info({table})').fetchall()}
+        for key in keys:
+            if key not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {key} TEXT NOT NULL DEFAULT ''")
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_search_name ON {table}(search_name)')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_search_phone ON {table}(search_phone)')
+
+        trigram = _trigram_table(table)
+        columns = ', '.join(keys)
+        new_values = ', '.join(f'NEW.{key}' for key in keys)
+        old_values = ', '.join(f'OLD.{key}' for key in keys)
+        conn.execute(f'''
+            CREATE VIRTUAL TABLE IF NOT EXISTS {trigram} USING fts5(
+                {columns},
+                content = '{table}', content_rowid = 'id',
+                tokenize = 'trigram'
+            )
+        ''')
+        insert = f'''
+                INSERT INTO {trigram} (rowid, {columns}) VALUES (NEW.id, {new_values});'''
+        delete = f'''
+                INSERT INTO {trigram} ({trigram}, rowid, {columns}) VALUES ('delete', OLD.id, {old_values});'''
+
+        conn.execute(f'DROP TRIGGER IF EXISTS trg_{table}_trigram_insert')
+        conn.execute(f'''
+            CREATE TRIGGER trg_{table}_trigram_insert AFTER INSERT ON {table}
+            BEGIN{insert}
+            END
+        ''')
+        conn.execute(f'DROP TRIGGER IF EXISTS trg_{table}_trigram_update')
+        conn.execute(f'''
+            CREATE TRIGGER trg_{table}_trigram_update AFTER UPDATE OF {columns} ON {table}
+            BEGIN{delete}{insert}
+            END
+        ''')
+        conn.execute(f'DROP TRIGGER IF EXISTS trg_{table}_trigram_delete')
+        conn.execute(f'''
+            CREATE TRIGGER trg_{table}_trigram_delete AFTER DELETE ON {table}
+            BEGIN{delete}
+            END
+        ''')
+
+
+def rebuild_search_keys(conn, table: Optional[str] = None) -> None:
+    """Пересчитывает ключи всех строк и перестраивает триграммные индексы"""
+    tables = [table] if table else list(SEARCH_KEYS)
+    for name in tables:
+        # Сначала индекс приводится к текущим значениям колонок: триггер
+        # обновления удаляет из него старые ключи и требует их совпадения
+        trigram = _trigram_table(name)
+        conn.execute(f"INSERT INTO {trigram} ({trigram}) VALUES ('rebuild')")
+
+        keys = list(SEARCH_KEYS[name])
+        sources = sorted({source for _, columns in SEARCH_KEYS[name].values() for source in columns})
+        cursor = conn.execute(f"SELECT id, {', '.join(keys)}, {', '.join(sources)} FROM {name}")
+        updates = []
+        for row in cursor.fetchall():
+            current = list(row[1:len(keys) + 1])
+            computed = compute_search_keys(name, dict(zip(sources, row[len(keys) + 1:])))
+            values = [computed[key] for key in keys]
+            if values != current:
+                updates.append(values + [row[0]])
+        assignments = ', '.join(f'{key} = ?' for key in keys)
+        conn.executemany(f'UPDATE {name} SET {assignments} WHERE id = ?', updates)
+
+
+def _phrase(text: str) -> str:
+    return '"' + text.replace('"', '""') + '"'
+
+
+def search_condition(table: str, search: str) -> Tuple[str, List[Any]]:
+    """
+    Условие WHERE для поиска по таблице
+
+    Запрос нормализуется так же, как ключи. От трёх символов - поиск
+    подстроки по всем ключам через триграммный индекс (цифры запроса
+    дополнительно ищутся в search_phone); короче - префикс search_name.
+
+    Returns:
+        Кортеж (SQL-условие, параметры)
+    """
+    text = normalize_text(search)
+    digits = search_digits(search)
+    terms = []
+    if len(text) >= TRIGRAM_MIN_LENGTH:
+        terms.append(_phrase(text))
+    if len(digits) >= TRIGRAM_MIN_LENGTH and digits != text:
+        terms.append(f'search_phone : {_phrase(digits)}')
+    if terms:
+        trigram = _trigram_table(table)
+        return (
+            f'id IN (SELECT rowid FROM {trigram} WHERE {trigram} MATCH ?)',
+            [' OR '.join(terms)],
+        )
+    if text:
+        return 'search_name >= ? AND search_name < ?', [text, text + '\U0010ffff']
+    return '0', []
+
+
+if __name__ == "__main__":
+    from .database import db_manager
+
+    with db_manager.get_connection() as connection:
+        rebuild_search_keys(connection)
+    print("Ключи поиска клиентов и контактов пересчитаны")
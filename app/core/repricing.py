@@ -0,0 +1,391 @@
+"""
+Моделирование переоценки расчетов при изменении цен на металл
+
+Позиции-сортаменты всех расчетов загружаются одним запросом (json_each по
+payload) в колоночные массивы NumPy. Гипотетический вектор цен (ID марки
+из prices_metal_materials.json -> цена за кг) применяется ко всем
+позициям сразу, а изменения суммируются по расчетам через bincount.
+
+Стоимость материала позиции пропорциональна цене за кг, а итоговая цена
+расчета (app.utils.calculation_summary) линейна по стоимости сортаментов:
+изменение итога = k * sum(dМатериал * (1 + наценка / 100)), где
+k = 1 + глобальная наценка / 100, если она применяется к сортаментам.
+Остальные слагаемые (заготовки, операции) не меняются, поэтому новые
+значения получаются из сохранённой сводки расчета.
+
+Фактическая переоценка (после изменения цены марки в справочнике)
+выполняется фоновым RepricingWorker: затронутые расчеты находятся по
+обратному индексу (app.core.calculation_refs), пересчитываются только
+они, сводки обновляются при сохранении.
+"""
+import logging
+import queue
+import threading
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .calculation_refs import MATERIAL, find_calculations, material_id, rebuild_refs
+from .calculation_store import load_record, save_record
+from .database import DatabaseManager, begin_immediate, db_manager
+from .materials import MaterialCatalog, material_catalog
+
+logger = logging.getLogger(__name__)
+
+# Пауза перед повтором переоценки, завершившейся ошибкой (секунды)
+RETRY_DELAY = 5.0
+
+
+class RepricingLines(NamedTuple):
+    """Колоночное представление расчетов и их позиций-сортаментов"""
+    # По расчетам
+    calc_ids: np.ndarray
+    names: List[str]
+    cost_price: np.ndarray
+    total_price: np.ndarray
+    global_factor: np.ndarray
+    # По позициям
+    line_calc: np.ndarray
+    material_id: np.ndarray
+    weight: np.ndarray
+    quantity: np.ndarray
+    price_per_kg: np.ndarray
+    material_cost: np.ndarray
+    markup: np.ndarray
+
+
+_CALCULATIONS_SQL = '''
+    SELECT id, name, cost_price, total_price,
+           COALESCE(json_extract(payload, '$.global_markup'), 0) AS global_markup,
+           COALESCE(json_extract(payload, '$.global_markup_apply_to_assortments'), 1) AS apply_to_assortments,
+           COALESCE(json_extract(payload, '$.global_markup_apply_to_blanks'), 0) AS apply_to_blanks,
+           COALESCE(json_extract(payload, '$.global_markup_apply_to_operations'), 0) AS apply_to_operations
+    FROM calculations
+    WHERE json_type(payload, '$.assortments') = 'array' {where}
+    ORDER BY id
+'''
+
+_LINES_SQL = '''
+    SELECT c.id,
+           json_extract(a.value, '$.material'),
+           json_extract(a.value, '$.materialId'),
+           COALESCE(json_extract(a.value, '$.weight'), 0),
+           COALESCE(json_extract(a.value, '$.quantity'), 0),
+           COALESCE(json_extract(a.value, '$.pricePerKg'), 0),
+           COALESCE(json_extract(a.value, '$.materialCost'), 0),
+           COALESCE(json_extract(a.value, '$.markup'), 0)
+    FROM calculations c, json_each(c.payload, '$.assortments') a
+    WHERE 1=1 {where}
+    ORDER BY c.id
+'''
+
+
+def _material_ids(materials: Sequence[Any], explicit: Sequence[Any], catalog: MaterialCatalog) -> np.ndarray:
+    """ID марок позиций: materialId позиции или сопоставление строки материала (-1 - не найдена)"""
+    labels, inverse = np.unique(np.array([m or '' for m in materials], dtype=object), return_inverse=True)
+    resolved = np.array([catalog.resolve(label) or -1 for label in labels], dtype=np.int64)
+    ids = resolved[inverse] if len(labels) else np.empty(0, dtype=np.int64)
+    given = np.array([m if isinstance(m, int) else -1 for m in explicit], dtype=np.int64)
+    return np.where(given >= 0, given, ids)
+
+
+def load_lines(
+    conn,
+    calculation_ids: Optional[Sequence[int]] = None,
+    catalog: MaterialCatalog = material_catalog,
+) -> RepricingLines:
+    """
+    Загружает расчеты нового формата и их сортаменты в колоночные массивы
+
+    Args:
+        conn: Соединение с БД
+        calculation_ids: Только эти расчеты (None - все)
+        catalog: Справочник марок для сопоставления материалов
+    """
+    params: List[int] = []
+    where = ''
+    if calculation_ids is not None:
+        params = sorted({int(calc_id) for calc_id in calculation_ids})
+        where = f"AND {{column}} IN ({', '.join('?' for _ in params)})" if params else 'AND 0'
+
+    calcs = conn.execute(_CALCULATIONS_SQL.format(where=where.format(column='id')), params).fetchall()
+    lines = conn.execute(_LINES_SQL.format(where=where.format(column='c.id')), params).fetchall()
+
+    calc_ids = np.array([row['id'] for row in calcs], dtype=np.int64)
+    # Множитель глобальной наценки для сортаментов (без выбранных категорий - ко всему)
+    global_factor = np.array([
+        1 + (row['global_markup'] or 0) / 100
+        if row['apply_to_assortments'] or not (row['apply_to_blanks'] or row['apply_to_operations'])
+        else 1.0
+        for row in calcs
+    ], dtype=np.float64)
+
+    columns = list(zip(*lines)) if lines else [()] * 8
+    line_calc = np.searchsorted(calc_ids, np.array(columns[0], dtype=np.int64))
+    return RepricingLines(
+        calc_ids=calc_ids,
+        names=[row['name'] or '' for row in calcs],
+        cost_price=np.array([row['cost_price'] for row in calcs], dtype=np.float64),
+        total_price=np.array([row['total_price'] for row in calcs], dtype=np.float64),
+        global_factor=global_factor,
+        line_calc=line_calc,
+        material_id=_material_ids(columns[1], columns[2], catalog),
+        weight=np.array(columns[3], dtype=np.float64),
+        quantity=np.array(columns[4], dtype=np.float64),
+        price_per_kg=np.array(columns[5], dtype=np.float64),
+        material_cost=np.array(columns[6], dtype=np.float64),
+        markup=np.array(columns[7], dtype=np.float64),
+    )
+
+
+def price_vector(prices: Mapping[int, float], material_id: np.ndarray) -> np.ndarray:
+    """Новая цена за кг каждой позиции (NaN - цена марки не меняется)"""
+    if not prices or not len(material_id):
+        return np.full(len(material_id), np.nan)
+    keys = np.array(sorted(prices), dtype=np.int64)
+    values = np.array([prices[key] for key in keys], dtype=np.float64)
+    index = np.clip(np.searchsorted(keys, material_id), 0, len(keys) - 1)
+    return np.where(keys[index] == material_id, values[index], np.nan)
+
+
+def simulate(lines: RepricingLines, prices: Mapping[int, float]) -> Dict[str, np.ndarray]:
+    """
+    Применяет вектор цен ко всем позициям
+
+    Returns:
+        Массивы по расчетам: new_cost_price, new_total_price, delta,
+        affected_items (число позиций с изменённой ценой)
+    """
+    new_price = price_vector(prices, lines.material_id)
+    # Позиции, чья цена за кг действительно меняется
+    repriced = ~np.isnan(new_price) & (new_price != lines.price_per_kg)
+    # Стоимость материала пропорциональна цене за кг; без сохранённой цены - вес * количество * цена
+    new_cost = np.where(
+        lines.price_per_kg > 0,
+        lines.material_cost * np.divide(new_price, lines.price_per_kg, where=lines.price_per_kg > 0,
+                                        out=np.zeros_like(new_price)),
+        lines.weight * lines.quantity * new_price,
+    )
+    cost_delta = np.where(repriced, new_cost - lines.material_cost, 0.0)
+    price_delta = cost_delta * (1 + lines.markup / 100)
+
+    count = len(lines.calc_ids)
+    calc_cost_delta = np.bincount(lines.line_calc, weights=cost_delta, minlength=count)
+    calc_price_delta = np.bincount(lines.line_calc, weights=price_delta, minlength=count) * lines.global_factor
+    return {
+        'new_cost_price': lines.cost_price + calc_cost_delta,
+        'new_total_price': lines.total_price + calc_price_delta,
+        'delta': calc_price_delta,
+        'affected_items': np.bincount(lines.line_calc, weights=repriced, minlength=count).astype(np.int64),
+    }
+
+
+def simulate_reprice(
+    conn,
+    prices: Mapping[int, float],
+    calculation_ids: Optional[Sequence[int]] = None,
+    include_unchanged: bool = False,
+) -> Dict[str, Any]:
+    """
+    Моделирует новые итоги расчетов при ценах prices
+
+    Args:
+        conn: Соединение с БД
+        prices: ID марки -> новая цена за кг
+        calculation_ids: Только эти расчеты (None - все)
+        include_unchanged: Включать расчеты без затронутых позиций
+
+    Returns:
+        Словарь с расчетами (items) и итогами по всем расчетам (summary)
+    """
+    lines = load_lines(conn, calculation_ids)
+    result = simulate(lines, {int(key): float(value) for key, value in prices.items()})
+
+    affected = result['affected_items'] > 0
+    selected = np.arange(len(lines.calc_ids)) if include_unchanged else np.flatnonzero(affected)
+    items: List[Dict[str, Any]] = []
+    for i in selected:
+        total_price = float(lines.total_price[i])
+        delta = float(result['delta'][i])
+        items.append({
+            'id': int(lines.calc_ids[i]),
+            'name': lines.names[i],
+            'cost_price': float(lines.cost_price[i]),
+            'new_cost_price': float(result['new_cost_price'][i]),
+            'total_price': total_price,
+            'new_total_price': float(result['new_total_price'][i]),
+            'delta': delta,
+            'delta_percent': delta / total_price * 100 if total_price else 0.0,
+            'affected_items': int(result['affected_items'][i]),
+        })
+
+    return {
+        'items': items,
+        'summary': {
+            'calculations_count': len(lines.calc_ids),
+            'affected_count': int(affected.sum()),
+            'total_price': float(lines.total_price.sum()),
+            'new_total_price': float(result['new_total_price'].sum()),
+            'delta': float(result['delta'].sum()),
+        },
+    }
+
+
+def reprice_item(item: Dict[str, Any], new_price: float) -> bool:
+    """
+    Пересчитывает стоимость материала позиции по новой цене за кг
+
+    Returns:
+        False, если цена позиции не изменилась
+    """
+    old_price = item.get('pricePerKg') or 0
+    if old_price == new_price:
+        return False
+    old_cost = item.get('materialCost') or 0
+    if old_price > 0:
+        new_cost = old_cost * new_price / old_price
+    else:
+        new_cost = (item.get('weight') or 0) * (item.get('quantity') or 0) * new_price
+    item['pricePerKg'] = new_price
+    item['materialCost'] = new_cost
+    if item.get('totalCost') is not None:
+        item['totalCost'] = item['totalCost'] + new_cost - old_cost
+    return True
+
+
+def apply_material_prices(
+    conn,
+    prices: Mapping[int, float],
+    catalog: MaterialCatalog = material_catalog,
+) -> List[int]:
+    """
+    Переоценивает расчеты, ссылающиеся на марки из prices
+
+    Расчеты находятся по обратному индексу, изменяются только позиции с
+    этими марками; сводка и индекс обновляются при сохранении.
+
+    Returns:
+        ID изменённых расчетов
+    """
+    changed = []
+    for calc_id, item_ids in find_calculations(conn, MATERIAL, prices).items():
+        record = load_record(conn, calc_id)
+        if record is None:
+            continue
+        item_ids = set(item_ids)
+        touched = False
+        for item in record.get('assortments') or []:
+            if not isinstance(item, dict) or str(item.get('id') or '') not in item_ids:
+                continue
+            grade_id = material_id(item, catalog)
+            if grade_id in prices and reprice_item(item, prices[grade_id]):
+                touched = True
+        if touched:
+            save_record(conn, calc_id, record)
+            changed.append(calc_id)
+    return changed
+
+
+class RepricingWorker:
+    """
+    Фоновая переоценка расчетов после изменения справочника марок
+
+    Изменения цен и запросы перестройки индекса копятся в очереди; фоновый
+    поток объединяет их (последняя цена марки побеждает) и применяет в
+    одной транзакции. При ошибке изменения возвращаются в очередь и
+    повторяются после паузы RETRY_DELAY.
+    """
+
+    def __init__(self, db: Optional[DatabaseManager] = None):
+        self.db = db or db_manager
+        self._queue: "queue.Queue[Tuple[Dict[int, float], bool]]" = queue.Queue()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._thread_lock = threading.Lock()
+        self._run_lock = threading.Lock()
+
+    def submit(self, prices: Optional[Mapping[int, float]] = None, rebuild_index: bool = False) -> None:
+        """
+        Ставит переоценку в очередь
+
+        Args:
+            prices: ID марки -> новая цена за кг
+            rebuild_index: Перестроить ссылки на марки (изменились названия или состав справочника)
+        """
+        if not prices and not rebuild_index:
+            return
+        self._queue.put(({int(key): float(value) for key, value in (prices or {}).items()}, rebuild_index))
+        self._ensure_thread()
+        self._wakeup.set()
+
+    def run_pending(self) -> List[int]:
+        """Синхронно применяет накопленные изменения, возвращает ID изменённых расчетов"""
+        with self._run_lock:
+            prices, rebuild_index = self._drain()
+            if not prices and not rebuild_index:
+                return []
+            try:
+                with self.db.get_connection() as conn:
+                    begin_immediate(conn)
+                    if rebuild_index:
+                        rebuild_refs(conn)
+                    changed = apply_material_prices(conn, prices) if prices else []
+            except Exception:
+                # Изменения возвращаются в очередь перед поступившими позже
+                # (более новые цены марок по-прежнему побеждают)
+                later = self._drain()
+                self._queue.put((prices, rebuild_index))
+                if later[0] or later[1]:
+                    self._queue.put(later)
+                raise
+        logger.info(f"Переоценка расчетов: изменено {len(changed)}")
+        return changed
+
+    def _drain(self) -> Tuple[Dict[int, float], bool]:
+        """Забирает очередь, объединяя изменения (последняя цена марки побеждает)"""
+        prices: Dict[int, float] = {}
+        rebuild_index = False
+        while True:
+            try:
+                batch, rebuild = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            prices.update(batch)
+            rebuild_index = rebuild_index or rebuild
+        return prices, rebuild_index
+
+    def close(self) -> None:
+        """Останавливает фоновый поток и применяет остаток очереди"""
+        with self._thread_lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stopping.set()
+            self._wakeup.set()
+            thread.join()
+            self._stopping.clear()
+        self.run_pending()
+
+    def _ensure_thread(self) -> None:
+        if self._thread is not None:
+            return
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="calculation-repricing", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            self._wakeup.wait()
+            self._wakeup.clear()
+            try:
+                self.run_pending()
+            except Exception:
+                logger.exception("Ошибка фоновой переоценки расчетов")
+                # Возвращённые в очередь изменения повторяются после паузы
+                if not self._stopping.wait(RETRY_DELAY):
+                    self._wakeup.set()
+
+
+# Глобальный экземпляр для роутов справочника марок
+repricing_worker = RepricingWorker()
@@ -0,0 +1,86 @@
+"""
+Компилируемые мапперы строк SQLite в словари
+
+Маппер описывается списком полей. Для конкретного набора колонок
+выборки (cursor.description) он один раз генерирует функцию, которая
+читает значения по индексам кортежа и подставляет значения по умолчанию.
+Функция кэшируется и переиспользуется для всех строк, вместо проверок
+'x' in row.keys() на каждую колонку каждой строки.
+"""
+import threading
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+
+class Column(NamedTuple):
+    """Поле результата"""
+    key: str
+    # Колонки-источники в порядке приоритета (первая существующая)
+    sources: Tuple[str, ...]
+    # Значение, если колонки нет (или она NULL при none_to_default)
+    default: Any = None
+    none_to_default: bool = False
+    convert: Optional[Callable[[Any], Any]] = None
+
+
+def column(
+    key: str,
+    *sources: str,
+    default: Any = None,
+    none_to_default: bool = False,
+    convert: Optional[Callable[[Any], Any]] = None,
+) -> Column:
+    """Описание поля; по умолчанию источник - колонка с тем же именем"""
+    return Column(key, sources or (key,), default, none_to_default, convert)
+
+
+class RowMapper:
+    """Маппер строк с кэшем сгенерированных функций по набору колонок"""
+
+    def __init__(self, columns: Sequence[Column]):
+        self.columns = tuple(columns)
+        self._compiled: Dict[Tuple[str, ...], Callable[[Any], Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+
+    def _compile(self, names: Tuple[str, ...]) -> Callable[[Any], Dict[str, Any]]:
+        positions = {name: index for index, name in reversed(list(enumerate(names)))}
+        namespace: Dict[str, Any] = {}
+        items = []
+        for n, col in enumerate(self.columns):
+            index = next((positions[s] for s in col.sources if s in positions), None)
+            namespace[f'd{n}'] = col.default
+            if index is None:
+                expr = f'd{n}'
+            elif col.none_to_default:
+                expr = f'(r[{index}] if r[{index}] is not None else d{n})'
+            else:
+                expr = f'r[{index}]'
+            if col.convert is not None:
+                namespace[f'c{n}'] = col.convert
+                expr = f'c{n}({expr})'
+            items.append(f'{col.key!r}: {expr}')
+        source = 'def mapper(r):\n    return {' + ', '.join(items) + '}\n'
+        exec(compile(source, '<row_mapper>', 'exec'), namespace)
+        return namespace['mapper']
+
+    def for_cursor(self, cursor) -> Callable[[Any], Dict[str, Any]]:
+        """Функция маппинга для колонок данной выборки"""
+        names = tuple(d[0] for d in cursor.description)
+        mapper = self._compiled.get(names)
+        if mapper is None:
+            with self._lock:
+                mapper = self._compiled.get(names)
+                if mapper is None:
+                    mapper = self._compiled[names] = self._compile(names)
+        return mapper
+
+    def map_all(self, cursor) -> List[Dict[str, Any]]:
+        """Преобразует все строки выборки"""
+        mapper = self.for_cursor(cursor)
+        return [mapper(row) for row in cursor.fetchall()]
+
+    def map_one(self, cursor) -> Optional[Dict[str, Any]]:
+        """Преобразует первую строку выборки (None, если строк нет)"""
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return self.for_cursor(cursor)(row)
@@ -0,0 +1,281 @@
+"""
+Метрики стадий воронки (stage_metrics)
+
+Метрики ведутся приращениями в той же транзакции, что и изменение
+сделки (DealService.create/update/move_to_stage/delete, пересчёт суммы
+по товарам, перенос сделок при удалении стадии), поэтому FunnelService
+читает их без сканирования таблицы deals:
+
+- deals_count, total_amount - сделки, находящиеся на стадии сейчас;
+- avg_days_in_stage - среднее число дней на стадии у сделок, покинувших
+  её (время на стадии считается от moved_at, для новых сделок - от created_at);
+- conversion_percent - доля выходов со стадии, ведущих вперёд по воронке
+  (на стадию с большим order_index или на успешную, но не на отказ).
+
+Для средних хранятся накопители entered_count, exited_count,
+advanced_count и days_total. rebuild_stage_metrics пересчитывает всё по
+таблице deals и истории смен стадий (deal_history).
+"""
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..utils.enums import StageSemanticId
+
+# Накопители, добавляемые к исходной таблице stage_metrics
+ACCUMULATOR_COLUMNS = {
+    'entered_count': 'INTEGER NOT NULL DEFAULT 0',
+    'exited_count': 'INTEGER NOT NULL DEFAULT 0',
+    'advanced_count': 'INTEGER NOT NULL DEFAULT 0',
+    'days_total': 'REAL NOT NULL DEFAULT 0',
+}
+
+# Поля истории, в которых пишется смена стадии (move_to_stage и update)
+STAGE_HISTORY_FIELDS = ('stage', 'stage_id')
+
+_UPSERT_SQL = '''
+    INSERT INTO stage_metrics (
+        stage_id, deals_count, total_amount, entered_count, exited_count,
+        advanced_count, days_total, avg_days_in_stage, conversion_percent
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (stage_id) DO UPDATE SET
+        deals_count = deals_count + excluded.deals_count,
+        total_amount = total_amount + excluded.total_amount,
+        entered_count = entered_count + excluded.entered_count,
+        exited_count = exited_count + excluded.exited_count,
+        advanced_count = advanced_count + excluded.advanced_count,
+        days_total = days_total + excluded.days_total,
+        avg_days_in_stage = COALESCE(
+            (days_total + excluded.days_total) / NULLIF(exited_count + excluded.exited_count, 0), 0),
+        conversion_percent = COALESCE(
+            (advanced_count + excluded.advanced_count) * 100.0 / NULLIF(exited_count + excluded.exited_count, 0), 0),
+        updated_at = CURRENT_TIMESTAMP
+'''
+
+
+def _ratio(numerator: float, denominator: int, scale: float = 1.0) -> float:
+    return numerator * scale / denominator if denominator else 0.0
+
+
+def _upsert_row(
+    stage_id: int,
+    count: int = 0,
+    amount: float = 0.0,
+    entered: int = 0,
+    exited: int = 0,
+    advanced: int = 0,
+    days: float = 0.0,
+) -> Tuple[Any, ...]:
+    return (
+        stage_id, count, amount, entered, exited, advanced, days,
+        _ratio(days, exited), _ratio(advanced, exited, 100.0),
+    )
+
+
+def _parse_timestamp(value: Any) -> Optional[datetime]:
+    """Разбирает метку времени SQLite (UTC без зоны)"""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    try:
+        return datetime.fromisoformat(str(value).replace('Z', '').replace('T', ' '))
+    except ValueError:
+        return None
+
+
+def _days_between(start: Any, end: Optional[datetime] = None) -> float:
+    started = _parse_timestamp(start)
+    if started is None:
+        return 0.0
+    finished = end or datetime.now(timezone.utc).replace(tzinfo=None)
+    return max((finished - started).total_seconds() / 86400, 0.0)
+
+
+def _is_advance(stages: Dict[int, Tuple[int, str]], old_stage_id: int, new_stage_id: int) -> bool:
+    """Переход вперёд по воронке: на успешную стадию или дальше по порядку, но не в отказ"""
+    old, new = stages.get(old_stage_id), stages.get(new_stage_id)
+    if old is None or new is None or new[1] == StageSemanticId.F.value:
+        return False
+    return new[1] == StageSemanticId.S.value or new[0] > old[0]
+
+
+def _load_stages(conn, stage_ids=None) -> Dict[int, Tuple[int, str]]:
+    if stage_ids is None:
+        cursor = conn.execute('SELECT id, order_index, stage_semantic_id FROM deal_stages')
+    else:
+        ids = list(stage_ids)
+        placeholders = ', '.join('?' for _ in ids)
+        cursor = conn.execute(
+            f'SELECT id, order_index, stage_semantic_id FROM deal_stages WHERE id IN ({placeholders})',
+            ids,
+        )
+    return {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+
+
+def record_deal_created(conn, stage_id: int, amount: Optional[float]) -> None:
+    """Новая сделка на стадии"""
+    conn.execute(_UPSERT_SQL, _upsert_row(stage_id, count=1, amount=amount or 0, entered=1))
+
+
+def record_deal_deleted(conn, stage_id: int, amount: Optional[float]) -> None:
+    """Сделка удалена со стадии (не считается выходом со стадии)"""
+    conn.execute(_UPSERT_SQL, _upsert_row(stage_id, count=-1, amount=-(amount or 0)))
+
+
+def record_amount_change(conn, stage_id: int, delta: float) -> None:
+    """Изменение суммы сделки без смены стадии"""
+    if delta:
+        conn.execute(_UPSERT_SQL, _upsert_row(stage_id, amount=delta))
+
+
+def record_stage_change(
+    conn,
+    deal: Dict[str, Any],
+    new_stage_id: int,
+    new_amount: Optional[float] = None,
+) -> None:
+    """
+    Сделка перешла на другую стадию
+
+    Args:
+        deal: Строка сделки до изменения (stage_id, amount, moved_at, created_at)
+        new_stage_id: Новая стадия
+        new_amount: Сумма после изменения (если меняется вместе со стадией)
+    """
+    old_stage_id = deal['stage_id']
+    old_amount = deal.get('amount') or 0
+    amount = old_amount if new_amount is None else new_amount
+    days = _days_between(deal.get('moved_at') or deal.get('created_at'))
+    advanced = _is_advance(_load_stages(conn, {old_stage_id, new_stage_id}), old_stage_id, new_stage_id)
+    conn.executemany(_UPSERT_SQL, [
+        _upsert_row(old_stage_id, count=-1, amount=-old_amount, exited=1, advanced=int(advanced), days=days),
+        _upsert_row(new_stage_id, count=1, amount=amount, entered=1),
+    ])
+
+
+def record_stage_deals_moved(conn, old_stage_id: int, new_stage_id: int) -> None:
+    """
+    Все сделки стадии переносятся на другую стадию (удаление стадии)
+
+    Вызывается до переноса: приращения считаются одним запросом по
+    сделкам, которые сейчас находятся на old_stage_id.
+    """
+    rows = conn.execute(
+        'SELECT amount, moved_at, created_at FROM deals WHERE stage_id = ?', (old_stage_id,)
+    ).fetchall()
+    if not rows:
+        return
+    count = len(rows)
+    amount = sum(row[0] or 0 for row in rows)
+    days = sum(_days_between(row[1] or row[2]) for row in rows)
+    advanced = _is_advance(_load_stages(conn, {old_stage_id, new_stage_id}), old_stage_id, new_stage_id)
+    conn.executemany(_UPSERT_SQL, [
+        _upsert_row(old_stage_id, count=-count, amount=-amount, exited=count,
+                    advanced=count if advanced else 0, days=days),
+        _upsert_row(new_stage_id, count=count, amount=amount, entered=count),
+    ])
+
+
+def ensure_accumulator_columns(conn) -> None:
+    """Добавляет накопители в таблицу stage_metrics, созданную старой схемой"""
+    existing = {row[1] for row in conn.execute('PRAGMA table_info(stage_metrics)').fetchall()}
+    for name, definition in ACCUMULATOR_COLUMNS.items():
+        if name not in existing:
+            conn.execute(f'ALTER TABLE stage_metrics ADD COLUMN {name} {definition}')
+
+
+def _replay_history(conn, stages: Dict[int, Tuple[int, str]]) -> Dict[int, List[float]]:
+    """Накопители entered/exited/advanced/days по истории смен стадий существующих сделок"""
+    totals: Dict[int, List[float]] = {}
+
+    def bucket(stage_id: int) -> List[float]:
+        return totals.setdefault(stage_id, [0, 0, 0, 0.0])
+
+    placeholders = ', '.join('?' for _ in STAGE_HISTORY_FIELDS)
+    transitions: Dict[int, List[Tuple[int, int, Any]]] = {}
+    cursor = conn.execute(f'''
+        SELECT deal_id, old_value, new_value, changed_at FROM deal_history
+        WHERE field_name IN ({placeholders})
+        ORDER BY deal_id, changed_at, id
+    ''', STAGE_HISTORY_FIELDS)
+    for deal_id, old_value, new_value, changed_at in cursor.fetchall():
+        try:
+            transitions.setdefault(deal_id, []).append((int(old_value), int(new_value), changed_at))
+        except (TypeError, ValueError):
+            continue
+
+    for deal_id, stage_id, created_at in conn.execute('SELECT id, stage_id, created_at FROM deals').fetchall():
+        moves = transitions.get(deal_id, [])
+        current = moves[0][0] if moves else stage_id
+        entered_at = created_at
+        bucket(current)[0] += 1
+        for old_stage_id, new_stage_id, changed_at in moves:
+            exited = bucket(old_stage_id)
+            exited[1] += 1
+            exited[2] += int(_is_advance(stages, old_stage_id, new_stage_id))
+            exited[3] += _days_between(entered_at, _parse_timestamp(changed_at))
+            bucket(new_stage_id)[0] += 1
+            entered_at = changed_at
+    return totals
+
+
+def rebuild_stage_metrics(conn) -> None:
+    """Пересчитывает метрики всех стадий по сделкам и истории (бэкфилл, починка)"""
+    ensure_accumulator_columns(conn)
+    stages = _load_stages(conn)
+    history = _replay_history(conn, stages)
+    current = {
+        row[0]: (row[1], row[2])
+        for row in conn.execute('SELECT stage_id, COUNT(*), TOTAL(amount) FROM deals GROUP BY stage_id').fetchall()
+    }
+    conn.execute('DELETE FROM stage_metrics')
+    rows = []
+    for stage_id in stages:
+        count, amount = current.get(stage_id, (0, 0.0))
+        entered, exited, advanced, days = history.get(stage_id, (0, 0, 0, 0.0))
+        rows.append(_upsert_row(stage_id, count, amount, int(entered), int(exited), int(advanced), days))
+    conn.executemany(_UPSERT_SQL, rows)
+
+
+def check_stage_metrics(conn) -> List[Dict[str, Any]]:
+    """
+    Сверяет deals_count и total_amount с фактическими данными
+
+    Returns:
+        Расхождения: stage_id, значения в метриках и по сделкам
+    """
+    cursor = conn.execute('''
+        SELECT s.id AS stage_id,
+               COALESCE(m.deals_count, 0) AS deals_count,
+               COALESCE(m.total_amount, 0) AS total_amount,
+               COUNT(d.id) AS actual_count,
+               TOTAL(d.amount) AS actual_amount
+        FROM deal_stages s
+        LEFT JOIN stage_metrics m ON m.stage_id = s.id
+        LEFT JOIN deals d ON d.stage_id = s.id
+        GROUP BY s.id
+        HAVING COALESCE(m.deals_count, 0) != COUNT(d.id)
+            OR ABS(COALESCE(m.total_amount, 0) - TOTAL(d.amount)) > 0.005
+    ''')
+    return [dict(zip([d[0] for d in cursor.description], row)) for row in cursor.fetchall()]
+
+
+if __name__ == "__main__":
+    import sys
+
+    from .audit_writer import audit_writer
+    from .database import db_manager
+
+    # История смен стадий должна быть записана до пересчёта
+    audit_writer.flush()
+    if '--check' in sys.argv[1:]:
+        with db_manager.get_connection() as connection:
+            mismatches = check_stage_metrics(connection)
+        for item in mismatches:
+            print(item)
+        print(f"Расхождений метрик стадий: {len(mismatches)}")
+        sys.exit(1 if mismatches else 0)
+
+    with db_manager.get_connection() as connection:
+        rebuild_stage_metrics(connection)
+    print("Метрики стадий пересчитаны")
@@ -8,6 +8,11 @@ from fastapi.exceptions import RequestValidationError
 
 from .core.config import settings
 from .core.database import db_manager
+from .core.audit_writer import audit_writer
+from .core.db_executor import db_executor, run_in_db
+from .core.migrations import apply_migrations
+from .core.repricing import repricing_worker
+from .services.legacy_import import run_startup_imports
 from .api.middleware import setup_middleware
 from .api.v1 import router as v1_router
 from .core.exceptions import AppException, create_http_exception
@@ -25,10 +30,8 @@ def create_app() -> FastAPI:
     # Настройка middleware
     setup_middleware(app)
     
-    # Инициализация базы данных
-    db_manager.init_database()
-    db_manager.migrate_users_table()  # Миграция таблицы пользователей
-    db_manager.init_crm_tables()  # Инициализация таблиц CRM
+    # Инициализация базы данных (применяются только недостающие миграции)
+    apply_migrations(db_manager)
     
     # Подключение роутов
     app.include_router(v1_router)
@@ -70,6 +73,20 @@ def create_app() -> FastAPI:
             "redoc": "/redoc"
         }
     
+    # Однократный импорт legacy JSON до приёма запросов (после первого
+    # старта - один SELECT по журналу)
+    @app.on_event("startup")
+    async def run_legacy_imports():
+        await run_in_db(run_startup_imports)
+    
+    # Закрытие пула соединений SQLite при остановке
+    @app.on_event("shutdown")
+    async def close_database_connections():
+        db_executor.shutdown()
+        audit_writer.close()
+        repricing_worker.close()
+        db_manager.close_all()
+    
     # Эндпоинт здоровья
     @app.get("/health")
     async def health_check():
@@ -110,4 +110,97 @@ class Calculation(CalculationBase, IDMixin, TimestampMixin):
     pass
 
 
+class RepriceSimulationRequest(BaseModel):
+    """Запрос моделирования переоценки расчетов"""
+    prices: Dict[int, float] = Field(..., description="Новые цены за кг: ID марки из prices_metal_materials.json -> цена")
+    calculation_ids: Optional[List[int]] = Field(default=None, alias="calculationIds", description="Только эти расчеты (по умолчанию - все)")
+    include_unchanged: bool = Field(default=False, alias="includeUnchanged", description="Включать расчеты без затронутых позиций")
 
+    class Config:
+        populate_by_name = True
+
+
+class RepriceSimulationItem(BaseModel):
+    """Результат переоценки одного расчета"""
+    id: int
+    name: str
+    cost_price: float
+    new_cost_price: float
+    total_price: float
+    new_total_price: float
+    delta: float
+    delta_percent: float
+    affected_items: int = Field(..., description="Позиций с изменённой ценой")
+
+
+class RepriceSimulationSummary(BaseModel):
+    """Итоги переоценки по всем расчетам"""
+    calculations_count: int
+    affected_count: int
+    total_price: float
+    new_total_price: float
+    delta: float
+
+
+class RepriceSimulationResponse(BaseModel):
+    """Ответ моделирования переоценки"""
+    items: List[RepriceSimulationItem]
+    summary: RepriceSimulationSummary
+
+
+class EvaluatePosition(BaseModel):
+    """Позиция для расчета веса и стоимости на сервере"""
+    id: Optional[str] = Field(default=None, description="ID позиции (возвращается в ответе)")
+    material: Optional[str] = Field(default=None, description="Материал: \"<категория> <марка>\"")
+    material_id: Optional[int] = Field(default=None, alias="materialId", description="ID марки (вместо material)")
+    shape: str = Field(..., description="Форма: Круг, Квадрат, Шестигранник, Лист, Плита, Полоса, Труба, Труба профильная, Уголок")
+    dimensions: Dict[str, Any] = Field(default_factory=dict, description="Размеры, мм")
+    quantity: int = Field(default=1, ge=0, description="Количество")
+    price_per_kg: Optional[float] = Field(default=None, alias="pricePerKg", description="Цена за кг (по умолчанию - из справочника марок)")
+    processing_cost: float = Field(default=0.0, alias="processingCost", description="Стоимость обработки, руб")
+    markup: float = Field(default=0.0, description="Процент наценки")
+
+    class Config:
+        populate_by_name = True
+
+
+class EvaluateRequest(BaseModel):
+    """Пакет позиций для расчета"""
+    positions: List[EvaluatePosition] = Field(..., max_length=1000, description="Позиции (не более 1000)")
+
+
+class EvaluatedPosition(BaseModel):
+    """Рассчитанная позиция (поля совпадают с позицией-сортаментом расчета)"""
+    id: Optional[str] = None
+    error: Optional[str] = Field(default=None, description="Ошибка расчета позиции")
+    material_id: Optional[int] = Field(default=None, alias="materialId")
+    material: Optional[str] = None
+    density: Optional[float] = Field(default=None, description="Плотность, кг/м3")
+    weight: Optional[float] = Field(default=None, description="Вес единицы, кг")
+    total_weight: Optional[float] = Field(default=None, alias="totalWeight", description="Вес всех единиц, кг")
+    quantity: Optional[int] = None
+    price_per_kg: Optional[float] = Field(default=None, alias="pricePerKg")
+    material_cost: Optional[float] = Field(default=None, alias="materialCost")
+    processing_cost: Optional[float] = Field(default=None, alias="processingCost")
+    total_cost: Optional[float] = Field(default=None, alias="totalCost")
+    markup: Optional[float] = None
+    price: Optional[float] = Field(default=None, description="Стоимость с наценкой, руб")
+
+    class Config:
+        populate_by_name = True
+
+
+class EvaluateTotals(BaseModel):
+    """Итоги пакета по рассчитанным позициям"""
+    positions_count: int
+    errors_count: int
+    total_weight: float
+    material_cost: float
+    total_cost: float
+    price: float
+
+
+class EvaluateResponse(BaseModel):
+    """Ответ пакетного расчета позиций"""
+    items: List[EvaluatedPosition]
+    totals: EvaluateTotals
@@ -13,6 +13,7 @@ class PaginatedResponse(BaseModel, Generic[T]):
     total: int = Field(..., description="Общее количество записей")
     skip: int = Field(0, description="Пропущено записей")
     limit: int = Field(50, description="Лимит записей")
+    next_cursor: Optional[str] = Field(None, description="Курсор следующей страницы (None - страница последняя)")
 
 
 class ErrorResponse(BaseModel):
@@ -36,5 +37,26 @@ class FileResponse(BaseModel):
     uploaded_by: Optional[str] = Field(None, description="Кто загрузил")
 
 
+class EntityReference(BaseModel):
+    """Схема ссылки на запись (клиента или контакт)"""
+    id: int = Field(..., description="ID записи")
+    name: str = Field(..., description="Название или ФИО")
 
 
+class DuplicateCandidate(BaseModel):
+    """Схема пары вероятных дублей"""
+    left: EntityReference = Field(..., description="Запись с меньшим ID")
+    right: EntityReference = Field(..., description="Вторая запись пары")
+    score: float = Field(..., description="Оценка сходства от 0 до 1")
+    matched_by: List[str] = Field(default_factory=list, description="Совпавшие признаки: inn, name, phone, email, company")
+
+
+class DuplicateListResponse(BaseModel):
+    """Схема списка пар вероятных дублей"""
+    data: List[DuplicateCandidate] = Field(..., description="Пары по убыванию оценки")
+    total: int = Field(..., description="Всего пар с оценкой не ниже порога")
+
+
+class MergeRequest(BaseModel):
+    """Схема запроса на слияние записей"""
+    source_ids: List[int] = Field(..., min_length=1, description="ID записей, сливаемых в целевую и удаляемых")
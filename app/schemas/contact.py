@@ -81,6 +81,10 @@ class ContactResponse(ContactBase):
     created_by_id: Optional[int] = None
     modified_by_id: Optional[int] = None
     deals_count: int = Field(0, description="Количество сделок")
+    open_deals_count: int = Field(0, description="Количество открытых сделок")
+    won_deals_count: int = Field(0, description="Количество выигранных сделок")
+    won_amount: float = Field(0, description="Сумма выигранных сделок")
+    last_deal_at: Optional[datetime] = Field(None, description="Дата последней сделки")
     last_activity_at: Optional[datetime] = None
     communications: List[ContactCommunicationSchema] = Field(default_factory=list)
     tags: List[str] = Field(default_factory=list)
@@ -95,6 +99,26 @@ class ContactResponse(ContactBase):
         from_attributes = True
 
 
+class ContactReference(BaseModel):
+    """Схема ссылки на контакт"""
+    id: int = Field(..., description="ID контакта")
+    name: str = Field(..., description="ФИО контакта")
+
+
+class ContactLookupMatch(BaseModel):
+    """Схема совпадения обратного поиска"""
+    contact: Optional[ContactReference] = Field(None, description="Найденный контакт")
+    company: Optional[CompanyReference] = Field(None, description="Компания контакта или найденная компания")
+    matched_by: str = Field(..., description="Поле совпадения: phone, email")
+
+
+class ContactLookupResponse(BaseModel):
+    """Схема ответа обратного поиска по телефону/email"""
+    phone: Optional[str] = Field(None, description="Нормализованный телефон (E.164 без +)")
+    email: Optional[str] = Field(None, description="Нормализованный email")
+    matches: List[ContactLookupMatch] = Field(default_factory=list)
+
+
 class ContactListResponse(PaginatedResponse[ContactResponse]):
     """Схема списка контактов с пагинацией"""
     pass
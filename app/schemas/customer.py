@@ -113,6 +113,11 @@ class CustomerResponse(CustomerBase):
     updated_at: Optional[datetime] = None
     created_by_id: Optional[int] = None
     modified_by_id: Optional[int] = None
+    deals_count: int = Field(0, description="Количество сделок")
+    open_deals_count: int = Field(0, description="Количество открытых сделок")
+    won_deals_count: int = Field(0, description="Количество выигранных сделок")
+    won_amount: float = Field(0, description="Сумма выигранных сделок")
+    last_deal_at: Optional[datetime] = Field(None, description="Дата последней сделки")
     contacts: List[CustomerContactSchema] = Field(default_factory=list)
     files: List[CustomerFileSchema] = Field(default_factory=list)
     
@@ -120,6 +125,79 @@ class CustomerResponse(CustomerBase):
         from_attributes = True
 
 
+class CustomerOverviewContact(BaseModel):
+    """Контакт клиента в карточке"""
+    id: int
+    name: str = Field(..., description="ФИО контакта")
+    position: Optional[str] = None
+    email: Optional[str] = None
+    phone: Optional[str] = None
+    is_active: bool = True
+    deals_count: int = 0
+    last_deal_at: Optional[datetime] = None
+
+
+class CustomerOverviewDeal(BaseModel):
+    """Краткие данные сделки клиента"""
+    id: int
+    deal_number: str
+    title: str
+    amount: float = 0
+    currency_id: Optional[str] = None
+    is_closed: bool = False
+    primary_contact_id: Optional[int] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+
+class CustomerStageSummary(BaseModel):
+    """Сделки клиента на стадии"""
+    funnel_id: int
+    funnel_name: Optional[str] = None
+    stage_id: int
+    stage_name: Optional[str] = None
+    stage_semantic_id: Optional[str] = None
+    deals_count: int = Field(..., description="Всего сделок клиента на стадии")
+    amount: float = Field(0, description="Сумма сделок на стадии")
+    open_amount: float = Field(0, description="Сумма незакрытых сделок на стадии")
+    deals: List[CustomerOverviewDeal] = Field(default_factory=list, description="Последние изменённые сделки стадии")
+
+
+class CustomerOverviewTotals(BaseModel):
+    """Итоги по сделкам клиента"""
+    deals_count: int = 0
+    open_deals_count: int = 0
+    won_deals_count: int = 0
+    won_amount: float = 0
+    open_amount: float = 0
+    last_deal_at: Optional[datetime] = None
+    contacts_count: int = 0
+
+
+class CustomerActivity(BaseModel):
+    """Событие по сделке клиента: изменение (history) или комментарий (comment)"""
+    kind: str
+    deal_id: int
+    deal_title: Optional[str] = None
+    at: Optional[datetime] = None
+    user_id: Optional[int] = None
+    user_name: Optional[str] = None
+    field_name: Optional[str] = None
+    old_value: Optional[str] = None
+    new_value: Optional[str] = None
+    change_type: Optional[str] = None
+    text: Optional[str] = None
+
+
+class CustomerOverviewResponse(BaseModel):
+    """Карточка клиента (GET /customers/{id}/overview)"""
+    customer: CustomerResponse
+    contacts: List[CustomerOverviewContact] = Field(default_factory=list)
+    stages: List[CustomerStageSummary] = Field(default_factory=list)
+    totals: CustomerOverviewTotals
+    recent_activity: List[CustomerActivity] = Field(default_factory=list)
+
+
 class CustomerListResponse(PaginatedResponse[CustomerResponse]):
     """Схема списка клиентов с пагинацией"""
     pass
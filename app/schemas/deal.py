@@ -217,5 +217,30 @@ class DealListResponse(PaginatedResponse[DealResponse]):
     pass
 
 
+class DealSearchHit(BaseModel):
+    """Схема результата полнотекстового поиска по сделкам"""
+    id: int = Field(..., description="ID сделки")
+    deal_number: str = Field(..., description="Номер сделки")
+    title: str = Field(..., description="Название сделки")
+    amount: float = Field(0, description="Сумма сделки")
+    currency_id: Optional[str] = None
+    funnel_id: int = Field(..., description="ID воронки")
+    stage_id: int = Field(..., description="ID стадии")
+    company_id: Optional[int] = None
+    primary_contact_id: Optional[int] = None
+    responsible_user_id: Optional[int] = None
+    is_closed: bool = Field(False, description="Закрыта ли сделка")
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    matched_in: str = Field(..., description="Где найдено совпадение: deal, comment, product")
+    snippet: Optional[str] = Field(None, description="Фрагмент текста с выделенными совпадениями (<mark>)")
+    score: float = Field(..., description="Релевантность (больше - лучше)")
+
+
+class DealSearchResponse(PaginatedResponse[DealSearchHit]):
+    """Схема результатов поиска по сделкам"""
+    total_capped: bool = Field(False, description="total ограничен пределом подсчёта (найдено не меньше)")
+
+
 
 
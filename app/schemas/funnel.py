@@ -101,6 +101,32 @@ class FunnelResponse(FunnelBase):
         from_attributes = True
 
 
+class BoardStageResponse(BaseModel):
+    """Схема колонки канбан-доски"""
+    id: int = Field(..., description="ID стадии")
+    stage_id: str = Field(..., description="Идентификатор стадии")
+    name: str = Field(..., description="Название стадии")
+    label: Optional[str] = None
+    color_text: Optional[str] = None
+    color_bg: Optional[str] = None
+    color_border: Optional[str] = None
+    order_index: int = Field(0, description="Порядковый номер")
+    stage_semantic_id: str = Field("P", description="Семантический идентификатор: P, S, F")
+    deals_count: int = Field(0, description="Количество сделок в стадии")
+    total_amount: float = Field(0, description="Сумма сделок в стадии")
+    deals: List[dict] = Field(default_factory=list, description="Первые сделки стадии (краткая проекция)")
+    next_cursor: Optional[str] = Field(None, description="Курсор для догрузки через GET /deals")
+
+
+class FunnelBoardResponse(BaseModel):
+    """Схема канбан-доски воронки"""
+    funnel_id: int = Field(..., description="ID воронки")
+    name: str = Field(..., description="Название воронки")
+    sort: str = Field(..., description="Ключ сортировки сделок в колонках")
+    order: str = Field(..., description="Направление сортировки")
+    stages: List[BoardStageResponse] = Field(default_factory=list, description="Колонки доски")
+
+
 class StageReorderRequest(BaseModel):
     """Схема для изменения порядка стадий"""
     stage_ids: List[int] = Field(..., description="Список ID стадий в новом порядке")
@@ -6,6 +6,7 @@ from datetime import timedelta
 
 from ..core.security import security_manager
 from ..core.database import db_manager
+from ..core.db_executor import run_in_db
 from ..core.exceptions import AuthenticationError, AuthorizationError
 from ..models.user import UserLogin, UserCreate, UserUpdate, PasswordChange
 
@@ -19,8 +20,10 @@ class AuthService:
     
     async def authenticate_user(self, user_credentials: UserLogin) -> Dict[str, str]:
         """Аутентификация пользователя"""
-        user = self.security_manager.authenticate_user(
-            user_credentials.get_login_value(), 
+        # Поиск пользователя и проверка bcrypt-хеша блокируют поток
+        user = await run_in_db(
+            self.security_manager.authenticate_user,
+            user_credentials.get_login_value(),
             user_credentials.password
         )
         
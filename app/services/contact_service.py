@@ -5,46 +5,42 @@ import os
 from datetime import datetime
 from typing import Any, Dict, List, Optional, Tuple
 
-from ..core.database import db_manager
-from ..utils.storage import read_json_file, generate_external_id
+from ..core.counters import fetch_page
+from ..core import dedup
+from ..core.database import db_manager, fetch_in
+from ..core.contact_lookup import EMAIL, PHONE, lookup, lookup_cache, refresh_contact
+from ..core.name_search import refresh_search_keys, search_condition
+from ..utils.pagination import resolve_sort, decode_cursor, keyset_tail, split_page
+from ..utils.search_keys import normalize_email, normalize_phone_e164
+from ..utils.storage import generate_external_id
 from ..utils.validators import validate_email, validate_phone
 
 
 CONTACTS_JSON_PATH = os.path.join(os.path.dirname(__file__), '..', 'contacts.json')
 
+# Ключи сортировки для keyset-пагинации (под каждый есть индекс (ключ, id))
+CONTACT_SORT_KEYS = ('updated_at', 'created_at')
+
 
 class ContactService:
     """Сервис для управления контактами на основе SQLite"""
 
-    def __init__(self) -> None:
-        self.json_path = CONTACTS_JSON_PATH
-        self._legacy_migrated = False
-        self._ensure_legacy_data_migrated()
-
     # ------------------------------------------------------------------
     # Legacy migration
     # ------------------------------------------------------------------
-    def _ensure_legacy_data_migrated(self) -> None:
-        if self._legacy_migrated:
-            return
-        self._legacy_migrated = True
+    def import_legacy(self, conn, records: List[Dict[str, Any]]) -> int:
+        """
+        Импортирует legacy записи в транзакции вызывающего
 
-        try:
-            with db_manager.get_connection() as conn:
-                cursor = conn.execute('SELECT COUNT(*) AS cnt FROM contacts')
-                if cursor.fetchone()['cnt'] > 0:
-                    return
-        except Exception:
-            return
+        Запускается однократно из app.services.legacy_import, а не при
+        создании сервиса.
 
-        legacy_contacts = read_json_file(self.json_path)
-        if not legacy_contacts:
-            return
-
-        with db_manager.get_connection() as conn:
-            for contact in legacy_contacts:
-                self._insert_contact_from_legacy(conn, contact)
-            conn.commit()
+        Returns:
+            Количество импортированных записей
+        """
+        for record in records:
+            self._insert_contact_from_legacy(conn, record)
+        return len(records)
 
     def _insert_contact_from_legacy(self, conn, contact: Dict[str, Any]) -> int:
         first_name, middle_name, last_name = self._extract_names(contact)
@@ -53,9 +49,9 @@ class ContactService:
             INSERT INTO contacts (
                 external_id, first_name, middle_name, last_name, honorific,
                 position, department, birthdate, photo_url, company_id,
-                responsible_user_id, email, phone, is_active, deals_count,
+                responsible_user_id, email, phone, is_active,
                 last_activity_at, created_at, updated_at, created_by_id, modified_by_id
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             ''',
             (
                 contact.get('external_id'),
@@ -72,7 +68,6 @@ class ContactService:
                 contact.get('email'),
                 contact.get('phone'),
                 contact.get('is_active', True),
-                contact.get('deals_count', 0),
                 contact.get('last_activity_at'),
                 contact.get('created_at') or datetime.utcnow().isoformat(),
                 contact.get('updated_at') or datetime.utcnow().isoformat(),
@@ -83,6 +78,7 @@ class ContactService:
         contact_id = cursor.lastrowid
         external_id = contact.get('external_id') or generate_external_id('contact', contact_id)
         conn.execute('UPDATE contacts SET external_id = ? WHERE id = ?', (external_id, contact_id))
+        refresh_search_keys(conn, 'contacts', contact_id)
 
         for comm in contact.get('communications', []):
             conn.execute(
@@ -108,6 +104,7 @@ class ContactService:
                 (contact_id, tag),
             )
 
+        refresh_contact(conn, contact_id)
         return contact_id
 
     # ------------------------------------------------------------------
@@ -153,80 +150,113 @@ class ContactService:
             'phone': row['phone'] or '',
             'is_active': bool(row['is_active']),
             'deals_count': row['deals_count'] or 0,
+            'open_deals_count': row['open_deals_count'],
+            'won_deals_count': row['won_deals_count'],
+            'won_amount': row['won_amount'],
+            'last_deal_at': row['last_deal_at'],
             'last_activity_at': row['last_activity_at'],
             'created_at': row['created_at'],
             'updated_at': row['updated_at'],
         }
 
-    def _fetch_communications(self, conn, contact_id: int) -> List[Dict[str, Any]]:
-        cursor = conn.execute(
+    def _fetch_communications(self, conn, contact_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+        """Коммуникации контактов одним запросом: contact_id -> список"""
+        rows = fetch_in(
+            conn,
             '''
-            SELECT id, comm_type, value_type, value, is_primary
+            SELECT id, contact_id, comm_type, value_type, value, is_primary
             FROM contact_communications
-            WHERE contact_id = ?
+            WHERE contact_id IN ({ids})
             ORDER BY is_primary DESC, id ASC
             ''',
-            (contact_id,),
+            contact_ids,
         )
-        return [
-            {
+        grouped: Dict[int, List[Dict[str, Any]]] = {}
+        for row in rows:
+            grouped.setdefault(row['contact_id'], []).append({
                 'id': row['id'],
                 'comm_type': row['comm_type'],
                 'value_type': row['value_type'],
                 'value': row['value'],
                 'is_primary': bool(row['is_primary']),
-            }
-            for row in cursor.fetchall()
-        ]
+            })
+        return grouped
 
-    def _fetch_tags(self, conn, contact_id: int) -> List[str]:
-        cursor = conn.execute(
+    def _fetch_tags(self, conn, contact_ids: List[int]) -> Dict[int, List[str]]:
+        """Теги контактов одним запросом: contact_id -> список"""
+        rows = fetch_in(
+            conn,
             '''
-            SELECT tag
+            SELECT contact_id, tag
             FROM contact_tags
-            WHERE contact_id = ?
+            WHERE contact_id IN ({ids})
             ORDER BY tag ASC
             ''',
-            (contact_id,),
+            contact_ids,
         )
-        return [row['tag'] for row in cursor.fetchall()]
+        grouped: Dict[int, List[str]] = {}
+        for row in rows:
+            grouped.setdefault(row['contact_id'], []).append(row['tag'])
+        return grouped
+
+    def _attach_company_and_responsible(self, conn, contacts: List[Dict[str, Any]]) -> None:
+        """Подставляет названия компаний и имена ответственных (по запросу на таблицу)"""
+        company_ids = list({contact['company_id'] for contact in contacts if contact.get('company_id')})
+        companies = {
+            row['id']: row['name']
+            for row in fetch_in(conn, 'SELECT id, name FROM customers WHERE id IN ({ids})', company_ids)
+        }
+        user_ids = list({contact['responsible_user_id'] for contact in contacts if contact.get('responsible_user_id')})
+        users = {
+            row['id']: row['full_name'] or row['username'] or ''
+            for row in fetch_in(conn, 'SELECT id, full_name, username FROM users WHERE id IN ({ids})', user_ids)
+        }
 
-    def _attach_company_and_responsible(self, conn, contact: Dict[str, Any]) -> None:
-        company_id = contact.get('company_id')
-        if company_id:
-            cursor = conn.execute('SELECT name FROM customers WHERE id = ?', (company_id,))
-            row = cursor.fetchone()
-            contact['company_name'] = row['name'] if row else ''
-            contact['company'] = {'id': company_id, 'name': contact['company_name']} if row else None
-        else:
-            contact['company_name'] = ''
-            contact['company'] = None
-
-        responsible_id = contact.get('responsible_user_id')
-        if responsible_id:
-            cursor = conn.execute('SELECT full_name, username FROM users WHERE id = ?', (responsible_id,))
-            row = cursor.fetchone()
-            if row:
-                contact['responsible_name'] = row['full_name'] or row['username'] or ''
+        for contact in contacts:
+            company_id = contact.get('company_id')
+            if company_id and company_id in companies:
+                contact['company_name'] = companies[company_id]
+                contact['company'] = {'id': company_id, 'name': contact['company_name']}
+            else:
+                contact['company_name'] = ''
+                contact['company'] = None
+
+            responsible_id = contact.get('responsible_user_id')
+            if responsible_id and responsible_id in users:
+                contact['responsible_name'] = users[responsible_id]
                 contact['responsible_user'] = {'id': responsible_id, 'name': contact['responsible_name']}
             else:
                 contact['responsible_name'] = ''
                 contact['responsible_user'] = None
-        else:
-            contact['responsible_name'] = ''
-            contact['responsible_user'] = None
+
+    def _hydrate_contacts(self, conn, rows: List[Any]) -> List[Dict[str, Any]]:
+        """Собирает контакты страницы: дочерние записи и имена читаются пакетно (IN)"""
+        if not rows:
+            return []
+        contact_ids = [row['id'] for row in rows]
+        communications = self._fetch_communications(conn, contact_ids)
+        tags = self._fetch_tags(conn, contact_ids)
+        contacts = []
+        for row in rows:
+            contact = self._row_to_contact(row)
+            contact['communications'] = communications.get(row['id'], [])
+            contact['tags'] = tags.get(row['id'], [])
+            contacts.append(contact)
+        self._attach_company_and_responsible(conn, contacts)
+        return contacts
 
     def _hydrate_contact(self, conn, row: Any) -> Dict[str, Any]:
-        contact = self._row_to_contact(row)
-        contact['communications'] = self._fetch_communications(conn, row['id'])
-        contact['tags'] = self._fetch_tags(conn, row['id'])
-        self._attach_company_and_responsible(conn, contact)
-        return contact
+        return self._hydrate_contacts(conn, [row])[0]
 
     # ------------------------------------------------------------------
     # CRUD
     # ------------------------------------------------------------------
-    def get_all(
+    def get_all(self, *args: Any, **kwargs: Any) -> Tuple[List[Dict[str, Any]], int]:
+        """Список контактов с фильтрами (параметры как у get_page)"""
+        contacts, total, _ = self.get_page(*args, **kwargs)
+        return contacts, total
+
+    def get_page(
         self,
         skip: int = 0,
         limit: int = 50,
@@ -235,9 +265,18 @@ class ContactService:
         tags: Optional[List[str]] = None,
         search: Optional[str] = None,
         is_active: Optional[bool] = None,
-    ) -> Tuple[List[Dict[str, Any]], int]:
-        """Список контактов с фильтрами"""
-        self._ensure_legacy_data_migrated()
+        cursor: Optional[str] = None,
+        sort: str = 'updated_at',
+        order: str = 'desc',
+    ) -> Tuple[List[Dict[str, Any]], int, Optional[str]]:
+        """
+        Страница контактов: (контакты, всего, курсор следующей страницы)
+
+        С курсором выборка продолжается после последней строки по (sort, id),
+        skip игнорируется.
+        """
+        sort, order = resolve_sort(sort, order, CONTACT_SORT_KEYS)
+        after = decode_cursor(cursor, sort, order) if cursor else None
 
         with db_manager.get_connection() as conn:
             query = 'SELECT * FROM contacts WHERE 1=1'
@@ -252,9 +291,9 @@ class ContactService:
                 params.append(responsible_user_id)
 
             if search:
-                like = f"%{search.lower()}%"
-                query += ' AND (LOWER(first_name) LIKE ? OR LOWER(last_name) LIKE ? OR LOWER(phone) LIKE ? OR LOWER(email) LIKE ?)'
-                params.extend([like, like, like, like])
+                condition, search_params = search_condition('contacts', search)
+                query += f' AND ({condition})'
+                params.extend(search_params)
 
             if is_active is not None:
                 query += ' AND is_active = ?'
@@ -271,19 +310,22 @@ class ContactService:
                 '''
                 params.extend(tags)
 
-            count_cursor = conn.execute(query.replace('SELECT *', 'SELECT COUNT(*) AS cnt'), params)
-            total = count_cursor.fetchone()['cnt']
-
-            query += ' ORDER BY updated_at DESC LIMIT ? OFFSET ?'
-            params.extend([limit, skip])
-            cursor = conn.execute(query, params)
-            contacts = [self._hydrate_contact(conn, row) for row in cursor.fetchall()]
-            return contacts, total
+            # Итог из счётчиков, если нет поиска и тегов; иначе COUNT(*) OVER() в том же запросе
+            filters = None
+            if not search and not tags:
+                filters = {
+                    'company_id': company_id,
+                    'responsible_user_id': responsible_user_id,
+                    'is_active': (1 if is_active else 0) if is_active is not None else None,
+                }
+            tail, tail_params = keyset_tail(sort, order, after, limit, skip)
+            rows, total = fetch_page(conn, 'contacts', query, params, filters, tail, tail_params)
+            rows, next_cursor = split_page(rows, limit, sort, order)
+            contacts = self._hydrate_contacts(conn, rows)
+            return contacts, total, next_cursor
 
     def get_by_id(self, contact_id: int) -> Optional[Dict[str, Any]]:
         """Возвращает контакт по ID"""
-        self._ensure_legacy_data_migrated()
-
         with db_manager.get_connection() as conn:
             cursor = conn.execute('SELECT * FROM contacts WHERE id = ?', (contact_id,))
             row = cursor.fetchone()
@@ -293,8 +335,6 @@ class ContactService:
 
     def create(self, contact_data: Dict[str, Any], user_id: Optional[int] = None) -> Dict[str, Any]:
         """Создаёт контакт"""
-        self._ensure_legacy_data_migrated()
-
         communications = contact_data.get('communications', []).copy()
         if not communications:
             if contact_data.get('email'):
@@ -332,9 +372,9 @@ class ContactService:
                 INSERT INTO contacts (
                     external_id, first_name, middle_name, last_name, honorific,
                     position, department, birthdate, photo_url, company_id,
-                    responsible_user_id, email, phone, is_active, deals_count,
+                    responsible_user_id, email, phone, is_active,
                     last_activity_at, created_at, updated_at, created_by_id, modified_by_id
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 ''',
                 (
                     None,
@@ -351,7 +391,6 @@ class ContactService:
                     email,
                     phone,
                     contact_data.get('is_active', True),
-                    contact_data.get('deals_count', 0),
                     contact_data.get('last_activity_at'),
                     datetime.utcnow().isoformat(),
                     datetime.utcnow().isoformat(),
@@ -362,6 +401,7 @@ class ContactService:
             contact_id = cursor.lastrowid
             external_id = generate_external_id('contact', contact_id)
             conn.execute('UPDATE contacts SET external_id = ? WHERE id = ?', (external_id, contact_id))
+            refresh_search_keys(conn, 'contacts', contact_id)
 
             for comm in communications:
                 conn.execute(
@@ -387,13 +427,11 @@ class ContactService:
                     (contact_id, tag),
                 )
 
-            conn.commit()
+            refresh_contact(conn, contact_id)
             return self.get_by_id(contact_id)  # type: ignore[arg-type]
 
     def update(self, contact_id: int, contact_data: Dict[str, Any], user_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
         """Обновляет контакт"""
-        self._ensure_legacy_data_migrated()
-
         email = contact_data.get('email')
         phone = contact_data.get('phone')
         if email and email.strip() and not validate_email(email):
@@ -447,6 +485,7 @@ class ContactService:
                     return None
 
                 conn.execute(sql, values)
+                refresh_search_keys(conn, 'contacts', contact_id)
 
                 if 'communications' in contact_data:
                     conn.execute('DELETE FROM contact_communications WHERE contact_id = ?', (contact_id,))
@@ -476,29 +515,86 @@ class ContactService:
                             (contact_id, tag),
                         )
 
-                conn.commit()
+                refresh_contact(conn, contact_id)
 
         return self.get_by_id(contact_id)
 
     def delete(self, contact_id: int) -> bool:
         """Удаляет контакт"""
-        self._ensure_legacy_data_migrated()
-
         with db_manager.get_connection() as conn:
             cursor = conn.execute('SELECT id FROM contacts WHERE id = ?', (contact_id,))
             if not cursor.fetchone():
                 return False
             conn.execute('DELETE FROM contacts WHERE id = ?', (contact_id,))
-            conn.commit()
+            refresh_contact(conn, contact_id)
             return True
 
+    def find_duplicates(
+        self,
+        min_score: float = dedup.DEFAULT_MIN_SCORE,
+        limit: int = 100,
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """Пары вероятных дублей контактов (см. app.core.dedup)"""
+        with db_manager.get_connection() as conn:
+            return dedup.find_duplicates(conn, dedup.CONTACTS, min_score, limit)
+
+    def merge(self, target_id: int, source_ids: List[int], user_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Сливает контакты source_ids в контакт target_id
+
+        Returns:
+            Целевой контакт или None, если какой-либо из контактов не найден
+
+        Raises:
+            ValueError: Некорректный список сливаемых контактов
+        """
+        source_ids = dedup.merge_source_ids(target_id, source_ids)
+
+        with db_manager.get_connection() as conn:
+            ids = [target_id] + source_ids
+            found = fetch_in(conn, 'SELECT id FROM contacts WHERE id IN ({ids})', ids)
+            if len(found) != len(ids):
+                return None
+            dedup.merge_contacts(conn, target_id, source_ids, user_id)
+
+        return self.get_by_id(target_id)
+
+    def lookup(self, phone: Optional[str] = None, email: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Обратный поиск контакта и компании по телефону и/или email
+
+        Значения нормализуются (телефон - E.164, email - нижний регистр) и
+        ищутся по точному совпадению в contact_lookup; результат кэшируется.
+
+        Raises:
+            ValueError: Не передано ни одного значения для поиска
+        """
+        phone_key = normalize_phone_e164(phone) if phone else ''
+        email_key = normalize_email(email) if email else ''
+        queries = [(kind, value) for kind, value in ((PHONE, phone_key), (EMAIL, email_key)) if value]
+        if not queries:
+            raise ValueError("Укажите телефон или email для поиска")
+
+        matches: List[Dict[str, Any]] = []
+        for key in queries:
+            found = lookup_cache.get(key)
+            if found is None:
+                generation = lookup_cache.generation
+                with db_manager.get_connection() as conn:
+                    found = lookup(conn, *key)
+                lookup_cache.put(key, found, generation)
+            matches.extend(found)
+        return {
+            'phone': phone_key or None,
+            'email': email_key or None,
+            'matches': matches,
+        }
+
     # ------------------------------------------------------------------
     # Communications & tags
     # ------------------------------------------------------------------
     def add_communication(self, contact_id: int, communication: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Добавляет коммуникацию"""
-        self._ensure_legacy_data_migrated()
-
         with db_manager.get_connection() as conn:
             cursor = conn.execute('SELECT id FROM contacts WHERE id = ?', (contact_id,))
             if not cursor.fetchone():
@@ -527,23 +623,21 @@ class ContactService:
                     bool(communication.get('is_primary', False)),
                 ),
             )
-            conn.commit()
+            refresh_contact(conn, contact_id)
         return self.get_by_id(contact_id)
 
     def remove_communication(self, contact_id: int, comm_id: int) -> Optional[Dict[str, Any]]:
         """Удаляет коммуникацию"""
-        self._ensure_legacy_data_migrated()
         with db_manager.get_connection() as conn:
             conn.execute(
                 'DELETE FROM contact_communications WHERE id = ? AND contact_id = ?',
                 (comm_id, contact_id),
             )
-            conn.commit()
+            refresh_contact(conn, contact_id)
         return self.get_by_id(contact_id)
 
     def add_tag(self, contact_id: int, tag_name: str) -> Optional[Dict[str, Any]]:
         """Добавляет тег"""
-        self._ensure_legacy_data_migrated()
         with db_manager.get_connection() as conn:
             conn.execute(
                 '''
@@ -552,45 +646,13 @@ class ContactService:
                 ''',
                 (contact_id, tag_name),
             )
-            conn.commit()
         return self.get_by_id(contact_id)
 
     def remove_tag(self, contact_id: int, tag_name: str) -> Optional[Dict[str, Any]]:
         """Удаляет тег"""
-        self._ensure_legacy_data_migrated()
         with db_manager.get_connection() as conn:
             conn.execute(
                 'DELETE FROM contact_tags WHERE contact_id = ? AND tag = ?',
                 (contact_id, tag_name),
             )
-            conn.commit()
         return self.get_by_id(contact_id)
-
-    # ------------------------------------------------------------------
-    # Deal counters
-    # ------------------------------------------------------------------
-    def increment_deals_count(self, contact_id: int) -> None:
-        with db_manager.get_connection() as conn:
-            conn.execute(
-                '''
-                UPDATE contacts
-                SET deals_count = deals_count + 1,
-                    last_activity_at = CURRENT_TIMESTAMP
-                WHERE id = ?
-                ''',
-                (contact_id,),
-            )
-            conn.commit()
-
-    def decrement_deals_count(self, contact_id: int) -> None:
-        with db_manager.get_connection() as conn:
-            conn.execute(
-                '''
-                UPDATE contacts
-                SET deals_count = CASE WHEN deals_count > 0 THEN deals_count - 1 ELSE 0 END
-                WHERE id = ?
-                ''',
-                (contact_id,),
-            )
-            conn.commit()
-
@@ -5,48 +5,42 @@ import os
 from datetime import datetime
 from typing import Any, Dict, List, Optional, Tuple
 
-from ..core.database import db_manager
+from ..core.counters import fetch_page
+from ..core import dedup
+from ..core.database import db_manager, fetch_in
+from ..core.contact_lookup import refresh_customer
+from ..core.name_search import refresh_search_keys, search_condition
 from ..utils.customer_rules import CUSTOMER_TYPE_RULES, validate_customer_fields
-from ..utils.storage import read_json_file, generate_external_id
+from ..utils.pagination import resolve_sort, decode_cursor, keyset_tail, split_page
+from ..utils.storage import generate_external_id
 from ..utils.validators import validate_inn, validate_kpp, validate_ogrn
 
 
 CUSTOMERS_JSON_PATH = os.path.join(os.path.dirname(__file__), '..', 'customers.json')
 
+# Ключи сортировки для keyset-пагинации (под каждый есть индекс (ключ, id))
+CUSTOMER_SORT_KEYS = ('created_at', 'updated_at')
+
 
 class CustomerService:
     """Сервис для работы с клиентами на основе SQLite"""
 
-    def __init__(self) -> None:
-        self.json_path = CUSTOMERS_JSON_PATH
-        self._legacy_migrated = False
-        self._ensure_legacy_data_migrated()
-
     # ------------------------------------------------------------------
     # Legacy migration helpers
     # ------------------------------------------------------------------
-    def _ensure_legacy_data_migrated(self) -> None:
-        """Однократно переносит данные из legacy JSON в SQLite, если таблица пуста"""
-        if self._legacy_migrated:
-            return
-        self._legacy_migrated = True
+    def import_legacy(self, conn, records: List[Dict[str, Any]]) -> int:
+        """
+        Импортирует legacy записи в транзакции вызывающего
 
-        try:
-            with db_manager.get_connection() as conn:
-                cursor = conn.execute('SELECT COUNT(*) AS cnt FROM customers')
-                if cursor.fetchone()['cnt'] > 0:
-                    return
-        except Exception:
-            return
+        Запускается однократно из app.services.legacy_import, а не при
+        создании сервиса.
 
-        legacy_customers = read_json_file(self.json_path)
-        if not legacy_customers:
-            return
-
-        with db_manager.get_connection() as conn:
-            for customer in legacy_customers:
-                self._insert_customer_from_legacy(conn, customer)
-            conn.commit()
+        Returns:
+            Количество импортированных записей
+        """
+        for record in records:
+            self._insert_customer_from_legacy(conn, record)
+        return len(records)
 
     def _insert_customer_from_legacy(self, conn, customer: Dict[str, Any]) -> int:
         """Импортирует legacy запись клиента в SQLite"""
@@ -87,6 +81,7 @@ class CustomerService:
         customer_id = cursor.lastrowid
         external_id = customer.get('external_id') or generate_external_id('customer', customer_id)
         conn.execute('UPDATE customers SET external_id = ? WHERE id = ?', (external_id, customer_id))
+        refresh_search_keys(conn, 'customers', customer_id)
 
         for contact in customer.get('contacts', []):
             conn.execute(
@@ -125,6 +120,7 @@ class CustomerService:
                 ),
             )
 
+        refresh_customer(conn, customer_id)
         return customer_id
 
     # ------------------------------------------------------------------
@@ -157,41 +153,51 @@ class CustomerService:
             'annual_revenue': row['annual_revenue'],
             'employees_count': row['employees_count'],
             'industry': row['industry'],
+            'deals_count': row['deals_count'],
+            'open_deals_count': row['open_deals_count'],
+            'won_deals_count': row['won_deals_count'],
+            'won_amount': row['won_amount'],
+            'last_deal_at': row['last_deal_at'],
         }
 
-    def _fetch_customer_contacts(self, conn, customer_id: int) -> List[Dict[str, Any]]:
-        cursor = conn.execute(
+    def _fetch_customer_contacts(self, conn, customer_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+        """Контактные данные клиентов одним запросом: customer_id -> список"""
+        rows = fetch_in(
+            conn,
             '''
-            SELECT id, contact_type, value_type, value, is_primary
+            SELECT id, customer_id, contact_type, value_type, value, is_primary
             FROM customer_contacts
-            WHERE customer_id = ?
+            WHERE customer_id IN ({ids})
             ORDER BY is_primary DESC, id ASC
             ''',
-            (customer_id,),
+            customer_ids,
         )
-        return [
-            {
+        grouped: Dict[int, List[Dict[str, Any]]] = {}
+        for row in rows:
+            grouped.setdefault(row['customer_id'], []).append({
                 'id': row['id'],
                 'contact_type': row['contact_type'],
                 'value_type': row['value_type'],
                 'value': row['value'],
                 'is_primary': bool(row['is_primary']),
-            }
-            for row in cursor.fetchall()
-        ]
+            })
+        return grouped
 
-    def _fetch_customer_files(self, conn, customer_id: int) -> List[Dict[str, Any]]:
-        cursor = conn.execute(
+    def _fetch_customer_files(self, conn, customer_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+        """Файлы клиентов одним запросом: customer_id -> список"""
+        rows = fetch_in(
+            conn,
             '''
             SELECT *
             FROM customer_files
-            WHERE customer_id = ? AND is_deleted = FALSE
+            WHERE customer_id IN ({ids}) AND is_deleted = FALSE
             ORDER BY uploaded_at DESC
             ''',
-            (customer_id,),
+            customer_ids,
         )
-        return [
-            {
+        grouped: Dict[int, List[Dict[str, Any]]] = {}
+        for row in rows:
+            grouped.setdefault(row['customer_id'], []).append({
                 'id': row['id'],
                 'file_name': row['file_name'],
                 'file_path': row['file_path'],
@@ -201,29 +207,54 @@ class CustomerService:
                 'version_number': row['version_number'],
                 'uploaded_by_id': row['uploaded_by_id'],
                 'uploaded_at': row['uploaded_at'],
-            }
-            for row in cursor.fetchall()
-        ]
+            })
+        return grouped
+
+    def _hydrate_customers(self, conn, rows: List[Any]) -> List[Dict[str, Any]]:
+        """Собирает клиентов страницы: дочерние записи читаются пакетно (IN)"""
+        if not rows:
+            return []
+        customer_ids = [row['id'] for row in rows]
+        contacts = self._fetch_customer_contacts(conn, customer_ids)
+        files = self._fetch_customer_files(conn, customer_ids)
+        customers = []
+        for row in rows:
+            customer = self._row_to_customer(row)
+            customer['contacts'] = contacts.get(row['id'], [])
+            customer['files'] = files.get(row['id'], [])
+            customers.append(customer)
+        return customers
 
     def _hydrate_customer(self, conn, row: Any) -> Dict[str, Any]:
-        customer = self._row_to_customer(row)
-        customer['contacts'] = self._fetch_customer_contacts(conn, row['id'])
-        customer['files'] = self._fetch_customer_files(conn, row['id'])
-        return customer
+        return self._hydrate_customers(conn, [row])[0]
 
     # ------------------------------------------------------------------
     # CRUD
     # ------------------------------------------------------------------
-    def get_all(
+    def get_all(self, *args: Any, **kwargs: Any) -> Tuple[List[Dict[str, Any]], int]:
+        """Возвращает список клиентов с фильтрами (параметры как у get_page)"""
+        customers, total, _ = self.get_page(*args, **kwargs)
+        return customers, total
+
+    def get_page(
         self,
         skip: int = 0,
         limit: int = 50,
         customer_type: Optional[int] = None,
         search: Optional[str] = None,
         is_active: Optional[bool] = None,
-    ) -> Tuple[List[Dict[str, Any]], int]:
-        """Возвращает список клиентов с фильтрами"""
-        self._ensure_legacy_data_migrated()
+        cursor: Optional[str] = None,
+        sort: str = 'created_at',
+        order: str = 'desc',
+    ) -> Tuple[List[Dict[str, Any]], int, Optional[str]]:
+        """
+        Возвращает страницу клиентов: (клиенты, всего, курсор следующей страницы)
+
+        С курсором выборка продолжается после последней строки по (sort, id),
+        skip игнорируется.
+        """
+        sort, order = resolve_sort(sort, order, CUSTOMER_SORT_KEYS)
+        after = decode_cursor(cursor, sort, order) if cursor else None
 
         with db_manager.get_connection() as conn:
             query = 'SELECT * FROM customers WHERE 1=1'
@@ -234,30 +265,29 @@ class CustomerService:
                 params.append(customer_type)
 
             if search:
-                query += ' AND (LOWER(name) LIKE ? OR inn LIKE ?)'
-                like = f"%{search.lower()}%"
-                params.extend([like, search])
+                condition, search_params = search_condition('customers', search)
+                query += f' AND ({condition} OR inn = ?)'
+                params.extend(search_params + [search.strip()])
 
             if is_active is not None:
                 query += ' AND is_active = ?'
                 params.append(1 if is_active else 0)
 
-            count_cursor = conn.execute(
-                query.replace('SELECT *', 'SELECT COUNT(*) AS cnt'),
-                params,
-            )
-            total = count_cursor.fetchone()['cnt']
-
-            query += ' ORDER BY created_at DESC LIMIT ? OFFSET ?'
-            params.extend([limit, skip])
-            cursor = conn.execute(query, params)
-            customers = [self._hydrate_customer(conn, row) for row in cursor.fetchall()]
-            return customers, total
+            # Итог из счётчиков, если нет поиска; иначе COUNT(*) OVER() в том же запросе
+            filters = None
+            if not search:
+                filters = {
+                    'customer_type': customer_type,
+                    'is_active': (1 if is_active else 0) if is_active is not None else None,
+                }
+            tail, tail_params = keyset_tail(sort, order, after, limit, skip)
+            rows, total = fetch_page(conn, 'customers', query, params, filters, tail, tail_params)
+            rows, next_cursor = split_page(rows, limit, sort, order)
+            customers = self._hydrate_customers(conn, rows)
+            return customers, total, next_cursor
 
     def get_by_id(self, customer_id: int) -> Optional[Dict[str, Any]]:
         """Возвращает клиента по ID"""
-        self._ensure_legacy_data_migrated()
-
         with db_manager.get_connection() as conn:
             cursor = conn.execute('SELECT * FROM customers WHERE id = ?', (customer_id,))
             row = cursor.fetchone()
@@ -265,10 +295,151 @@ class CustomerService:
                 return None
             return self._hydrate_customer(conn, row)
 
+    def get_overview(
+        self,
+        customer_id: int,
+        deals_per_stage: int = 20,
+        activity_limit: int = 20,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Карточка клиента: клиент, его контакты, сделки по стадиям, итоги и
+        последние события по сделкам
+
+        Число запросов не зависит от количества сделок: сделки и агрегаты
+        стадий читаются одним запросом с оконными функциями, события -
+        одним UNION ALL по истории и комментариям, итоги - из сводки
+        сделок клиента (app.core.deal_stats).
+        """
+        with db_manager.get_connection() as conn:
+            row = conn.execute('SELECT * FROM customers WHERE id = ?', (customer_id,)).fetchone()
+            if not row:
+                return None
+            customer = self._hydrate_customer(conn, row)
+            people = self._fetch_overview_contacts(conn, customer_id)
+            stages = self._fetch_overview_stages(conn, customer_id, deals_per_stage)
+            activity = self._fetch_overview_activity(conn, customer_id, activity_limit)
+
+        totals = {
+            key: customer[key]
+            for key in ('deals_count', 'open_deals_count', 'won_deals_count', 'won_amount', 'last_deal_at')
+        }
+        totals['open_amount'] = sum(stage['open_amount'] for stage in stages)
+        totals['contacts_count'] = len(people)
+        return {
+            'customer': customer,
+            'contacts': people,
+            'stages': stages,
+            'totals': totals,
+            'recent_activity': activity,
+        }
+
+    def _fetch_overview_contacts(self, conn, customer_id: int) -> List[Dict[str, Any]]:
+        cursor = conn.execute(
+            '''
+            SELECT id, first_name, middle_name, last_name, position, email, phone,
+                   is_active, deals_count, last_deal_at
+            FROM contacts
+            WHERE company_id = ?
+            ORDER BY is_active DESC, last_name, first_name, id
+            ''',
+            (customer_id,),
+        )
+        return [
+            {
+                'id': row['id'],
+                'name': ' '.join(filter(None, [row['last_name'], row['first_name'], row['middle_name']])).strip(),
+                'position': row['position'],
+                'email': row['email'],
+                'phone': row['phone'],
+                'is_active': bool(row['is_active']),
+                'deals_count': row['deals_count'] or 0,
+                'last_deal_at': row['last_deal_at'],
+            }
+            for row in cursor.fetchall()
+        ]
+
+    def _fetch_overview_stages(self, conn, customer_id: int, deals_per_stage: int) -> List[Dict[str, Any]]:
+        """Сделки клиента по стадиям: агрегаты по всем сделкам стадии и deals_per_stage последних сделок"""
+        cursor = conn.execute(
+            '''
+            SELECT * FROM (
+                SELECT d.id, d.deal_number, d.title, d.amount, d.currency_id, d.is_closed,
+                       d.primary_contact_id, d.created_at, d.updated_at,
+                       d.funnel_id, f.name AS funnel_name,
+                       d.stage_id, s.name AS stage_name, s.stage_semantic_id, s.order_index,
+                       ROW_NUMBER() OVER recent AS position,
+                       COUNT(*) OVER stage AS stage_deals_count,
+                       TOTAL(d.amount) OVER stage AS stage_amount,
+                       TOTAL(CASE WHEN NOT COALESCE(d.is_closed, 0) THEN d.amount END) OVER stage AS stage_open_amount
+                FROM deals d
+                LEFT JOIN deal_stages s ON s.id = d.stage_id
+                LEFT JOIN funnels f ON f.id = d.funnel_id
+                WHERE d.company_id = ?
+                WINDOW stage AS (PARTITION BY d.stage_id),
+                       recent AS (PARTITION BY d.stage_id ORDER BY d.updated_at DESC, d.id DESC)
+            )
+            WHERE position <= ?
+            ORDER BY funnel_id, order_index, stage_id, position
+            ''',
+            (customer_id, deals_per_stage),
+        )
+        stages: Dict[int, Dict[str, Any]] = {}
+        for row in cursor.fetchall():
+            stage = stages.get(row['stage_id'])
+            if stage is None:
+                stage = stages[row['stage_id']] = {
+                    'funnel_id': row['funnel_id'],
+                    'funnel_name': row['funnel_name'],
+                    'stage_id': row['stage_id'],
+                    'stage_name': row['stage_name'],
+                    'stage_semantic_id': row['stage_semantic_id'],
+                    'deals_count': row['stage_deals_count'],
+                    'amount': row['stage_amount'],
+                    'open_amount': row['stage_open_amount'],
+                    'deals': [],
+                }
+            stage['deals'].append({
+                'id': row['id'],
+                'deal_number': row['deal_number'],
+                'title': row['title'],
+                'amount': row['amount'],
+                'currency_id': row['currency_id'],
+                'is_closed': bool(row['is_closed']),
+                'primary_contact_id': row['primary_contact_id'],
+                'created_at': row['created_at'],
+                'updated_at': row['updated_at'],
+            })
+        return list(stages.values())
+
+    def _fetch_overview_activity(self, conn, customer_id: int, limit: int) -> List[Dict[str, Any]]:
+        """Последние изменения и комментарии по сделкам клиента"""
+        cursor = conn.execute(
+            '''
+            SELECT a.*, COALESCE(NULLIF(u.full_name, ''), u.username) AS user_name
+            FROM (
+                SELECT 'history' AS kind, h.deal_id, d.title AS deal_title, h.changed_at AS at,
+                       h.changed_by_id AS user_id, h.field_name, h.old_value, h.new_value,
+                       h.change_type, NULL AS text
+                FROM deal_history h
+                JOIN deals d ON d.id = h.deal_id
+                WHERE d.company_id = ?
+                UNION ALL
+                SELECT 'comment', c.deal_id, d.title, c.created_at, c.author_id,
+                       NULL, NULL, NULL, NULL, c.text
+                FROM deal_comments c
+                JOIN deals d ON d.id = c.deal_id
+                WHERE d.company_id = ? AND NOT COALESCE(c.is_deleted, 0)
+            ) a
+            LEFT JOIN users u ON u.id = a.user_id
+            ORDER BY a.at DESC
+            LIMIT ?
+            ''',
+            (customer_id, customer_id, limit),
+        )
+        return [dict(row) for row in cursor.fetchall()]
+
     def get_by_inn(self, inn: str) -> Optional[Dict[str, Any]]:
         """Возвращает клиента по ИНН"""
-        self._ensure_legacy_data_migrated()
-
         with db_manager.get_connection() as conn:
             cursor = conn.execute('SELECT * FROM customers WHERE inn = ?', (inn.strip(),))
             row = cursor.fetchone()
@@ -278,8 +449,6 @@ class CustomerService:
 
     def create(self, customer_data: Dict[str, Any], user_id: Optional[int] = None) -> Dict[str, Any]:
         """Создаёт клиента"""
-        self._ensure_legacy_data_migrated()
-
         inn = customer_data.get('inn')
         if inn and inn.strip() and not validate_inn(inn):
             raise ValueError('Некорректный ИНН')
@@ -357,6 +526,7 @@ class CustomerService:
             customer_id = cursor.lastrowid
             external_id = generate_external_id('customer', customer_id)
             conn.execute('UPDATE customers SET external_id = ? WHERE id = ?', (external_id, customer_id))
+            refresh_search_keys(conn, 'customers', customer_id)
 
             for contact in contacts:
                 conn.execute(
@@ -393,13 +563,11 @@ class CustomerService:
                     ),
                 )
 
-            conn.commit()
+            refresh_customer(conn, customer_id)
             return self.get_by_id(customer_id)  # type: ignore[arg-type]
 
     def update(self, customer_id: int, customer_data: Dict[str, Any], user_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
         """Обновляет клиента"""
-        self._ensure_legacy_data_migrated()
-
         inn = customer_data.get('inn')
         if inn and inn.strip() and not validate_inn(inn):
             raise ValueError('Некорректный ИНН')
@@ -472,6 +640,7 @@ class CustomerService:
 
             with db_manager.get_connection() as conn:
                 conn.execute(sql, values)
+                refresh_search_keys(conn, 'customers', customer_id)
 
                 if 'contacts' in customer_data:
                     conn.execute('DELETE FROM customer_contacts WHERE customer_id = ?', (customer_id,))
@@ -514,14 +683,12 @@ class CustomerService:
                             ),
                         )
 
-                conn.commit()
+                refresh_customer(conn, customer_id)
 
         return self.get_by_id(customer_id)
 
     def delete(self, customer_id: int, soft: bool = True) -> bool:
         """Удаляет клиента"""
-        self._ensure_legacy_data_migrated()
-
         with db_manager.get_connection() as conn:
             cursor = conn.execute('SELECT id FROM customers WHERE id = ?', (customer_id,))
             if not cursor.fetchone():
@@ -538,10 +705,43 @@ class CustomerService:
                 )
             else:
                 conn.execute('DELETE FROM customers WHERE id = ?', (customer_id,))
+                refresh_customer(conn, customer_id)
 
-            conn.commit()
             return True
 
+    # ------------------------------------------------------------------
+    # Duplicates
+    # ------------------------------------------------------------------
+    def find_duplicates(
+        self,
+        min_score: float = dedup.DEFAULT_MIN_SCORE,
+        limit: int = 100,
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """Пары вероятных дублей клиентов (см. app.core.dedup)"""
+        with db_manager.get_connection() as conn:
+            return dedup.find_duplicates(conn, dedup.CUSTOMERS, min_score, limit)
+
+    def merge(self, target_id: int, source_ids: List[int], user_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Сливает клиентов source_ids в клиента target_id
+
+        Returns:
+            Целевой клиент или None, если какой-либо из клиентов не найден
+
+        Raises:
+            ValueError: Некорректный список сливаемых клиентов
+        """
+        source_ids = dedup.merge_source_ids(target_id, source_ids)
+
+        with db_manager.get_connection() as conn:
+            ids = [target_id] + source_ids
+            found = fetch_in(conn, 'SELECT id FROM customers WHERE id IN ({ids})', ids)
+            if len(found) != len(ids):
+                return None
+            dedup.merge_customers(conn, target_id, source_ids, user_id)
+
+        return self.get_by_id(target_id)
+
     # ------------------------------------------------------------------
     # Files
     # ------------------------------------------------------------------
@@ -556,8 +756,6 @@ class CustomerService:
         user_id: Optional[int],
     ) -> Optional[Dict[str, Any]]:
         """Добавляет файл к клиенту с учётом версионирования"""
-        self._ensure_legacy_data_migrated()
-
         with db_manager.get_connection() as conn:
             cursor = conn.execute('SELECT id FROM customers WHERE id = ?', (customer_id,))
             if not cursor.fetchone():
@@ -593,7 +791,6 @@ class CustomerService:
             )
             file_id = cursor.lastrowid
             conn.execute('UPDATE customers SET updated_at = CURRENT_TIMESTAMP WHERE id = ?', (customer_id,))
-            conn.commit()
 
             cursor = conn.execute('SELECT * FROM customer_files WHERE id = ?', (file_id,))
             row = cursor.fetchone()
@@ -613,8 +810,6 @@ class CustomerService:
 
     def delete_file(self, customer_id: int, file_id: int) -> Optional[Dict[str, Any]]:
         """Помечает файл клиента как удалённый"""
-        self._ensure_legacy_data_migrated()
-
         with db_manager.get_connection() as conn:
             cursor = conn.execute(
                 '''
@@ -636,7 +831,6 @@ class CustomerService:
                 (file_id,),
             )
             conn.execute('UPDATE customers SET updated_at = CURRENT_TIMESTAMP WHERE id = ?', (customer_id,))
-            conn.commit()
 
             return {
                 'id': row['id'],
@@ -3,15 +3,72 @@
 """
 from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime, date
-from ..core.database import db_manager
+from ..core.database import db_manager, fetch_in
 from ..utils.enums import ChangeType, FileType
 from ..utils.constants import DEFAULT_CURRENCY
+from ..core.audit_writer import HistoryEntry, audit_writer
+from ..core.counters import fetch_page
+from ..core import stage_metrics
+from ..core.config import settings
+from ..core.deal_search import best_documents, build_match_query, count_matching_deals
+from ..utils.pagination import resolve_sort, decode_cursor, encode_cursor, keyset_tail, split_page
+
+
+# Скалярные колонки таблицы deals, доступные для выборки через fields=
+DEAL_COLUMNS = (
+    'id', 'external_id', 'deal_number', 'title', 'description', 'deal_type',
+    'funnel_id', 'stage_id', 'amount', 'currency_id', 'probability_percent',
+    'is_manual_amount', 'tax_value', 'start_date', 'close_date',
+    'created_at', 'updated_at', 'closed_at', 'company_id', 'responsible_user_id',
+    'primary_contact_id', 'is_closed', 'is_public', 'is_new', 'is_recurring',
+    'recurrence_pattern', 'is_return_customer', 'source_id', 'source_description',
+    'utm_source', 'utm_medium', 'utm_campaign', 'utm_content', 'utm_term',
+    'created_by_id', 'modified_by_id', 'moved_by_id', 'moved_at',
+    'last_activity_at', 'last_activity_by_id', 'originator_id', 'origin_id',
+)
+
+DEAL_BOOL_COLUMNS = frozenset({
+    'is_manual_amount', 'is_closed', 'is_public', 'is_new', 'is_recurring', 'is_return_customer',
+})
+
+# Связанные объекты и колонка, по которой они подтягиваются
+DEAL_REFERENCES = {
+    'funnel': 'funnel_id',
+    'stage': 'stage_id',
+    'company': 'company_id',
+    'primary_contact': 'primary_contact_id',
+    'responsible_user': 'responsible_user_id',
+}
+
+# Дочерние коллекции сделки
+DEAL_COLLECTIONS = ('products', 'files', 'comments', 'participants', 'history')
+
+DEAL_RELATIONS = tuple(DEAL_REFERENCES) + DEAL_COLLECTIONS
+
+# Ключи сортировки для keyset-пагинации (под каждый есть индекс (ключ, id))
+DEAL_SORT_KEYS = ('created_at', 'updated_at', 'amount', 'close_date')
+
+# Проекция для канбана и табличного представления
+DEAL_SUMMARY_FIELDS = (
+    'id', 'deal_number', 'title', 'amount', 'currency_id', 'probability_percent',
+    'funnel_id', 'stage_id', 'company_id', 'primary_contact_id', 'responsible_user_id',
+    'is_closed', 'start_date', 'close_date', 'created_at', 'updated_at', 'moved_at',
+)
 
 
 class DealService:
     """Сервис для работы со сделками через SQLite"""
     
-    def get_all(
+    def get_all(self, *args: Any, **kwargs: Any) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Получает список сделок с фильтрацией (без курсора следующей страницы)
+        
+        Принимает те же параметры, что и get_page.
+        """
+        deals, total, _ = self.get_page(*args, **kwargs)
+        return deals, total
+    
+    def get_page(
         self,
         skip: int = 0,
         limit: int = 50,
@@ -23,9 +80,24 @@ class DealService:
         is_closed: Optional[bool] = None,
         date_from: Optional[date] = None,
         date_to: Optional[date] = None,
-    ) -> Tuple[List[Dict[str, Any]], int]:
+        fields: Optional[List[str]] = None,
+        include: Optional[List[str]] = None,
+        cursor: Optional[str] = None,
+        sort: str = 'created_at',
+        order: str = 'desc',
+    ) -> Tuple[List[Dict[str, Any]], int, Optional[str]]:
         """
-        Получает список всех сделок с фильтрацией
+        Получает страницу сделок с фильтрацией
+        
+        Поддерживается как skip/limit, так и keyset-пагинация: курсор из
+        предыдущего ответа продолжает выборку после последней строки по
+        (sort, id), skip при этом игнорируется.
+        
+        Без fields и include сделки возвращаются полностью, со всеми
+        связанными объектами. Если задан хотя бы один из параметров,
+        выбираются только запрошенные колонки (по умолчанию
+        DEAL_SUMMARY_FIELDS) и только запрошенные связи (по умолчанию
+        никакие); незапрошенные коллекции не читаются из БД.
         
         Args:
             skip: Пропустить записей
@@ -38,10 +110,29 @@ class DealService:
             is_closed: Фильтр по статусу закрытия
             date_from: Фильтр по дате начала (от)
             date_to: Фильтр по дате начала (до)
+            fields: Колонки сделки для разреженной выборки
+            include: Связанные объекты для разреженной выборки
+            cursor: Курсор следующей страницы из предыдущего ответа
+            sort: Ключ сортировки (DEAL_SORT_KEYS)
+            order: Направление сортировки: asc или desc
             
         Returns:
-            Кортеж (список сделок, общее количество)
+            Кортеж (список сделок, общее количество, курсор следующей страницы)
+            
+        Raises:
+            ValueError: Если запрошено неизвестное поле, связь, сортировка
+                или передан некорректный курсор
         """
+        sort, order = resolve_sort(sort, order, DEAL_SORT_KEYS)
+        after = decode_cursor(cursor, sort, order) if cursor else None
+        
+        sparse = fields is not None or include is not None
+        if sparse:
+            columns, relations = self._resolve_projection(fields, include)
+            # Ключ сортировки нужен для курсора следующей страницы
+            if sort not in columns:
+                columns.append(sort)
+        
         with db_manager.get_connection() as conn:
             # Строим запрос с фильтрами
             query = 'SELECT * FROM deals WHERE 1=1'
@@ -79,22 +170,210 @@ class DealService:
                 query += ' AND start_date <= ?'
                 params.append(date_to.isoformat())
             
-            # Подсчёт общего количества
-            count_query = query.replace('SELECT *', 'SELECT COUNT(*)')
-            cursor = conn.execute(count_query, params)
-            total = cursor.fetchone()[0]
+            # Разреженная выборка: только нужные колонки
+            if sparse:
+                query = query.replace('SELECT *', f"SELECT {', '.join(columns)}", 1)
             
-            # Получаем данные с пагинацией
-            query += ' ORDER BY created_at DESC LIMIT ? OFFSET ?'
-            params.extend([limit, skip])
+            # Итог берётся из счётчиков, если фильтры это позволяют
+            filters = None
+            if date_from is None and date_to is None:
+                filters = {
+                    'funnel_id': funnel_id,
+                    'stage_id': stage_id,
+                    'company_id': company_id,
+                    'responsible_user_id': responsible_user_id,
+                    'primary_contact_id': primary_contact_id,
+                    'is_closed': is_closed,
+                }
             
-            cursor = conn.execute(query, params)
-            deals = [dict(row) for row in cursor.fetchall()]
+            # Получаем данные с пагинацией (одна лишняя строка - признак следующей страницы)
+            tail, tail_params = keyset_tail(sort, order, after, limit, skip)
+            deals, total = fetch_page(conn, 'deals', query, params, filters, tail, tail_params)
+            deals, next_cursor = split_page(deals, limit, sort, order)
             
-            # Обогащаем данными
-            enriched = [self._enrich_deal(conn, deal) for deal in deals]
+            if not sparse:
+                # Обогащаем данными
+                enriched = self._enrich_deals(conn, deals)
+                
+                return enriched, total, next_cursor
+            
+            for deal in deals:
+                self._normalize_bools(deal)
             
-            return enriched, total
+            return self._enrich_deals(conn, deals, relations), total, next_cursor
+    
+    def get_board(
+        self,
+        funnel_id: int,
+        per_stage: int = 20,
+        sort: str = 'created_at',
+        order: str = 'desc',
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Канбан-доска воронки
+        
+        Все стадии с первыми per_stage сделками (краткая проекция), числом
+        сделок и суммой по стадии. Сделки, счётчики и суммы выбираются
+        одним запросом с оконными функциями по stage_id. Для стадий, где
+        сделок больше, возвращается next_cursor - его можно передать в
+        get_page (GET /deals) с тем же stage_id, sort и order.
+        
+        Returns:
+            Доска или None, если воронка не найдена
+        """
+        sort, order = resolve_sort(sort, order, DEAL_SORT_KEYS)
+        direction = order.upper()
+        columns = ', '.join(DEAL_SUMMARY_FIELDS)
+        
+        with db_manager.get_connection() as conn:
+            funnel = conn.execute('SELECT id, name FROM funnels WHERE id = ?', (funnel_id,)).fetchone()
+            if not funnel:
+                return None
+            
+            stages = [
+                dict(row) for row in conn.execute('''
+                    SELECT id, stage_id, name, label, color_text, color_bg, color_border,
+                           order_index, stage_semantic_id
+                    FROM deal_stages
+                    WHERE funnel_id = ?
+                    ORDER BY order_index ASC
+                ''', (funnel_id,)).fetchall()
+            ]
+            
+            rows = conn.execute(f'''
+                SELECT * FROM (
+                    SELECT {columns},
+                           ROW_NUMBER() OVER (PARTITION BY stage_id ORDER BY {sort} {direction}, id {direction}) AS _rn,
+                           COUNT(*) OVER (PARTITION BY stage_id) AS _stage_count,
+                           TOTAL(amount) OVER (PARTITION BY stage_id) AS _stage_amount
+                    FROM deals
+                    WHERE funnel_id = ?
+                )
+                WHERE _rn <= ?
+                ORDER BY stage_id, _rn
+            ''', (funnel_id, per_stage)).fetchall()
+            
+            deals = []
+            totals: Dict[int, Tuple[int, float]] = {}
+            for row in rows:
+                deal = dict(row)
+                totals[deal['stage_id']] = (deal.pop('_stage_count'), deal.pop('_stage_amount'))
+                deal.pop('_rn')
+                self._normalize_bools(deal)
+                deals.append(deal)
+            
+            deals = self._enrich_deals(conn, deals, ['company', 'primary_contact', 'responsible_user'])
+            by_stage: Dict[int, List[Dict[str, Any]]] = {}
+            for deal in deals:
+                by_stage.setdefault(deal['stage_id'], []).append(deal)
+            
+            for stage in stages:
+                stage_deals = by_stage.get(stage['id'], [])
+                count, amount = totals.get(stage['id'], (0, 0.0))
+                stage['deals'] = stage_deals
+                stage['deals_count'] = count
+                stage['total_amount'] = amount
+                stage['next_cursor'] = None
+                if count > len(stage_deals):
+                    last = stage_deals[-1]
+                    stage['next_cursor'] = encode_cursor(sort, order, last[sort], last['id'])
+            
+            return {
+                'funnel_id': funnel['id'],
+                'name': funnel['name'],
+                'sort': sort,
+                'order': order,
+                'stages': stages,
+            }
+    
+    def search(self, query: str, skip: int = 0, limit: int = 20) -> Tuple[List[Dict[str, Any]], int, bool]:
+        """
+        Полнотекстовый поиск по сделкам, комментариям и товарам
+        
+        Слова запроса ищутся как префиксы (все слова обязательны).
+        Сделка попадает в выдачу один раз - по лучшему документу; в
+        snippet совпадения выделены тегами <mark>.
+        
+        Returns:
+            Кортеж (найденные сделки в порядке релевантности, общее
+            количество, ограничено ли количество пределом deal_search_total_cap)
+        
+        Raises:
+            ValueError: В запросе нет ни одного слова
+        """
+        match = build_match_query(query)
+        
+        with db_manager.get_connection() as conn:
+            found = best_documents(conn, match, skip + limit)
+            rows = found[skip:]
+            if len(found) < skip + limit:
+                # Совпадения исчерпаны - количество известно точно
+                total, capped = len(found), False
+            else:
+                total, capped = count_matching_deals(conn, match, settings.deal_search_total_cap)
+                total = max(total, len(found))
+            if not rows:
+                return [], total, capped
+            
+            doc_ids = [row['doc_id'] for row in rows]
+            placeholders = ', '.join('?' * len(doc_ids))
+            snippets = {
+                row['rowid']: row['snippet']
+                for row in conn.execute(f'''
+                    SELECT rowid, snippet(deal_search, -1, '<mark>', '</mark>', '…', 16) AS snippet
+                    FROM deal_search
+                    WHERE deal_search MATCH ? AND rowid IN ({placeholders})
+                ''', [match] + doc_ids).fetchall()
+            }
+            
+            columns = ', '.join(DEAL_SUMMARY_FIELDS)
+            deals = {
+                row['id']: dict(row)
+                for row in fetch_in(conn, f'SELECT {columns} FROM deals WHERE id IN ({{ids}})',
+                                    [row['deal_id'] for row in rows])
+            }
+            
+            hits = []
+            for row in rows:
+                deal = deals.get(row['deal_id'])
+                if deal is None:
+                    continue
+                self._normalize_bools(deal)
+                deal['matched_in'] = row['kind']
+                deal['snippet'] = snippets.get(row['doc_id'])
+                deal['score'] = -row['score']
+                hits.append(deal)
+            return hits, total, capped
+    
+    @staticmethod
+    def _normalize_bools(deal: Dict[str, Any]) -> None:
+        """Приводит булевы колонки (0/1 в SQLite) к bool"""
+        for column in DEAL_BOOL_COLUMNS.intersection(deal):
+            if deal[column] is not None:
+                deal[column] = bool(deal[column])
+    
+    @staticmethod
+    def _resolve_projection(
+        fields: Optional[List[str]],
+        include: Optional[List[str]],
+    ) -> Tuple[List[str], List[str]]:
+        """Проверяет fields/include и возвращает колонки для SELECT и связи"""
+        requested = list(fields) if fields else list(DEAL_SUMMARY_FIELDS)
+        relations = list(include or [])
+        
+        unknown = [name for name in requested if name not in DEAL_COLUMNS]
+        if unknown:
+            raise ValueError(f"Неизвестные поля сделки: {', '.join(unknown)}")
+        unknown = [name for name in relations if name not in DEAL_RELATIONS]
+        if unknown:
+            raise ValueError(f"Неизвестные связи сделки: {', '.join(unknown)}")
+        
+        # id и внешние ключи нужны для подтягивания связей
+        columns = ['id']
+        for name in requested + [DEAL_REFERENCES[r] for r in relations if r in DEAL_REFERENCES]:
+            if name not in columns:
+                columns.append(name)
+        return columns, relations
     
     def get_by_id(self, deal_id: int) -> Optional[Dict[str, Any]]:
         """Получает сделку по ID со всеми связанными данными"""
@@ -185,11 +464,11 @@ class DealService:
             ))
             
             deal_id = cursor.lastrowid
+            stage_metrics.record_deal_created(conn, deal_data.get('stage_id'), deal_data.get('amount', 0))
             
             # Логируем создание в историю
             self._log_history(conn, deal_id, 'deal_created', None, deal_data.get('title', ''), ChangeType.CREATE, user_id)
             
-            conn.commit()
             return self.get_by_id(deal_id)
     
     def update(self, deal_id: int, deal_data: Dict[str, Any], user_id: int) -> Optional[Dict[str, Any]]:
@@ -244,6 +523,11 @@ class DealService:
                         values.append(value)
             
             if updates:
+                if 'stage_id' in changes:
+                    # Время на новой стадии отсчитывается от moved_at
+                    updates.append('moved_at = CURRENT_TIMESTAMP')
+                    updates.append('moved_by_id = ?')
+                    values.append(user_id)
                 updates.append('updated_at = CURRENT_TIMESTAMP')
                 updates.append('modified_by_id = ?')
                 values.extend([user_id, deal_id])
@@ -251,12 +535,25 @@ class DealService:
                 sql = f"UPDATE deals SET {', '.join(updates)} WHERE id = ?"
                 conn.execute(sql, values)
                 
-                # Логируем изменения в историю
-                for field, (old_val, new_val) in changes.items():
-                    self._log_history(conn, deal_id, field, str(old_val) if old_val is not None else None, str(new_val) if new_val is not None else None, ChangeType.UPDATE, user_id)
+                new_amount = changes['amount'][1] if 'amount' in changes else None
+                if 'stage_id' in changes:
+                    stage_metrics.record_stage_change(conn, old_deal, changes['stage_id'][1], new_amount)
+                elif new_amount is not None:
+                    stage_metrics.record_amount_change(conn, old_deal['stage_id'], new_amount - (old_deal['amount'] or 0))
+                
+                # Логируем изменения в историю одним пакетом
+                audit_writer.write(conn, [
+                    HistoryEntry(
+                        deal_id,
+                        field,
+                        str(old_val) if old_val is not None else None,
+                        str(new_val) if new_val is not None else None,
+                        ChangeType.UPDATE,
+                        user_id,
+                    )
+                    for field, (old_val, new_val) in changes.items()
+                ])
                 
-                conn.commit()
-            
             return self.get_by_id(deal_id)
     
     def delete(self, deal_id: int, user_id: int) -> bool:
@@ -278,7 +575,8 @@ class DealService:
             
             # Удаляем сделку (связанные данные удалятся каскадно)
             cursor = conn.execute('DELETE FROM deals WHERE id = ?', (deal_id,))
-            conn.commit()
+            if deal and cursor.rowcount:
+                stage_metrics.record_deal_deleted(conn, deal['stage_id'], deal.get('amount'))
             return cursor.rowcount > 0
     
     def move_to_stage(self, deal_id: int, stage_id: int, user_id: int) -> Optional[Dict[str, Any]]:
@@ -295,7 +593,10 @@ class DealService:
         """
         with db_manager.get_connection() as conn:
             # Получаем текущую стадию
-            cursor = conn.execute('SELECT stage_id FROM deals WHERE id = ?', (deal_id,))
+            cursor = conn.execute(
+                'SELECT stage_id, amount, moved_at, created_at FROM deals WHERE id = ?',
+                (deal_id,)
+            )
             row = cursor.fetchone()
             if not row:
                 return None
@@ -311,11 +612,11 @@ class DealService:
                 SET stage_id = ?, moved_at = CURRENT_TIMESTAMP, moved_by_id = ?, updated_at = CURRENT_TIMESTAMP
                 WHERE id = ?
             ''', (stage_id, user_id, deal_id))
+            stage_metrics.record_stage_change(conn, dict(row), stage_id)
             
             # Логируем изменение стадии
             self._log_history(conn, deal_id, 'stage', str(old_stage_id), str(stage_id), ChangeType.STAGE_CHANGE, user_id)
             
-            conn.commit()
             return self.get_by_id(deal_id)
     
     def add_product(self, deal_id: int, product_data: Dict[str, Any], user_id: int) -> Dict[str, Any]:
@@ -363,8 +664,6 @@ class DealService:
             # Пересчитываем сумму сделки если не manual
             self._recalculate_deal_amount(conn, deal_id)
             
-            conn.commit()
-            
             # Возвращаем созданный товар
             cursor = conn.execute('SELECT * FROM deal_products WHERE id = ?', (product_id,))
             return dict(cursor.fetchone())
@@ -380,7 +679,6 @@ class DealService:
             # Пересчитываем сумму сделки если не manual
             self._recalculate_deal_amount(conn, deal_id)
             
-            conn.commit()
             return cursor.rowcount > 0
     
     def get_products(self, deal_id: int) -> List[Dict[str, Any]]:
@@ -468,7 +766,6 @@ class DealService:
                 user_id
             )
             
-            conn.commit()
             cursor = conn.execute('SELECT * FROM deal_files WHERE id = ?', (file_id,))
             return dict(cursor.fetchone())
     
@@ -490,7 +787,6 @@ class DealService:
                 SET is_deleted = TRUE
                 WHERE id = ? AND deal_id = ?
             ''', (file_id, deal_id))
-            conn.commit()
             return cursor.rowcount > 0
     
     def add_comment(self, deal_id: int, text: str, user_id: int, parent_comment_id: Optional[int] = None) -> Dict[str, Any]:
@@ -502,7 +798,6 @@ class DealService:
             ''', (deal_id, user_id, text, parent_comment_id))
             
             comment_id = cursor.lastrowid
-            conn.commit()
             
             # Возвращаем созданный комментарий
             cursor = conn.execute('SELECT * FROM deal_comments WHERE id = ?', (comment_id,))
@@ -526,7 +821,6 @@ class DealService:
                 SET is_deleted = TRUE, updated_at = CURRENT_TIMESTAMP
                 WHERE id = ? AND deal_id = ?
             ''', (comment_id, deal_id))
-            conn.commit()
             return cursor.rowcount > 0
     
     def get_history(self, deal_id: int) -> List[Dict[str, Any]]:
@@ -569,7 +863,6 @@ class DealService:
             ''', (deal_id, contact_id, user_id, participant_type))
             
             participant_id = cursor.lastrowid
-            conn.commit()
             
             # Возвращаем созданного участника
             cursor = conn.execute('SELECT * FROM deal_participants WHERE id = ?', (participant_id,))
@@ -582,7 +875,6 @@ class DealService:
                 DELETE FROM deal_participants
                 WHERE id = ? AND deal_id = ?
             ''', (participant_id, deal_id))
-            conn.commit()
             return cursor.rowcount > 0
     
     def get_participants(self, deal_id: int) -> List[Dict[str, Any]]:
@@ -597,9 +889,9 @@ class DealService:
     
     def _recalculate_deal_amount(self, conn, deal_id: int) -> None:
         """Пересчитывает сумму сделки из товаров (если не is_manual_amount)"""
-        cursor = conn.execute('SELECT is_manual_amount FROM deals WHERE id = ?', (deal_id,))
-        row = cursor.fetchone()
-        if not row or row['is_manual_amount']:
+        cursor = conn.execute('SELECT is_manual_amount, stage_id, amount FROM deals WHERE id = ?', (deal_id,))
+        deal = cursor.fetchone()
+        if not deal or deal['is_manual_amount']:
             return
         
         # Суммируем все line_total товаров
@@ -613,6 +905,7 @@ class DealService:
         
         # Обновляем сумму сделки
         conn.execute('UPDATE deals SET amount = ? WHERE id = ?', (total, deal_id))
+        stage_metrics.record_amount_change(conn, deal['stage_id'], total - (deal['amount'] or 0))
     
     def _log_history(
         self,
@@ -625,98 +918,101 @@ class DealService:
         user_id: int,
     ) -> None:
         """Логирует изменение в историю"""
-        conn.execute('''
-            INSERT INTO deal_history (deal_id, field_name, old_value, new_value, change_type, changed_by_id)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (deal_id, field_name, old_value, new_value, change_type, user_id))
+        audit_writer.write(conn, [HistoryEntry(deal_id, field_name, old_value, new_value, change_type, user_id)])
     
     def _enrich_deal(self, conn, deal: Dict[str, Any]) -> Dict[str, Any]:
         """Обогащает сделку связанными данными"""
-        enriched = deal.copy()
-        deal_id = deal['id']
+        return self._enrich_deals(conn, [deal])[0]
+    
+    def _enrich_deals(
+        self,
+        conn,
+        deals: List[Dict[str, Any]],
+        include: Optional[List[str]] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Обогащает список сделок связанными данными
         
-        # Получаем воронку
-        if deal.get('funnel_id'):
-            cursor = conn.execute('SELECT id, name FROM funnels WHERE id = ?', (deal['funnel_id'],))
-            row = cursor.fetchone()
-            if row:
-                enriched['funnel'] = dict(row)
+        Каждая связанная таблица читается одним запросом с WHERE ... IN (...)
+        для всей страницы, результаты раскладываются по сделкам в памяти.
+        Число запросов не зависит от размера страницы.
         
-        # Получаем стадию
-        if deal.get('stage_id'):
-            cursor = conn.execute('SELECT id, stage_id, name, label, order_index FROM deal_stages WHERE id = ?', (deal['stage_id'],))
-            row = cursor.fetchone()
-            if row:
-                enriched['stage'] = dict(row)
+        Args:
+            include: Подтягиваемые связи (None - все из DEAL_RELATIONS)
+        """
+        if not deals:
+            return []
         
-        # Получаем компанию
-        if deal.get('company_id'):
-            cursor = conn.execute('SELECT id, name FROM customers WHERE id = ?', (deal['company_id'],))
-            row = cursor.fetchone()
-            if row:
-                enriched['company'] = {'id': row['id'], 'name': row['name']}
+        relations = set(DEAL_RELATIONS if include is None else include)
+        if not relations:
+            return [deal.copy() for deal in deals]
         
-        # Получаем основной контакт
-        if deal.get('primary_contact_id'):
-            cursor = conn.execute(
-                'SELECT id, first_name, middle_name, last_name FROM contacts WHERE id = ?',
-                (deal['primary_contact_id'],)
+        deal_ids = [deal['id'] for deal in deals]
+        
+        def ids_for(relation: str) -> List[int]:
+            if relation not in relations:
+                return []
+            return self._collect_ids(deals, DEAL_REFERENCES[relation])
+        
+        def rows_for(relation: str, query: str) -> List[Any]:
+            if relation not in relations:
+                return []
+            return fetch_in(conn, query, deal_ids)
+        
+        funnels = {
+            row['id']: dict(row)
+            for row in fetch_in(conn, 'SELECT id, name FROM funnels WHERE id IN ({ids})', ids_for('funnel'))
+        }
+        stages = {
+            row['id']: dict(row)
+            for row in fetch_in(
+                conn,
+                'SELECT id, stage_id, name, label, order_index FROM deal_stages WHERE id IN ({ids})',
+                ids_for('stage'),
             )
-            row = cursor.fetchone()
-            if row:
-                full_name = ' '.join(filter(None, [row['last_name'], row['first_name'], row['middle_name']])).strip()
-                enriched['primary_contact'] = {'id': row['id'], 'name': full_name or row['first_name'] or ''}
-        
-        # Получаем ответственного пользователя
-        if deal.get('responsible_user_id'):
-            try:
-                user = db_manager.get_user_by_id(deal['responsible_user_id'])
-                if user:
-                    enriched['responsible_user'] = {
-                        'id': user['id'],
-                        'name': user.get('full_name') or user.get('username', '')
-                    }
-            except Exception:
-                pass
-        
-        # Получаем товары
-        products_cursor = conn.execute(
-            'SELECT * FROM deal_products WHERE deal_id = ? ORDER BY added_at ASC',
-            (deal_id,)
-        )
-        enriched['products'] = [dict(row) for row in products_cursor.fetchall()]
-        
-        # Получаем файлы
-        files_cursor = conn.execute('''
+        }
+        companies = {
+            row['id']: {'id': row['id'], 'name': row['name']}
+            for row in fetch_in(conn, 'SELECT id, name FROM customers WHERE id IN ({ids})', ids_for('company'))
+        }
+        contacts = {
+            row['id']: {
+                'id': row['id'],
+                'name': self._person_name(row['last_name'], row['first_name'], row['middle_name']),
+            }
+            for row in fetch_in(
+                conn,
+                'SELECT id, first_name, middle_name, last_name FROM contacts WHERE id IN ({ids})',
+                ids_for('primary_contact'),
+            )
+        }
+        users = {
+            row['id']: {'id': row['id'], 'name': row['full_name'] or row['username'] or ''}
+            for row in fetch_in(
+                conn,
+                'SELECT id, username, full_name FROM users WHERE id IN ({ids})',
+                ids_for('responsible_user'),
+            )
+        }
+        
+        # Дочерние коллекции: порядок внутри сделки задаёт ORDER BY запроса
+        products = self._group_by_deal(rows_for(
+            'products',
+            'SELECT * FROM deal_products WHERE deal_id IN ({ids}) ORDER BY added_at ASC',
+        ), dict)
+        files = self._group_by_deal(rows_for('files', '''
             SELECT * FROM deal_files
-            WHERE deal_id = ? AND is_deleted = FALSE
+            WHERE deal_id IN ({ids}) AND is_deleted = FALSE
             ORDER BY uploaded_at DESC
-        ''', (deal_id,))
-        enriched['files'] = [dict(row) for row in files_cursor.fetchall()]
-        
-        # Получаем комментарии
-        comments_cursor = conn.execute('''
+        '''), dict)
+        comments = self._group_by_deal(rows_for('comments', '''
             SELECT dc.*, u.username as author_name, u.full_name as author_full_name
             FROM deal_comments dc
             LEFT JOIN users u ON dc.author_id = u.id
-            WHERE dc.deal_id = ? AND dc.is_deleted = FALSE
+            WHERE dc.deal_id IN ({ids}) AND dc.is_deleted = FALSE
             ORDER BY dc.created_at ASC
-        ''', (deal_id,))
-        comments = []
-        for row in comments_cursor.fetchall():
-            comment = dict(row)
-            comment['author'] = {
-                'id': comment.get('author_id'),
-                'name': comment.get('author_full_name') or comment.get('author_name', '')
-            }
-            # Удаляем лишние поля
-            comment.pop('author_name', None)
-            comment.pop('author_full_name', None)
-            comments.append(comment)
-        enriched['comments'] = comments
-        
-        # Получаем участников
-        participants_cursor = conn.execute('''
+        '''), self._comment_from_row)
+        participants = self._group_by_deal(rows_for('participants', '''
             SELECT dp.*, 
                    u.username AS user_name, 
                    u.full_name AS user_full_name,
@@ -726,60 +1022,108 @@ class DealService:
             FROM deal_participants dp
             LEFT JOIN users u ON dp.user_id = u.id
             LEFT JOIN contacts c ON dp.contact_id = c.id
-            WHERE dp.deal_id = ?
+            WHERE dp.deal_id IN ({ids})
             ORDER BY dp.joined_at ASC
-        ''', (deal_id,))
-        participants = []
-        for row in participants_cursor.fetchall():
-            participant = dict(row)
-            if participant.get('user_id'):
-                participant['user'] = {
-                    'id': participant.get('user_id'),
-                    'name': participant.get('user_full_name') or participant.get('user_name', '')
-                }
-            if participant.get('contact_id'):
-                full_name = ' '.join(
-                    filter(
-                        None,
-                        [
-                            participant.get('contact_last_name'),
-                            participant.get('contact_first_name'),
-                            participant.get('contact_middle_name'),
-                        ],
-                    )
-                ).strip()
-                participant['contact'] = {
-                    'id': participant.get('contact_id'),
-                    'name': full_name or participant.get('contact_first_name') or ''
-                }
-            participant.pop('user_name', None)
-            participant.pop('user_full_name', None)
-            participant.pop('contact_first_name', None)
-            participant.pop('contact_middle_name', None)
-            participant.pop('contact_last_name', None)
-            participants.append(participant)
-        enriched['participants'] = participants
-        
-        # Получаем историю
-        history_cursor = conn.execute('''
+        '''), self._participant_from_row)
+        history = self._group_by_deal(rows_for('history', '''
             SELECT dh.*, u.username as changed_by_name, u.full_name as changed_by_full_name
             FROM deal_history dh
             LEFT JOIN users u ON dh.changed_by_id = u.id
-            WHERE dh.deal_id = ?
+            WHERE dh.deal_id IN ({ids})
             ORDER BY dh.changed_at DESC
-        ''', (deal_id,))
-        history = []
-        for row in history_cursor.fetchall():
-            h = dict(row)
-            h['changed_by'] = {
-                'id': h.get('changed_by_id'),
-                'name': h.get('changed_by_full_name') or h.get('changed_by_name', '')
+        '''), self._history_from_row)
+        
+        result = []
+        for deal in deals:
+            enriched = deal.copy()
+            deal_id = deal['id']
+            
+            if deal.get('funnel_id') in funnels:
+                enriched['funnel'] = funnels[deal['funnel_id']]
+            if deal.get('stage_id') in stages:
+                enriched['stage'] = stages[deal['stage_id']]
+            if deal.get('company_id') in companies:
+                enriched['company'] = companies[deal['company_id']]
+            if deal.get('primary_contact_id') in contacts:
+                enriched['primary_contact'] = contacts[deal['primary_contact_id']]
+            if deal.get('responsible_user_id') in users:
+                enriched['responsible_user'] = users[deal['responsible_user_id']]
+            
+            collections = {
+                'products': products,
+                'files': files,
+                'comments': comments,
+                'participants': participants,
+                'history': history,
             }
-            h.pop('changed_by_name', None)
-            h.pop('changed_by_full_name', None)
-            history.append(h)
-        enriched['history'] = history
+            for name, grouped in collections.items():
+                if name in relations:
+                    enriched[name] = grouped.get(deal_id, [])
+            result.append(enriched)
         
-        return enriched
-
-
+        return result
+    
+    @staticmethod
+    def _collect_ids(deals: List[Dict[str, Any]], field: str) -> List[int]:
+        """Уникальные непустые значения поля по списку сделок"""
+        return list({deal[field] for deal in deals if deal.get(field)})
+    
+    @staticmethod
+    def _group_by_deal(rows: List[Any], convert) -> Dict[int, List[Dict[str, Any]]]:
+        """Раскладывает строки по deal_id, сохраняя порядок выборки"""
+        grouped: Dict[int, List[Dict[str, Any]]] = {}
+        for row in rows:
+            grouped.setdefault(row['deal_id'], []).append(convert(row))
+        return grouped
+    
+    @staticmethod
+    def _person_name(last_name: Optional[str], first_name: Optional[str], middle_name: Optional[str]) -> str:
+        """ФИО контакта в формате 'Фамилия Имя Отчество'"""
+        full_name = ' '.join(filter(None, [last_name, first_name, middle_name])).strip()
+        return full_name or first_name or ''
+    
+    @staticmethod
+    def _comment_from_row(row) -> Dict[str, Any]:
+        comment = dict(row)
+        comment['author'] = {
+            'id': comment.get('author_id'),
+            'name': comment.get('author_full_name') or comment.get('author_name', '')
+        }
+        # Удаляем лишние поля
+        comment.pop('author_name', None)
+        comment.pop('author_full_name', None)
+        return comment
+    
+    def _participant_from_row(self, row) -> Dict[str, Any]:
+        participant = dict(row)
+        if participant.get('user_id'):
+            participant['user'] = {
+                'id': participant.get('user_id'),
+                'name': participant.get('user_full_name') or participant.get('user_name', '')
+            }
+        if participant.get('contact_id'):
+            participant['contact'] = {
+                'id': participant.get('contact_id'),
+                'name': self._person_name(
+                    participant.get('contact_last_name'),
+                    participant.get('contact_first_name'),
+                    participant.get('contact_middle_name'),
+                ),
+            }
+        participant.pop('user_name', None)
+        participant.pop('user_full_name', None)
+        participant.pop('contact_first_name', None)
+        participant.pop('contact_middle_name', None)
+        participant.pop('contact_last_name', None)
+        return participant
+    
+    @staticmethod
+    def _history_from_row(row) -> Dict[str, Any]:
+        h = dict(row)
+        h['changed_by'] = {
+            'id': h.get('changed_by_id'),
+            'name': h.get('changed_by_full_name') or h.get('changed_by_name', '')
+        }
+        h.pop('changed_by_name', None)
+        h.pop('changed_by_full_name', None)
+        return h
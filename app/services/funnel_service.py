@@ -3,9 +3,11 @@
 """
 from typing import List, Dict, Any, Optional
 from datetime import datetime
+from ..core import stage_metrics
+from ..core.audit_writer import HistoryEntry, audit_writer
 from ..core.database import db_manager
 from ..utils.constants import SYSTEM_STAGES, DEFAULT_FUNNEL_NAME, DEFAULT_FUNNEL_DESCRIPTION
-from ..utils.enums import StageSemanticId
+from ..utils.enums import ChangeType, StageSemanticId
 
 
 class FunnelService:
@@ -43,20 +45,18 @@ class FunnelService:
                 'SELECT * FROM deal_stages WHERE funnel_id = ? ORDER BY order_index ASC',
                 (funnel_id,)
             )
-            stages = []
-            for stage_row in stages_cursor.fetchall():
-                stage = dict(stage_row)
-                
-                # Получаем метрики для стадии
-                metrics_cursor = conn.execute(
-                    'SELECT * FROM stage_metrics WHERE stage_id = ?',
-                    (stage['id'],)
-                )
-                metrics_row = metrics_cursor.fetchone()
-                if metrics_row:
-                    stage['metrics'] = dict(metrics_row)
-                
-                stages.append(stage)
+            stages = [dict(stage_row) for stage_row in stages_cursor.fetchall()]
+            
+            # Метрики всех стадий воронки одним запросом (ведутся DealService)
+            metrics_cursor = conn.execute('''
+                SELECT m.* FROM stage_metrics m
+                JOIN deal_stages s ON s.id = m.stage_id
+                WHERE s.funnel_id = ?
+            ''', (funnel_id,))
+            metrics = {row['stage_id']: dict(row) for row in metrics_cursor.fetchall()}
+            for stage in stages:
+                if stage['id'] in metrics:
+                    stage['metrics'] = metrics[stage['id']]
             
             funnel['stages'] = stages
             return funnel
@@ -108,7 +108,6 @@ class FunnelService:
             if is_default or not self.get_all():
                 self._create_system_stages(conn, funnel_id)
             
-            conn.commit()
             return self.get_by_id(funnel_id)
     
     def update(self, funnel_id: int, funnel_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
@@ -147,7 +146,6 @@ class FunnelService:
                 values.append(funnel_id)
                 sql = f"UPDATE funnels SET {', '.join(updates)} WHERE id = ?"
                 conn.execute(sql, values)
-                conn.commit()
             
             return self.get_by_id(funnel_id)
     
@@ -165,7 +163,6 @@ class FunnelService:
             
             # Удаляем воронку (стадии удалятся каскадно)
             cursor = conn.execute('DELETE FROM funnels WHERE id = ?', (funnel_id,))
-            conn.commit()
             return cursor.rowcount > 0
     
     def add_stage(self, funnel_id: int, stage_data: Dict[str, Any]) -> Dict[str, Any]:
@@ -207,8 +204,6 @@ class FunnelService:
                 VALUES (?)
             ''', (stage_id,))
             
-            conn.commit()
-            
             # Возвращаем созданную стадию
             cursor = conn.execute('SELECT * FROM deal_stages WHERE id = ?', (stage_id,))
             return dict(cursor.fetchone())
@@ -237,27 +232,34 @@ class FunnelService:
                 values.extend([stage_id, funnel_id])
                 sql = f"UPDATE deal_stages SET {', '.join(updates)} WHERE id = ? AND funnel_id = ?"
                 conn.execute(sql, values)
-                conn.commit()
             
             cursor = conn.execute('SELECT * FROM deal_stages WHERE id = ?', (stage_id,))
             return dict(cursor.fetchone())
     
-    def delete_stage(self, funnel_id: int, stage_id: int) -> bool:
+    def delete_stage(self, funnel_id: int, stage_id: int, user_id: int) -> bool:
         """
         Удаляет стадию (перемещает все сделки в первую стадию воронки)
         
         Args:
             funnel_id: ID воронки
             stage_id: ID стадии для удаления
+            user_id: ID пользователя (автор записей истории о переносе сделок)
             
         Returns:
             True если успешно удалено
         """
         with db_manager.get_connection() as conn:
-            # Получаем первую стадию воронки
             cursor = conn.execute(
-                'SELECT id FROM deal_stages WHERE funnel_id = ? ORDER BY order_index ASC LIMIT 1',
-                (funnel_id,)
+                'SELECT 1 FROM deal_stages WHERE id = ? AND funnel_id = ?',
+                (stage_id, funnel_id)
+            )
+            if not cursor.fetchone():
+                return False
+            
+            # Получаем первую из остальных стадий воронки
+            cursor = conn.execute(
+                'SELECT id FROM deal_stages WHERE funnel_id = ? AND id != ? ORDER BY order_index ASC LIMIT 1',
+                (funnel_id, stage_id)
             )
             first_stage_row = cursor.fetchone()
             if not first_stage_row:
@@ -265,11 +267,23 @@ class FunnelService:
             
             first_stage_id = first_stage_row['id']
             
-            # Перемещаем все сделки в первую стадию
+            # Перемещаем все сделки в первую стадию (метрики - одним приращением)
+            deal_ids = [
+                row[0] for row in conn.execute(
+                    'SELECT id FROM deals WHERE stage_id = ? AND funnel_id = ?', (stage_id, funnel_id)
+                ).fetchall()
+            ]
+            stage_metrics.record_stage_deals_moved(conn, stage_id, first_stage_id)
             conn.execute('''
                 UPDATE deals SET stage_id = ?, moved_at = CURRENT_TIMESTAMP
-                WHERE funnel_id = ? AND stage_id = ?
-            ''', (first_stage_id, funnel_id, stage_id))
+                WHERE stage_id = ? AND funnel_id = ?
+            ''', (first_stage_id, stage_id, funnel_id))
+            
+            # История смены стадии (по ней rebuild_stage_metrics восстанавливает накопители)
+            audit_writer.write(conn, [
+                HistoryEntry(deal_id, 'stage', str(stage_id), str(first_stage_id), ChangeType.STAGE_CHANGE, user_id)
+                for deal_id in deal_ids
+            ])
             
             # Удаляем метрики стадии
             conn.execute('DELETE FROM stage_metrics WHERE stage_id = ?', (stage_id,))
@@ -279,7 +293,6 @@ class FunnelService:
                 'DELETE FROM deal_stages WHERE id = ? AND funnel_id = ?',
                 (stage_id, funnel_id)
             )
-            conn.commit()
             return cursor.rowcount > 0
     
     def reorder_stages(self, funnel_id: int, stage_ids: List[int]) -> bool:
@@ -308,7 +321,6 @@ class FunnelService:
                     WHERE id = ? AND funnel_id = ?
                 ''', (order_index, stage_id, funnel_id))
             
-            conn.commit()
             return True
     
     def set_default(self, funnel_id: int) -> Optional[Dict[str, Any]]:
@@ -319,7 +331,6 @@ class FunnelService:
             
             # Устанавливаем флаг default для указанной воронки
             conn.execute('UPDATE funnels SET is_default = TRUE, updated_at = CURRENT_TIMESTAMP WHERE id = ?', (funnel_id,))
-            conn.commit()
             
             return self.get_by_id(funnel_id)
     
@@ -361,9 +372,3 @@ class FunnelService:
                 INSERT INTO stage_metrics (stage_id)
                 VALUES (?)
             ''', (stage_id,))
-        
-        conn.commit()
-
-
-
-
@@ -0,0 +1,134 @@
+"""
+Однократный импорт legacy JSON (customers.json, contacts.json,
+calculations.json) в SQLite
+
+Импорт не выполняется при создании сервисов: его запускает CLI
+(python -m app.services.legacy_import) или приложение при старте, до
+приёма запросов (run_startup_imports). Выполненные импорты фиксируются в
+таблице legacy_imports (миграция схемы 13), поэтому каждый источник
+обрабатывается один раз, а проверка при старте - один SELECT.
+
+Как и прежде, клиенты и контакты переносятся только в пустую таблицу;
+непустая таблица или отсутствующий файл отмечаются в журнале как skipped.
+Расчеты собираются из двух файлов (корневого и app/calculations.json
+legacy API), поэтому импортируются и в непустую таблицу; их импорт
+идемпотентен (уже перенесённые записи пропускаются), так что повторный
+запуск с --force не создаёт дубликатов.
+"""
+import logging
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from ..core.database import begin_immediate, db_manager
+from ..utils.storage import read_json_file
+from .calculation_service import (
+    CALCULATIONS_STORAGE_PATH,
+    LEGACY_API_CALCULATIONS_PATH,
+    CalculationService,
+)
+from .contact_service import CONTACTS_JSON_PATH, ContactService
+from .customer_service import CUSTOMERS_JSON_PATH, CustomerService
+
+logger = logging.getLogger(__name__)
+
+IMPORTED = 'imported'
+SKIPPED = 'skipped'
+
+
+class LegacyImport(NamedTuple):
+    """Источник legacy данных"""
+    name: str
+    path: str
+    table: str
+    service: Callable[[], object]
+    # Импортировать только в пустую таблицу
+    require_empty: bool = True
+
+
+# Порядок важен: контакты ссылаются на клиентов
+LEGACY_IMPORTS: List[LegacyImport] = [
+    LegacyImport('customers_json', CUSTOMERS_JSON_PATH, 'customers', CustomerService),
+    LegacyImport('contacts_json', CONTACTS_JSON_PATH, 'contacts', ContactService),
+    LegacyImport('calculations_json', CALCULATIONS_STORAGE_PATH, 'calculations', CalculationService, False),
+    LegacyImport('legacy_api_calculations_json', LEGACY_API_CALCULATIONS_PATH, 'calculations',
+                 CalculationService, False),
+]
+
+
+def pending_imports() -> List[LegacyImport]:
+    """Источники, ещё не отмеченные в журнале legacy_imports"""
+    with db_manager.get_connection() as conn:
+        done = {row[0] for row in conn.execute('SELECT name FROM legacy_imports').fetchall()}
+    return [item for item in LEGACY_IMPORTS if item.name not in done]
+
+
+def run_import(item: LegacyImport, force: bool = False) -> Optional[int]:
+    """
+    Импортирует один источник и записывает результат в журнал
+
+    Журнал проверяется повторно под блокировкой записи (BEGIN IMMEDIATE),
+    поэтому несколько воркеров, стартовавших одновременно, не импортируют
+    данные дважды.
+
+    Args:
+        item: Источник
+        force: Импортировать, даже если источник уже отмечен в журнале
+
+    Returns:
+        Количество импортированных записей или None, если импорт пропущен
+    """
+    records = read_json_file(item.path)
+
+    with db_manager.get_connection() as conn:
+        begin_immediate(conn)
+        done = conn.execute('SELECT 1 FROM legacy_imports WHERE name = ?', (item.name,)).fetchone()
+        if done and not force:
+            return None
+
+        count = None
+        if records and (
+            not item.require_empty
+            or conn.execute(f'SELECT COUNT(*) FROM {item.table}').fetchone()[0] == 0
+        ):
+            count = item.service().import_legacy(conn, records)
+        # Повторный (force) запуск без новых записей не затирает запись о прошлом импорте
+        if count or not done:
+            conn.execute(
+                '''
+                INSERT OR REPLACE INTO legacy_imports (name, source, status, imported_count, imported_at)
+                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ''',
+                (item.name, item.path, IMPORTED if count is not None else SKIPPED, count or 0),
+            )
+    logger.info(f"Legacy импорт {item.name}: {count if count is not None else SKIPPED}")
+    return count
+
+
+def run_pending_imports(force: bool = False) -> Dict[str, Optional[int]]:
+    """Выполняет все невыполненные импорты (с force - все импорты)"""
+    items = LEGACY_IMPORTS if force else pending_imports()
+    return {item.name: run_import(item, force=force) for item in items}
+
+
+def run_startup_imports() -> None:
+    """
+    Выполняет невыполненные импорты при старте приложения
+
+    Вызывается до приёма запросов, чтобы ID расчетов из legacy файлов не
+    конфликтовали с расчетами, созданными пользователями.
+    """
+    if not pending_imports():
+        return
+    try:
+        run_pending_imports()
+    except Exception:
+        logger.exception("Ошибка legacy импорта")
+
+
+if __name__ == "__main__":
+    import sys
+
+    results = run_pending_imports(force='--force' in sys.argv[1:])
+    if not results:
+        print("Все legacy импорты уже выполнены")
+    for name, count in results.items():
+        print(f"{name}: {'пропущен' if count is None else f'импортировано записей: {count}'}")
@@ -3,6 +3,7 @@
 """
 from typing import List, Dict, Any, Optional
 from ..core.database import db_manager
+from ..core.db_executor import run_in_db
 from ..core.exceptions import NotFoundError
 from ..models.proposal import ProposalCreate, ProposalUpdate
 
@@ -15,17 +16,15 @@ class ProposalService:
     
     async def get_proposals(self, user_id: int = 1) -> List[Dict[str, Any]]:
         """Получение всех предложений пользователя"""
-        return self.db_manager.get_proposals(user_id)
+        return await run_in_db(self.db_manager.get_proposals, user_id)
     
     async def get_proposal_by_id(self, proposal_id: int) -> Optional[Dict[str, Any]]:
         """Получение предложения по ID"""
-        return self.db_manager.get_proposal_by_id(proposal_id)
+        return await run_in_db(self.db_manager.get_proposal_by_id, proposal_id)
     
     async def create_proposal(self, proposal_data: ProposalCreate, user_id: int = 1) -> Dict[str, Any]:
         """Создание нового предложения"""
-        self.db_manager.add_missing_columns()
-        
-        proposal_id = self.db_manager.save_proposal({
+        proposal_id = await run_in_db(self.db_manager.save_proposal, {
             'user_id': user_id,
             'company': proposal_data.company,
             'productType': proposal_data.product_type,
@@ -42,8 +41,6 @@ class ProposalService:
     
     async def update_proposal(self, proposal_id: int, proposal_data: ProposalUpdate) -> Dict[str, Any]:
         """Обновление предложения"""
-        # Убедимся, что структура таблицы актуальна, чтобы апдейты не падали молча
-        self.db_manager.add_missing_columns()
         # Создаем словарь только с переданными полями
         update_data = {}
         
@@ -66,7 +63,7 @@ class ProposalService:
         if proposal_data.priority is not None:
             update_data['priority'] = proposal_data.priority
             
-        updated_proposal = self.db_manager.update_proposal(proposal_id, update_data)
+        updated_proposal = await run_in_db(self.db_manager.update_proposal, proposal_id, update_data)
         
         if not updated_proposal:
             raise NotFoundError("КП не найдено")
@@ -75,7 +72,7 @@ class ProposalService:
     
     async def delete_proposal(self, proposal_id: int) -> Dict[str, bool]:
         """Удаление предложения"""
-        success = self.db_manager.delete_proposal(proposal_id)
+        success = await run_in_db(self.db_manager.delete_proposal, proposal_id)
         return {"success": success}
 
 
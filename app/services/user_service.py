@@ -3,6 +3,7 @@
 """
 from typing import List, Dict, Any, Optional
 from ..core.database import db_manager
+from ..core.db_executor import run_in_db
 from ..core.exceptions import NotFoundError, ConflictError, ValidationError
 from ..models.user import UserCreate, UserUpdate, PasswordChange
 
@@ -15,11 +16,11 @@ class UserService:
     
     async def get_all_users(self) -> List[Dict[str, Any]]:
         """Получение всех пользователей"""
-        return self.db_manager.get_all_users()
+        return await run_in_db(self.db_manager.get_all_users)
     
     async def get_user_by_id(self, user_id: int) -> Optional[Dict[str, Any]]:
         """Получение пользователя по ID"""
-        user = self.db_manager.get_user_by_id(user_id)
+        user = await run_in_db(self.db_manager.get_user_by_id, user_id)
         if not user:
             raise NotFoundError(f"Пользователь с ID {user_id} не найден")
         return user
@@ -27,11 +28,12 @@ class UserService:
     async def create_user(self, user_data: UserCreate) -> Dict[str, Any]:
         """Создание нового пользователя"""
         # Проверяем, существует ли пользователь с таким логином или email
-        existing_user = self.db_manager.get_user_by_login(user_data.login)
+        existing_user = await run_in_db(self.db_manager.get_user_by_login, user_data.login)
         if existing_user:
             raise ConflictError("Пользователь с таким логином уже существует")
         
-        user_id = self.db_manager.create_user(
+        user_id = await run_in_db(
+            self.db_manager.create_user,
             user_data.login,
             user_data.username,
             user_data.email,
@@ -42,7 +44,7 @@ class UserService:
             user_data.is_admin
         )
         
-        created_user = self.db_manager.get_user_by_id(user_id)
+        created_user = await run_in_db(self.db_manager.get_user_by_id, user_id)
         return {
             "id": created_user['id'],
             "login": created_user['login'],
@@ -64,11 +66,12 @@ class UserService:
         
         # Проверяем, что новый login не занят другим пользователем
         if user_data.login:
-            existing_user = self.db_manager.get_user_by_login(user_data.login)
+            existing_user = await run_in_db(self.db_manager.get_user_by_login, user_data.login)
             if existing_user and existing_user['id'] != user_id:
                 raise ConflictError("Пользователь с таким логином уже существует")
         
-        updated_user = self.db_manager.update_user(
+        updated_user = await run_in_db(
+            self.db_manager.update_user,
             user_id,
             user_data.login,
             user_data.username,
@@ -98,7 +101,7 @@ class UserService:
         """Изменение пароля пользователя"""
         await self.get_user_by_id(user_id)  # Проверяем существование пользователя
         
-        self.db_manager.change_user_password(user_id, password_data.new_password)
+        await run_in_db(self.db_manager.change_user_password, user_id, password_data.new_password)
         return {"message": "Пароль успешно изменен"}
     
     async def regenerate_password(self, user_id: int) -> Dict[str, str]:
@@ -109,17 +112,17 @@ class UserService:
         import string
         new_password = ''.join(secrets.choice(string.ascii_letters + string.digits) for _ in range(12))
         
-        self.db_manager.change_user_password(user_id, new_password)
+        await run_in_db(self.db_manager.change_user_password, user_id, new_password)
         return {"new_password": new_password}
     
     async def toggle_admin_status(self, user_id: int) -> Dict[str, str]:
         """Переключение статуса администратора"""
         # Убедимся, что пользователь существует
-        user = self.db_manager.get_user_by_id(user_id)
+        user = await run_in_db(self.db_manager.get_user_by_id, user_id)
         if not user:
             raise NotFoundError("Пользователь не найден")
 
-        new_status = self.db_manager.toggle_admin_status(user_id)
+        new_status = await run_in_db(self.db_manager.toggle_admin_status, user_id)
         if new_status is None:
             raise NotFoundError("Пользователь не найден")
         
@@ -128,11 +131,11 @@ class UserService:
     async def toggle_user_active_status(self, user_id: int) -> Dict[str, str]:
         """Переключение статуса активности пользователя"""
         # Убедимся, что пользователь существует
-        user = self.db_manager.get_user_by_id(user_id)
+        user = await run_in_db(self.db_manager.get_user_by_id, user_id)
         if not user:
             raise NotFoundError("Пользователь не найден")
 
-        new_status = self.db_manager.toggle_user_active_status(user_id)
+        new_status = await run_in_db(self.db_manager.toggle_user_active_status, user_id)
         if new_status is None:
             raise NotFoundError("Пользователь не найден")
         
@@ -140,7 +143,7 @@ class UserService:
     
     async def delete_user(self, user_id: int) -> Dict[str, str]:
         """Удаление пользователя"""
-        success = self.db_manager.delete_user(user_id)
+        success = await run_in_db(self.db_manager.delete_user, user_id)
         if not success:
             raise ConflictError("Нельзя удалить администратора или пользователь не найден")
         
@@ -0,0 +1,95 @@
+"""
+Сводка расчета для списка: количество позиций, себестоимость, наценка и итог
+
+Сводка вычисляется при записи расчета и хранится в таблице calculations,
+поэтому список расчетов не обходит позиции каждого расчета.
+"""
+from typing import Any, Dict
+
+
+SUMMARY_FIELDS = ('items_count', 'cost_price', 'markup_value', 'markup_percent', 'total_price')
+
+
+def calculation_summary(it: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Вычисляет сводку расчета
+
+    Args:
+        it: Расчет (новый формат с assortments/blanks/global_operations
+            или legacy формат с items)
+
+    Returns:
+        Словарь с полями SUMMARY_FIELDS
+    """
+    # Поддержка старого формата (legacy)
+    if 'items' in it:
+        # Для старого формата используем базовые значения
+        cost_price = sum([item.get('materialCost', 0) for item in it.get('items') or []])
+        return {
+            'items_count': len(it.get('items') or []),
+            'cost_price': cost_price,
+            'markup_value': 0,
+            'markup_percent': 0,
+            'total_price': cost_price,
+        }
+
+    assortments = it.get('assortments', [])
+    blanks = it.get('blanks', [])
+    global_ops = it.get('global_operations', [])
+    global_markup = it.get('global_markup', 0.0)
+
+    # Расчет себестоимости
+    assortments_material_cost = sum([a.get('materialCost', 0) for a in assortments])
+    assortments_processing_cost = sum([a.get('processingCost', 0) for a in assortments])
+    # Для заготовок: базовая стоимость = price * quantity (без наценки)
+    blanks_cost = sum([b.get('price', 0) * b.get('quantity', 0) for b in blanks])
+    # Для глобальных операций используем сохраненную стоимость операции
+    global_ops_cost = sum([op.get('cost', 0) or 0 for op in global_ops])
+    cost_price = assortments_material_cost + assortments_processing_cost + blanks_cost + global_ops_cost
+
+    # Расчет наценки
+    assortments_markup = sum([
+        (a.get('materialCost', 0) + a.get('processingCost', 0)) * (a.get('markup', 0) / 100)
+        for a in assortments
+    ])
+    # Наценка на заготовки: sum - базовая стоимость
+    blanks_markup = sum([
+        b.get('sum', 0) - (b.get('price', 0) * b.get('quantity', 0))
+        for b in blanks
+    ])
+    markup_value = assortments_markup + blanks_markup
+
+    # Цена без глобальной наценки (себестоимость + наценки)
+    price_without_global = cost_price + markup_value
+
+    apply_to_assortments = it.get('global_markup_apply_to_assortments', True)
+    apply_to_blanks = it.get('global_markup_apply_to_blanks', False)
+    apply_to_operations = it.get('global_markup_apply_to_operations', False)
+
+    # База для глобальной наценки (только выбранные категории)
+    global_markup_base = 0
+    if apply_to_assortments:
+        global_markup_base += sum([
+            (a.get('materialCost', 0) + a.get('processingCost', 0)) * (1 + a.get('markup', 0) / 100)
+            for a in assortments
+        ])
+    if apply_to_blanks:
+        global_markup_base += sum([b.get('sum', 0) for b in blanks])
+    if apply_to_operations:
+        global_markup_base += global_ops_cost
+
+    # Если ничего не выбрано, применяем ко всему (для обратной совместимости)
+    if not apply_to_assortments and not apply_to_blanks and not apply_to_operations:
+        global_markup_base = price_without_global
+
+    # Итоговая цена = цена без глобальной наценки + глобальная наценка
+    total_price = price_without_global + global_markup_base * (global_markup / 100)
+
+    return {
+        'items_count': len(assortments) + len(blanks),
+        'cost_price': cost_price,
+        'markup_value': markup_value,
+        # Процент наценки (относительно себестоимости)
+        'markup_percent': (markup_value / cost_price * 100) if cost_price > 0 else 0,
+        'total_price': total_price,
+    }
@@ -0,0 +1,106 @@
+"""
+Keyset-пагинация (курсоры) для списков
+"""
+import base64
+import json
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+
+SORT_ORDERS = ('asc', 'desc')
+
+
+def resolve_sort(sort: str, order: str, allowed: Sequence[str]) -> Tuple[str, str]:
+    """Проверяет ключ и направление сортировки"""
+    if sort not in allowed:
+        raise ValueError(f"Недопустимая сортировка: {sort}. Доступно: {', '.join(allowed)}")
+    order = (order or 'desc').lower()
+    if order not in SORT_ORDERS:
+        raise ValueError(f"Недопустимое направление сортировки: {order}")
+    return sort, order
+
+
+def encode_cursor(sort: str, order: str, value: Any, row_id: int) -> str:
+    """Кодирует позицию последней строки страницы в непрозрачный курсор"""
+    payload = json.dumps({'s': sort, 'o': order, 'v': value, 'id': row_id}, ensure_ascii=False)
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str, sort: str, order: str) -> Tuple[Any, int]:
+    """
+    Декодирует курсор и возвращает (значение ключа сортировки, id)
+
+    Raises:
+        ValueError: Если курсор повреждён или выдан для другой сортировки
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+        value, row_id = payload['v'], int(payload['id'])
+        cursor_sort, cursor_order = payload['s'], payload['o']
+    except (ValueError, KeyError, TypeError):
+        raise ValueError('Некорректный курсор')
+    if cursor_sort != sort or cursor_order != order:
+        raise ValueError('Курсор выдан для другой сортировки')
+    return value, row_id
+
+
+def keyset_condition(column: str, order: str, value: Any, row_id: int, id_column: str = 'id') -> Tuple[str, List[Any]]:
+    """
+    Условие "строки после курсора" для ORDER BY column, id
+
+    NULL в SQLite меньше любого значения: при DESC такие строки идут
+    в конце, при ASC - в начале.
+    """
+    if order == 'desc':
+        if value is None:
+            return f'({column} IS NULL AND {id_column} < ?)', [row_id]
+        return f'(({column}, {id_column}) < (?, ?) OR {column} IS NULL)', [value, row_id]
+    if value is None:
+        return f'({column} IS NOT NULL OR {id_column} > ?)', [row_id]
+    return f'(({column}, {id_column}) > (?, ?))', [value, row_id]
+
+
+def order_by_clause(column: str, order: str, id_column: str = 'id') -> str:
+    """ORDER BY по ключу сортировки с id для однозначного порядка"""
+    direction = order.upper()
+    return f' ORDER BY {column} {direction}, {id_column} {direction}'
+
+
+def keyset_tail(
+    sort: str,
+    order: str,
+    after: Optional[Tuple[Any, int]],
+    limit: int,
+    skip: int,
+) -> Tuple[str, List[Any]]:
+    """
+    Хвост запроса страницы: условие курсора, ORDER BY и LIMIT limit + 1
+
+    С курсором skip не применяется.
+    """
+    tail, params = '', []
+    if after is not None:
+        condition, params = keyset_condition(sort, order, *after)
+        tail = f'WHERE {condition}'
+        skip = 0
+    tail += order_by_clause(sort, order) + ' LIMIT ? OFFSET ?'
+    return tail, params + [limit + 1, skip]
+
+
+def split_page(
+    rows: List[Dict[str, Any]],
+    limit: int,
+    sort: str,
+    order: str,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Отделяет лишнюю строку (выборка делается с LIMIT limit + 1)
+
+    Returns:
+        Кортеж (строки страницы, курсор следующей страницы или None)
+    """
+    if len(rows) <= limit:
+        return rows, None
+    page = rows[:limit]
+    last = page[-1]
+    return page, encode_cursor(sort, order, last[sort], last['id'])
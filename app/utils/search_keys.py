@@ -0,0 +1,82 @@
+"""
+Нормализация строк для поиска по клиентам и контактам
+
+SQLite LOWER() не приводит кириллицу к нижнему регистру, поэтому ключи
+поиска вычисляются в Python при записи и хранятся в отдельных колонках.
+"""
+import re
+from typing import Any, Iterable, Optional
+
+_PUNCTUATION_RE = re.compile(r'[\W_]+', re.UNICODE)
+_NON_DIGITS_RE = re.compile(r'\D+')
+
+
+def normalize_text(value: Any) -> str:
+    """
+    Ключ поиска для текста: регистр сброшен (casefold), ё -> е,
+    пунктуация заменена пробелами, пробелы схлопнуты
+
+    Args:
+        value: Исходная строка (None - пустой ключ)
+
+    Returns:
+        Нормализованная строка
+    """
+    if value is None:
+        return ''
+    text = str(value).casefold().replace('ё', 'е')
+    return _PUNCTUATION_RE.sub(' ', text).strip()
+
+
+def normalize_phone(value: Any) -> str:
+    """
+    Ключ поиска для телефона: только цифры, российские номера
+    из 11 цифр приводятся к виду 7XXXXXXXXXX
+
+    Args:
+        value: Телефон в любом формате
+
+    Returns:
+        Цифры телефона
+    """
+    if value is None:
+        return ''
+    digits = _NON_DIGITS_RE.sub('', str(value))
+    if len(digits) == 11 and digits.startswith('8'):
+        digits = '7' + digits[1:]
+    return digits
+
+
+def normalize_phone_e164(value: Any, country_code: str = '7') -> str:
+    """
+    Телефон в формате E.164 без "+": 8XXXXXXXXXX и 10-значные
+    номера без кода страны приводятся к коду country_code
+
+    Args:
+        value: Телефон в любом формате
+
+    Returns:
+        Цифры номера с кодом страны (пустая строка, если цифр нет)
+    """
+    digits = normalize_phone(value)
+    if len(digits) == 10:
+        digits = country_code + digits
+    return digits
+
+
+def normalize_email(value: Any) -> str:
+    """Email для точного поиска: без пробелов по краям, в нижнем регистре"""
+    if value is None:
+        return ''
+    email = str(value).strip().lower()
+    return email if '@' in email else ''
+
+
+def join_keys(values: Iterable[Any]) -> str:
+    """Нормализует и объединяет несколько полей в один ключ"""
+    return ' '.join(key for key in (normalize_text(value) for value in values) if key)
+
+
+def search_digits(value: Optional[str]) -> str:
+    """Цифры поискового запроса (для поиска по телефону)"""
+    return normalize_phone(value) if value else ''
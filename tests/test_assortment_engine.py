@@ -0,0 +1,31 @@
+import json
+
+import pytest
+
+from backend.app.core.assortment_engine import evaluate_positions, unit_weight
+from backend.app.core.materials import MaterialCatalog
+
+
+def test_unit_weight_round_bar_and_tube():
+    # Круг 180 мм, длина 153 мм, сталь 7850 кг/м3 - как сохранено клиентом
+    assert unit_weight('Круг', {'diameter': 180, 'length': 153}, 7850) == pytest.approx(30.56, abs=0.01)
+    assert unit_weight('труба', {'diameter': 57, 'wall': '3,5', 'length': 1000}, 7850) == pytest.approx(4.618, abs=0.001)
+    with pytest.raises(ValueError):
+        unit_weight('Лист', {'width': 1000, 'length': 2000}, 7850)
+
+
+def test_evaluate_positions_uses_catalog_and_reports_errors(tmp_path):
+    path = tmp_path / 'materials.json'
+    path.write_text(json.dumps({'prices_metal_materials': {
+        'Сталь': [{'id': 1, 'grade': 'Ст3', 'density': 7850, 'price': 100}],
+    }}, ensure_ascii=False), encoding='utf-8')
+    catalog = MaterialCatalog(str(path))
+    items = evaluate_positions([
+        {'id': 'a', 'material': 'Сталь Ст3', 'shape': 'Квадрат', 'dimensions': {'side': 10, 'length': 1000},
+         'quantity': 2, 'processingCost': 50, 'markup': 10},
+        {'id': 'b', 'material': 'Медь М1', 'shape': 'Круг', 'dimensions': {'diameter': 10, 'length': 10}},
+    ], catalog)
+    assert items[0]['weight'] == pytest.approx(0.785)
+    assert items[0]['materialCost'] == pytest.approx(157)
+    assert items[0]['price'] == pytest.approx(207 * 1.1)
+    assert items[1] == {'id': 'b', 'error': 'Марка не найдена: Медь М1'}
@@ -0,0 +1,55 @@
+import pytest
+
+from backend.app.core.audit_writer import AuditWriter, HistoryEntry
+from backend.app.core.database import DatabaseManager
+from backend.app.core.exceptions import AppException
+
+
+@pytest.fixture
+def writer(tmp_path):
+    db = DatabaseManager(str(tmp_path / 'audit.db'))
+    with db.get_connection() as conn:
+        conn.execute('''
+            CREATE TABLE deal_history (
+                id INTEGER PRIMARY KEY, deal_id INTEGER, field_name TEXT, old_value TEXT,
+                new_value TEXT, change_type TEXT, changed_by_id INTEGER
+            )
+        ''')
+    writer = AuditWriter(db, mode='write_behind', flush_interval=60)
+    yield db, writer
+    writer.close()
+    db.close_all()
+
+
+def _entry(deal_id):
+    return HistoryEntry(deal_id, 'title', 'old', 'new', 'UPDATE', 1)
+
+
+def _history_count(db):
+    with db.get_connection() as conn:
+        return conn.execute('SELECT COUNT(*) FROM deal_history').fetchone()[0]
+
+
+def test_write_behind_drops_rolled_back_entries(writer):
+    db, writer = writer
+    with pytest.raises(AppException):
+        with db.get_connection() as conn:
+            writer.write(conn, [_entry(1)])
+            raise ValueError('x')
+    with db.get_connection() as conn:
+        with pytest.raises(AppException):
+            with db.get_connection() as inner:
+                writer.write(inner, [_entry(2)])
+                raise ValueError('x')
+
+    assert writer.flush() == 0
+    assert _history_count(db) == 0
+
+
+def test_write_behind_queues_entries_after_commit(writer):
+    db, writer = writer
+    with db.get_connection() as conn:
+        writer.write(conn, [_entry(1), _entry(2)])
+        assert writer.flush() == 0
+    assert writer.flush() == 2
+    assert _history_count(db) == 2
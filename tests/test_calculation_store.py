@@ -0,0 +1,63 @@
+import sqlite3
+
+from backend.app.core.calculation_refs import create_refs_table
+from backend.app.core.calculation_store import (
+    _row_to_record, create_calculations_table, create_summary_columns, import_calculations,
+)
+from backend.app.utils.calculation_summary import calculation_summary
+
+
+def _conn():
+    conn = sqlite3.connect(':memory:')
+    conn.row_factory = sqlite3.Row
+    create_calculations_table(conn)
+    create_summary_columns(conn)
+    create_refs_table(conn)
+    return conn
+
+
+def test_import_keeps_ids_and_record_shape():
+    conn = _conn()
+    record = {'id': 8, 'name': 'Втулка', 'assortments': [{'materialCost': 1.5}], 'global_markup': 10,
+              'created_at': '2025-11-08T11:41:58', 'updated_at': '2025-11-08T12:00:00'}
+    assert import_calculations(conn, [record]) == 1
+    row = conn.execute('SELECT * FROM calculations').fetchone()
+    assert _row_to_record(row) == record
+
+
+def test_import_reassigns_colliding_ids():
+    conn = _conn()
+    import_calculations(conn, [{'id': 1, 'name': 'a'}])
+    assert import_calculations(conn, [{'id': 1, 'name': 'b', 'items': []}, {'name': 'c'}]) == 2
+    rows = conn.execute('SELECT id, name FROM calculations ORDER BY id').fetchall()
+    assert [tuple(row) for row in rows] == [(1, 'a'), (2, 'b'), (3, 'c')]
+
+
+def test_reimport_skips_already_imported_records():
+    conn = _conn()
+    records = [
+        {'id': 1, 'name': 'a', 'created_at': '2025-01-01T00:00:00'},
+        {'id': 1, 'name': 'b', 'created_at': '2025-01-02T00:00:00'},
+        {'name': 'c', 'items': []},
+    ]
+    assert import_calculations(conn, records) == 3
+    # Изменения после импорта (переоценка) не делают запись новой
+    conn.execute("UPDATE calculations SET payload = '{\"global_markup\":5}' WHERE id = 1")
+    assert import_calculations(conn, records) == 0
+    assert conn.execute('SELECT COUNT(*) FROM calculations').fetchone()[0] == 3
+
+
+def test_summary_stored_on_import():
+    conn = _conn()
+    record = {
+        'name': 'Фланец', 'global_markup': 10,
+        'assortments': [{'materialCost': 100, 'processingCost': 50, 'markup': 20}],
+        'blanks': [{'price': 10, 'quantity': 2, 'sum': 25}],
+    }
+    summary = calculation_summary(record)
+    assert summary['items_count'] == 2
+    assert summary['cost_price'] == 170
+    assert summary['total_price'] == 180 + 25 + 18
+    import_calculations(conn, [record])
+    row = conn.execute('SELECT cost_price, total_price, search_name FROM calculations').fetchone()
+    assert tuple(row) == (170, 223, 'фланец')
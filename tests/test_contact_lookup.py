@@ -0,0 +1,13 @@
+from backend.app.core.contact_lookup import LookupCache
+
+
+def test_put_is_ignored_after_clear_during_read():
+    cache = LookupCache(maxsize=10, ttl=60)
+    generation = cache.generation
+    # Запись зафиксирована и кэш очищен, пока читались старые строки
+    cache.clear()
+    cache.put(('phone', '79990000000'), ['stale'], generation)
+    assert cache.get(('phone', '79990000000')) is None
+
+    cache.put(('phone', '79990000000'), ['fresh'], cache.generation)
+    assert cache.get(('phone', '79990000000')) == ['fresh']
@@ -0,0 +1,90 @@
+import threading
+
+import pytest
+
+from backend.app.core.database import DatabaseManager, call_after_commit
+from backend.app.core.exceptions import AppException, NotFoundError
+
+
+@pytest.fixture
+def manager(tmp_path):
+    manager = DatabaseManager(str(tmp_path / 'test.db'))
+    with manager.get_connection() as conn:
+        conn.execute('CREATE TABLE items (name TEXT)')
+    yield manager
+    manager.close_all()
+
+
+def _names(manager):
+    with manager.get_connection() as conn:
+        return [row[0] for row in conn.execute('SELECT name FROM items ORDER BY rowid')]
+
+
+def test_nested_error_rolls_back_only_inner_block(manager):
+    with manager.get_connection() as conn:
+        conn.execute("INSERT INTO items VALUES ('outer')")
+        with pytest.raises(AppException) as error:
+            with manager.get_connection() as inner:
+                inner.execute("INSERT INTO items VALUES ('inner')")
+                raise ValueError('x')
+        conn.execute("INSERT INTO items VALUES ('after')")
+    assert _names(manager) == ['outer', 'after']
+    assert str(error.value) == 'Ошибка базы данных: x'
+
+
+def test_nested_error_is_wrapped_once(manager):
+    with pytest.raises(AppException) as error:
+        with manager.get_connection():
+            with manager.get_connection():
+                with manager.get_connection():
+                    raise ValueError('x')
+    assert str(error.value) == 'Ошибка базы данных: x'
+
+
+def test_app_exception_passes_through_and_rolls_back(manager):
+    with pytest.raises(NotFoundError):
+        with manager.get_connection() as conn:
+            conn.execute("INSERT INTO items VALUES ('lost')")
+            raise NotFoundError()
+    assert _names(manager) == []
+
+
+def test_nested_writes_commit_with_outer_block(manager):
+    with manager.get_connection() as conn:
+        with manager.get_connection() as inner:
+            inner.execute("INSERT INTO items VALUES ('inner')")
+        conn.execute('SELECT 1')
+    assert _names(manager) == ['inner']
+
+
+def test_pool_drops_connections_of_finished_threads(manager):
+    def work():
+        with manager.get_connection() as conn:
+            conn.execute('SELECT 1')
+
+    for _ in range(3):
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+    # Остаются соединение основного потока и последнего завершившегося
+    assert len(manager._pool) == 2
+
+
+def test_after_commit_callbacks_run_only_for_committed_work(manager):
+    calls = []
+    with manager.get_connection() as conn:
+        call_after_commit(conn, lambda: calls.append('outer'))
+        with pytest.raises(AppException):
+            with manager.get_connection() as inner:
+                call_after_commit(inner, lambda: calls.append('rolled back'))
+                raise ValueError('x')
+        with manager.get_connection() as inner:
+            call_after_commit(inner, lambda: calls.append('inner'))
+        assert calls == []
+    assert calls == ['outer', 'inner']
+
+    with pytest.raises(AppException):
+        with manager.get_connection() as conn:
+            call_after_commit(conn, lambda: calls.append('failed'))
+            raise ValueError('x')
+    assert calls == ['outer', 'inner']
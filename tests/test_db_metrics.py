@@ -0,0 +1,19 @@
+import sqlite3
+
+from backend.app.core.db_metrics import InstrumentedConnection, start_query_stats, stop_query_stats
+
+
+def test_cursor_queries_are_counted_once():
+    conn = sqlite3.connect(':memory:', factory=InstrumentedConnection)
+    stats, token = start_query_stats(slow_threshold=1.0)
+    try:
+        conn.execute('CREATE TABLE items (id INTEGER)')
+        conn.executemany('INSERT INTO items VALUES (?)', [(1,), (2,)])
+        cursor = conn.cursor()
+        cursor.execute('SELECT id FROM items WHERE id = 1')
+        cursor.executemany('INSERT INTO items VALUES (?)', [(3,)])
+    finally:
+        stop_query_stats(token)
+    assert stats.count == 4
+    assert stats.shapes['SELECT id FROM items WHERE id = ?'] == 1
+    assert stats.shapes['INSERT INTO items VALUES (?)'] == 2
@@ -0,0 +1,74 @@
+import pytest
+
+from backend.app.core import deal_search
+from backend.app.core.database import DatabaseManager
+from backend.app.core.migrations import apply_migrations
+from backend.app.services import deal_service as deal_module
+from backend.app.services import funnel_service as funnel_module
+
+
+@pytest.fixture
+def deals(tmp_path, monkeypatch):
+    db = DatabaseManager(str(tmp_path / 'crm.db'))
+    apply_migrations(db)
+    monkeypatch.setattr(deal_module, 'db_manager', db)
+    monkeypatch.setattr(funnel_module, 'db_manager', db)
+    funnel = funnel_module.FunnelService().create({'name': 'Продажи', 'is_default': True}, user_id=1)
+    service = deal_module.DealService()
+
+    def create(title, comments=()):
+        deal = service.create({
+            'title': title, 'funnel_id': funnel['id'], 'stage_id': funnel['stages'][0]['id'],
+        }, user_id=1)
+        for text in comments:
+            service.add_comment(deal['id'], text, user_id=1)
+        return deal
+
+    yield service, create
+    db.close_all()
+
+
+def test_deal_appears_once_by_best_document(deals):
+    service, create = deals
+    flange = create('Фланец Ду150', comments=['фланец уточнить', 'фланец под сварку'])
+    create('Втулка', comments=['к фланцу'])
+    hits, total, capped = service.search('фланец')
+    assert [hit['id'] for hit in hits] == [flange['id']]
+    assert hits[0]['matched_in'] == 'deal'
+    assert (total, capped) == (1, False)
+
+
+def test_pages_are_disjoint_and_total_is_exact(deals):
+    service, create = deals
+    for number in range(7):
+        create(f'Лист {number}', comments=['лист', 'лист горячекатаный'])
+    first, total, _ = service.search('лист', skip=0, limit=3)
+    second, _, _ = service.search('лист', skip=3, limit=3)
+    rest, _, _ = service.search('лист', skip=6, limit=3)
+    ids = [hit['id'] for hit in first + second + rest]
+    assert len(ids) == len(set(ids)) == 7
+    assert total == 7
+
+
+def test_total_is_capped(deals, monkeypatch):
+    service, create = deals
+    for number in range(5):
+        create(f'Труба {number}')
+    monkeypatch.setattr(deal_module.settings, 'deal_search_total_cap', 3)
+    hits, total, capped = service.search('труба', limit=2)
+    assert len(hits) == 2
+    assert (total, capped) == (3, True)
+
+
+def test_documents_of_missing_deals_are_skipped(deals):
+    service, create = deals
+    kept = create('Уголок')
+    orphan = create('Уголок равнополочный')
+    with deal_module.db_manager.get_connection() as conn:
+        # Сделка удалена в обход триггеров индекса (старые данные)
+        conn.execute("INSERT INTO deal_search (rowid, title, body, deal_id, kind) VALUES (999, 'уголок', '', 12345, 'deal')")
+        assert deal_search.count_matching_deals(conn, deal_search.build_match_query('уголок'), 10) == (2, False)
+    service.delete(orphan['id'], user_id=1)
+    hits, total, capped = service.search('уголок')
+    assert [hit['id'] for hit in hits] == [kept['id']]
+    assert (total, capped) == (1, False)
@@ -0,0 +1,16 @@
+from backend.app.core.database import DatabaseManager
+from backend.app.core.deal_stats import check_deal_stats
+from backend.app.core.migrations import apply_migrations
+from backend.app.services.contact_service import ContactService
+
+
+def test_legacy_contact_import_keeps_deal_stats_consistent(tmp_path):
+    db = DatabaseManager(str(tmp_path / 'crm.db'))
+    apply_migrations(db)
+    with db.get_connection() as conn:
+        ContactService().import_legacy(conn, [
+            {'first_name': 'Иван', 'last_name': 'Петров', 'deals_count': 5},
+        ])
+        assert conn.execute('SELECT deals_count FROM contacts').fetchone()[0] == 0
+        assert check_deal_stats(conn) == []
+    db.close_all()
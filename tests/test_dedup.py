@@ -0,0 +1,39 @@
+import pytest
+
+from backend.app.core.dedup import (
+    CUSTOMERS, build_blocks, candidate_pairs, merge_source_ids, name_tokens, score_pair,
+)
+
+
+def _customer(search_name, inn='', phones=(), emails=()):
+    return {
+        'name': search_name, 'tokens': name_tokens(search_name), 'inn': inn,
+        'company_id': None, 'phone': set(phones), 'email': set(emails),
+    }
+
+
+def test_blocks_pair_only_records_sharing_a_key():
+    records = {
+        1: _customer('ооо ромашка'),
+        2: _customer('ромашка ооо'),
+        3: _customer('ооо лютик', phones=['74951112233']),
+        4: _customer('ип лютиков', phones=['74951112233']),
+        5: _customer('ооо василек'),
+    }
+    assert candidate_pairs(build_blocks(records, with_tokens=False)) == {(1, 2), (3, 4)}
+
+
+def test_score_pair_inn_and_name():
+    same = score_pair(CUSTOMERS, _customer('ооо ромашка', '7707083893'), _customer('ромашка', '7707083893'))
+    assert same == (1.0, ['inn', 'name'])
+    conflict, matched = score_pair(CUSTOMERS, _customer('ооо ромашка', '7707083893'), _customer('ромашка', '7736050003'))
+    assert conflict < 0.6
+    assert matched == ['name']
+
+
+def test_merge_source_ids_validation():
+    assert merge_source_ids(1, [3, 2, 3]) == [3, 2]
+    with pytest.raises(ValueError):
+        merge_source_ids(1, [])
+    with pytest.raises(ValueError):
+        merge_source_ids(1, [1, 2])
@@ -0,0 +1,39 @@
+import threading
+
+from backend.app.core import migrations
+from backend.app.core.database import DatabaseManager
+
+
+def test_steps_applied_by_another_process_are_skipped(tmp_path, monkeypatch):
+    db = DatabaseManager(str(tmp_path / 'crm.db'))
+    assert migrations.apply_migrations(db) == len(migrations.MIGRATIONS)
+
+    # Процесс, прочитавший версию до того, как другой применил миграции
+    monkeypatch.setattr(migrations, 'get_current_version', lambda _: 0)
+    assert migrations.apply_migrations(db) == 0
+    db.close_all()
+
+
+def test_concurrent_startup_applies_each_step_once(tmp_path):
+    path = str(tmp_path / 'crm.db')
+    managers = [DatabaseManager(path) for _ in range(3)]
+    results, errors = [], []
+
+    def start(db):
+        try:
+            results.append(migrations.apply_migrations(db))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=start, args=(db,)) for db in managers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert sum(results) == len(migrations.MIGRATIONS)
+    with managers[0].get_connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM schema_version').fetchone()[0] == len(migrations.MIGRATIONS)
+    for db in managers:
+        db.close_all()
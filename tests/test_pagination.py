@@ -0,0 +1,32 @@
+import pytest
+
+from backend.app.utils.pagination import decode_cursor, encode_cursor, keyset_condition, split_page
+
+
+def test_cursor_roundtrip():
+    cursor = encode_cursor('amount', 'desc', 1500.5, 42)
+    assert decode_cursor(cursor, 'amount', 'desc') == (1500.5, 42)
+
+
+def test_cursor_rejects_other_sort():
+    cursor = encode_cursor('amount', 'desc', 10, 1)
+    with pytest.raises(ValueError):
+        decode_cursor(cursor, 'updated_at', 'desc')
+    with pytest.raises(ValueError):
+        decode_cursor('not-a-cursor', 'amount', 'desc')
+
+
+def test_keyset_condition_handles_null():
+    sql, params = keyset_condition('close_date', 'desc', None, 7)
+    assert sql == '(close_date IS NULL AND id < ?)'
+    assert params == [7]
+
+
+def test_split_page_returns_cursor_only_when_more_rows():
+    rows = [{'id': i, 'amount': i * 10} for i in range(4)]
+    page, cursor = split_page(rows, 3, 'amount', 'asc')
+    assert [r['id'] for r in page] == [0, 1, 2]
+    assert decode_cursor(cursor, 'amount', 'asc') == (20, 2)
+
+    page, cursor = split_page(rows[:3], 3, 'amount', 'asc')
+    assert cursor is None
@@ -0,0 +1,89 @@
+import json
+import sqlite3
+
+import pytest
+
+from backend.app.core import repricing
+from backend.app.core.calculation_refs import create_refs_table, find_calculations
+from backend.app.core.calculation_store import (
+    create_calculations_table, create_summary_columns, import_calculations, load_record,
+)
+from backend.app.core.database import DatabaseManager
+from backend.app.core.exceptions import AppException
+from backend.app.core.materials import MaterialCatalog
+from backend.app.core.repricing import RepricingWorker, apply_material_prices, load_lines, simulate
+from backend.app.utils.calculation_summary import calculation_summary
+
+
+def test_simulate_matches_recomputed_summary(tmp_path):
+    path = tmp_path / 'materials.json'
+    path.write_text(json.dumps({'prices_metal_materials': {
+        'Сталь': [{'id': 1, 'grade': 'Ст3', 'density': 7850, 'price': 100}],
+        'Медь': [{'id': 2, 'grade': 'М1', 'density': 8940, 'price': 900}],
+    }}, ensure_ascii=False), encoding='utf-8')
+    record = {
+        'name': 'Фланец', 'global_markup': 10,
+        'assortments': [
+            {'material': 'Сталь Ст3', 'weight': 2, 'quantity': 3, 'pricePerKg': 100, 'materialCost': 600, 'markup': 20},
+            {'material': 'Медь М1', 'weight': 1, 'quantity': 1, 'pricePerKg': 900, 'materialCost': 900},
+        ],
+        'blanks': [{'price': 10, 'quantity': 2, 'sum': 25}],
+    }
+    conn = sqlite3.connect(':memory:')
+    conn.row_factory = sqlite3.Row
+    create_calculations_table(conn)
+    create_summary_columns(conn)
+    create_refs_table(conn)
+    import_calculations(conn, [record, {'name': 'legacy', 'items': [{'materialCost': 5}]}])
+
+    lines = load_lines(conn, catalog=MaterialCatalog(str(path)))
+    result = simulate(lines, {1: 150})
+
+    record['assortments'][0]['materialCost'] = 900
+    assert len(lines.calc_ids) == 1
+    assert result['affected_items'].tolist() == [1]
+    assert result['new_cost_price'][0] == pytest.approx(calculation_summary(record)['cost_price'])
+    assert result['new_total_price'][0] == pytest.approx(calculation_summary(record)['total_price'])
+
+
+def test_apply_material_prices_updates_only_referenced_items():
+    conn = sqlite3.connect(':memory:')
+    conn.row_factory = sqlite3.Row
+    create_calculations_table(conn)
+    create_summary_columns(conn)
+    create_refs_table(conn)
+    steel = {'id': 'a', 'materialId': 1, 'weight': 2, 'quantity': 1, 'pricePerKg': 100, 'materialCost': 200,
+             'totalCost': 250, 'processingCost': 50, 'operations': [{'serviceId': 6, 'variantId': '6-0'}]}
+    copper = {'id': 'b', 'materialId': 2, 'weight': 1, 'quantity': 1, 'pricePerKg': 900, 'materialCost': 900}
+    import_calculations(conn, [{'id': 1, 'name': 'a', 'assortments': [steel, copper]},
+                               {'id': 2, 'name': 'b', 'assortments': [copper]}])
+    assert find_calculations(conn, 'material', [1]) == {1: ['a']}
+    assert find_calculations(conn, 'variant', ['6-0']) == {1: ['a']}
+
+    assert apply_material_prices(conn, {1: 150}) == [1]
+    item = load_record(conn, 1)['assortments'][0]
+    assert (item['pricePerKg'], item['materialCost'], item['totalCost']) == (150, 300, 350)
+    assert conn.execute('SELECT cost_price FROM calculations WHERE id = 1').fetchone()[0] == 1250
+    assert apply_material_prices(conn, {1: 150}) == []
+
+
+def test_failed_run_requeues_prices(tmp_path, monkeypatch):
+    db = DatabaseManager(str(tmp_path / 'crm.db'))
+    worker = RepricingWorker(db)
+    applied = []
+
+    def fail(conn, prices):
+        # Цена, пришедшая во время неудачной транзакции, новее возвращённой в очередь
+        worker._queue.put(({1: 170.0}, False))
+        raise sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(repricing, 'apply_material_prices', fail)
+    worker._queue.put(({1: 150.0}, False))
+    worker._queue.put(({1: 160.0, 2: 900.0}, False))
+    with pytest.raises(AppException):
+        worker.run_pending()
+
+    monkeypatch.setattr(repricing, 'apply_material_prices', lambda conn, prices: applied.append(prices) or [])
+    worker.run_pending()
+    assert applied == [{1: 170.0, 2: 900.0}]
+    db.close_all()
@@ -0,0 +1,141 @@
+import sqlite3
+
+import pytest
+
+from backend.app.core.database import PROPOSAL_MAPPER, USER_MAPPER, USER_WITH_PASSWORD_MAPPER
+from backend.app.core.row_mappers import RowMapper, column
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    conn.row_factory = sqlite3.Row
+    yield conn
+    conn.close()
+
+
+# Прежнее построение словарей в DatabaseManager (до RowMapper)
+def _legacy_user(row, with_password=False):
+    user = {
+        'id': row['id'],
+        'login': row['login'] if 'login' in row.keys() else row['username'],
+        'username': row['username'],
+        'full_name': row['full_name'] if 'full_name' in row.keys() and row['full_name'] is not None else '',
+        'email': row['email'],
+        'phone': row['phone'] if 'phone' in row.keys() and row['phone'] is not None else '',
+        'role': row['role'] if 'role' in row.keys() and row['role'] is not None else 'manager',
+    }
+    if with_password:
+        user['password_hash'] = row['password_hash']
+    user.update({
+        'is_admin': bool(row['is_admin']),
+        'is_active': bool(row['is_active']),
+        'created_at': row['created_at'],
+        'updated_at': row['updated_at'] if 'updated_at' in row.keys() and row['updated_at'] is not None else '',
+    })
+    return user
+
+
+def _legacy_proposal(row):
+    return {
+        'id': row['id'],
+        'user_id': row['user_id'],
+        'company': row['company'] if 'company' in row.keys() else '',
+        'productType': row['productType'],
+        'material': row['material'],
+        'materialGrade': row['materialGrade'],
+        'dimensions': row['dimensions'],
+        'selectedOperations': row['selectedOperations'],
+        'result': row['result'],
+        'created_at': row['created_at'],
+        'status': row['status'] if 'status' in row.keys() else '',
+        'priority': row['priority'] if 'priority' in row.keys() else '',
+    }
+
+
+def test_renames_and_defaults_for_null(conn):
+    mapper = RowMapper([
+        column('name', 'title', 'name'),
+        column('note', default='-', none_to_default=True),
+        column('raw', 'note'),
+        column('flag', convert=bool),
+        column('missing', default=0),
+    ])
+    conn.execute('CREATE TABLE t (name TEXT, note TEXT, flag INTEGER)')
+    conn.execute("INSERT INTO t VALUES ('a', NULL, 1)")
+
+    assert mapper.map_one(conn.execute('SELECT * FROM t')) == {
+        'name': 'a', 'note': '-', 'raw': None, 'flag': True, 'missing': 0,
+    }
+    # Первая существующая колонка-источник имеет приоритет
+    cursor = conn.execute("SELECT 'b' AS title, name, note, flag FROM t")
+    assert mapper.map_one(cursor)['name'] == 'b'
+    assert mapper.map_one(conn.execute('SELECT * FROM t WHERE 0')) is None
+
+
+def test_compiled_mapper_is_reused_for_same_columns(conn):
+    mapper = RowMapper([column('id'), column('name', default='')])
+    conn.execute('CREATE TABLE t (id INTEGER, name TEXT)')
+    conn.executemany('INSERT INTO t VALUES (?, ?)', [(1, 'a'), (2, 'b')])
+
+    first = mapper.for_cursor(conn.execute('SELECT * FROM t'))
+    assert mapper.for_cursor(conn.execute('SELECT id, name FROM t WHERE id = 2')) is first
+    assert mapper.map_all(conn.execute('SELECT * FROM t')) == [{'id': 1, 'name': 'a'}, {'id': 2, 'name': 'b'}]
+    assert len(mapper._compiled) == 1
+
+    other = mapper.for_cursor(conn.execute('SELECT id FROM t'))
+    assert other is not first
+    assert len(mapper._compiled) == 2
+
+
+_OLD_USERS = (
+    'CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT, email TEXT, password_hash TEXT, '
+    'is_admin BOOLEAN, is_active BOOLEAN, created_at TIMESTAMP)'
+)
+_NEW_USERS = (
+    'CREATE TABLE users (id INTEGER PRIMARY KEY, login TEXT, username TEXT, full_name TEXT, email TEXT, '
+    'phone TEXT, role TEXT, password_hash TEXT, is_admin BOOLEAN, is_active BOOLEAN, '
+    'created_at TIMESTAMP, updated_at TIMESTAMP)'
+)
+
+
+@pytest.mark.parametrize('schema, rows', [
+    (_OLD_USERS, [
+        (1, 'ivan', 'ivan@example.com', 'hash', 1, 1, '2024-01-01'),
+        (2, 'olga', None, 'hash', 0, 0, None),
+    ]),
+    (_NEW_USERS, [
+        (1, 'ivan', 'ivan', 'Иван', 'ivan@example.com', '+7', 'admin', 'hash', 1, 1, '2024-01-01', '2024-02-01'),
+        (2, 'olga', 'olga', None, None, None, None, 'hash', 0, 0, None, None),
+    ]),
+])
+def test_user_mappers_match_legacy_dicts(conn, schema, rows):
+    conn.execute(schema)
+    placeholders = ', '.join('?' for _ in rows[0])
+    conn.executemany(f'INSERT INTO users VALUES ({placeholders})', rows)
+
+    expected = [_legacy_user(row) for row in conn.execute('SELECT * FROM users ORDER BY id')]
+    assert USER_MAPPER.map_all(conn.execute('SELECT * FROM users ORDER BY id')) == expected
+
+    for user_id in (1, 2):
+        row = conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+        mapped = USER_WITH_PASSWORD_MAPPER.map_one(conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)))
+        assert mapped == _legacy_user(row, with_password=True)
+        assert list(mapped) == list(_legacy_user(row, with_password=True))
+
+
+@pytest.mark.parametrize('extra_columns, extra_values', [
+    ('', ()),
+    (', company TEXT, status TEXT, priority TEXT', ('ООО Металл', 'new', None)),
+])
+def test_proposal_mapper_matches_legacy_dicts(conn, extra_columns, extra_values):
+    conn.execute(
+        'CREATE TABLE proposals (id INTEGER PRIMARY KEY, user_id INTEGER, productType TEXT, material TEXT, '
+        'materialGrade TEXT, dimensions TEXT, selectedOperations TEXT, result TEXT, created_at TIMESTAMP'
+        f'{extra_columns})'
+    )
+    values = (1, 7, 'Лист', 'Сталь', 'Ст3', '{}', '[]', '{"total": 1}', '2024-01-01') + extra_values
+    conn.execute(f"INSERT INTO proposals VALUES ({', '.join('?' for _ in values)})", values)
+
+    row = conn.execute('SELECT * FROM proposals').fetchone()
+    assert PROPOSAL_MAPPER.map_all(conn.execute('SELECT * FROM proposals')) == [_legacy_proposal(row)]
@@ -0,0 +1,22 @@
+from backend.app.core.name_search import search_condition
+from backend.app.utils.search_keys import join_keys, normalize_phone, normalize_text
+
+
+def test_normalize_text_folds_cyrillic():
+    assert normalize_text('ООО «Ёлка-Металл»') == 'ооо елка металл'
+    assert join_keys(['Ёлкин', None, 'Пётр']) == 'елкин петр'
+
+
+def test_normalize_phone_keeps_digits():
+    assert normalize_phone('8 (912) 345-67-89') == '79123456789'
+    assert normalize_phone('+7 912 345 67 89') == '79123456789'
+    assert normalize_phone(None) == ''
+
+
+def test_search_condition_short_query_uses_prefix():
+    sql, params = search_condition('contacts', 'Ёл')
+    assert 'search_name >= ?' in sql
+    assert params[0] == 'ел'
+    sql, params = search_condition('contacts', '+7 912')
+    assert 'MATCH' in sql
+    assert 'search_phone : "7912"' in params[0]
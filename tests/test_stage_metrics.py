@@ -0,0 +1,100 @@
+import pytest
+
+from backend.app.core import stage_metrics
+from backend.app.core.database import DatabaseManager
+from backend.app.core.migrations import apply_migrations
+from backend.app.services import deal_service as deal_module
+from backend.app.services import funnel_service as funnel_module
+
+
+@pytest.fixture
+def services(tmp_path, monkeypatch):
+    db = DatabaseManager(str(tmp_path / 'crm.db'))
+    apply_migrations(db)
+    monkeypatch.setattr(deal_module, 'db_manager', db)
+    monkeypatch.setattr(funnel_module, 'db_manager', db)
+    funnels = funnel_module.FunnelService()
+    funnel = funnels.create({'name': 'Продажи', 'is_default': True}, user_id=1)
+    yield db, funnels, deal_module.DealService(), funnel
+    db.close_all()
+
+
+def _mismatches(db):
+    with db.get_connection() as conn:
+        return stage_metrics.check_stage_metrics(conn)
+
+
+def _create_deal(deals, funnel, stage, amount=0):
+    return deals.create({
+        'title': 'Сделка', 'funnel_id': funnel['id'], 'stage_id': stage['id'], 'amount': amount,
+    }, user_id=1)
+
+
+def test_product_changes_keep_stage_totals(services):
+    db, _, deals, funnel = services
+    first, second = funnel['stages'][:2]
+    deal = _create_deal(deals, funnel, first)
+    product = deals.add_product(deal['id'], {'name': 'Лист', 'price': 100, 'quantity': 3}, user_id=1)
+    assert _mismatches(db) == []
+
+    deals.move_to_stage(deal['id'], second['id'], user_id=1)
+    assert _mismatches(db) == []
+
+    deals.remove_product(deal['id'], product['id'])
+    assert _mismatches(db) == []
+
+
+def test_delete_stage_moves_metrics_to_first_stage(services):
+    db, funnels, deals, funnel = services
+    first, second = funnel['stages'][:2]
+    for amount in (10, 20):
+        _create_deal(deals, funnel, first, amount)
+    for amount in (30, 40, 50):
+        _create_deal(deals, funnel, second, amount)
+
+    assert funnels.delete_stage(funnel['id'], second['id'], user_id=1)
+    assert _mismatches(db) == []
+    with db.get_connection() as conn:
+        row = conn.execute(
+            'SELECT deals_count, total_amount, entered_count FROM stage_metrics WHERE stage_id = ?', (first['id'],)
+        ).fetchone()
+    assert tuple(row) == (5, 150.0, 5)
+
+
+def test_delete_first_stage_moves_deals_to_next_one(services):
+    db, funnels, deals, funnel = services
+    first, second = funnel['stages'][:2]
+    _create_deal(deals, funnel, first, 10)
+
+    assert funnels.delete_stage(funnel['id'], first['id'], user_id=1)
+    assert _mismatches(db) == []
+    with db.get_connection() as conn:
+        assert conn.execute('SELECT stage_id FROM deals').fetchone()[0] == second['id']
+
+
+def test_delete_stage_of_other_funnel_changes_nothing(services):
+    db, funnels, deals, funnel = services
+    other = funnels.create({'name': 'Закупки', 'is_default': True}, user_id=1)
+    first, second = other['stages'][:2]
+    _create_deal(deals, other, second, 10)
+
+    assert not funnels.delete_stage(funnel['id'], second['id'], user_id=1)
+    assert _mismatches(db) == []
+    with db.get_connection() as conn:
+        assert tuple(conn.execute('SELECT funnel_id, stage_id FROM deals').fetchone()) == (other['id'], second['id'])
+        assert conn.execute('SELECT COUNT(*) FROM deal_stages WHERE id = ?', (second['id'],)).fetchone()[0] == 1
+
+
+def test_rebuild_matches_counters_after_delete_stage(services):
+    db, funnels, deals, funnel = services
+    first, second, third = funnel['stages'][:3]
+    _create_deal(deals, funnel, first, 10)
+    _create_deal(deals, funnel, second, 20)
+    assert funnels.delete_stage(funnel['id'], first['id'], user_id=1)
+
+    query = 'SELECT stage_id, deals_count, entered_count, exited_count, advanced_count FROM stage_metrics ORDER BY stage_id'
+    with db.get_connection() as conn:
+        incremental = [tuple(row) for row in conn.execute(query)]
+        stage_metrics.rebuild_stage_metrics(conn)
+        rebuilt = [tuple(row) for row in conn.execute(query)]
+    assert incremental == rebuilt